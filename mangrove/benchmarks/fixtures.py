@@ -0,0 +1,268 @@
+"""
+Generated questionnaires, data senders, subjects and message corpora for the submission benchmarks.
+Answers are drawn from a random.Random the caller seeds, so two runs with the same seed send the same messages.
+"""
+import StringIO
+import csv
+
+import xlwt
+from openpyxl import Workbook
+
+from mangrove.datastore.entity import create_contact, create_entity
+from mangrove.form_model.field import TextField, IntegerField, SelectField, DateField, UniqueIdField, FieldSet
+from mangrove.form_model.form_model import FormModel, NAME_FIELD, MOBILE_NUMBER_FIELD, REGISTRATION_FORM_CODE, \
+    ENTITY_TYPE_FIELD_CODE, NAME_FIELD_CODE, LOCATION_TYPE_FIELD_CODE, GEO_CODE, MOBILE_NUMBER_FIELD_CODE
+from mangrove.form_model.validation import NumericRangeConstraint, TextLengthConstraint
+from mangrove.transport.repository.reporters import REPORTER_ENTITY_TYPE
+
+SUBJECT_TYPE = ['clinic']
+DATA_SENDER_CODE_PREFIX = 'bds'
+SUBJECT_CODE_PREFIX = 'bcl'
+
+# A flat questionnaire answers a subject, text, integer, single and multiple select and date question. A repeat
+# questionnaire adds a repeat of two questions, an xform questionnaire is a repeat questionnaire with an xform.
+FLAT = 'flat'
+REPEAT = 'repeat'
+XFORM = 'xform'
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet']
+LOCATIONS = ['antananarivo', 'toamasina', 'mahajanga', 'fianarantsoa', 'toliara']
+COLOURS = [('red', 'a'), ('green', 'b'), ('blue', 'c')]
+SYMPTOMS = [('fever', 'a'), ('cough', 'b'), ('rash', 'c'), ('headache', 'd')]
+BULK_SAVE_SIZE = 1000
+
+
+class LocationTree(object):
+    """
+    A fixed location hierarchy for registrations, standing in for the geo registry.
+    """
+
+    def get_location_hierarchy_for_geocode(self, lat, long):
+        return [u'madagascar']
+
+    def get_centroid(self, location_name, level):
+        return 47.5, -18.9
+
+    def get_location_hierarchy(self, lowest_level_location_name):
+        return [lowest_level_location_name, u'madagascar']
+
+
+def questionnaire_fields(kind):
+    fields = [UniqueIdField(SUBJECT_TYPE[0], name='subject', code='q1', label='Which clinic is this about?'),
+              TextField(name='reporter_note', code='q2', label='Note', constraints=[TextLengthConstraint(max=40)]),
+              IntegerField(name='patients', code='q3', label='How many patients?',
+                           constraints=[NumericRangeConstraint(min=0, max=1000)]),
+              SelectField(name='colour', code='q4', label='Colour code', options=COLOURS),
+              SelectField(name='symptoms', code='q5', label='Symptoms seen', options=SYMPTOMS,
+                          single_select_flag=False),
+              DateField(name='visit_date', code='q6', label='Date of visit', date_format='dd.mm.yyyy')]
+    if kind in (REPEAT, XFORM):
+        fields.append(FieldSet(name='treatments', code='q7', label='Treatments', fieldset_type='repeat',
+                               field_set=[TextField(name='drug', code='q8', label='Drug', parent_field_code='q7'),
+                                          IntegerField(name='dose', code='q9', label='Dose', parent_field_code='q7',
+                                                       constraints=[NumericRangeConstraint(min=1, max=10)])]))
+    return fields
+
+
+def create_questionnaires(dbm, count, kind):
+    """
+    Saves count questionnaires of the given kind and returns them. Their form codes are the kind and a number.
+    """
+    questionnaires = []
+    for index in range(count):
+        form_code = '%s%03d' % (kind, index)
+        form_model = FormModel(dbm, name='benchmark %s' % form_code, label='Benchmark %s' % form_code,
+                               form_code=form_code, fields=questionnaire_fields(kind))
+        if kind == XFORM:
+            form_model.xform = _xform(form_code, form_model.fields)
+        form_model.save()
+        questionnaires.append(form_model)
+    return questionnaires
+
+
+def _xform(form_code, fields):
+    # Just enough of an XForm for the form model to be xform backed; submissions do not read it.
+    instance = ''.join('<%s/>' % field.code for field in fields)
+    binds = ''.join('<bind nodeset="/%s/%s" type="%s"/>' % (form_code, field.code, field.type) for field in fields)
+    inputs = ''.join('<input ref="/%s/%s"><label>%s</label></input>' % (form_code, field.code, field.label)
+                     for field in fields)
+    return ('<html xmlns="http://www.w3.org/2002/xforms" xmlns:html="http://www.w3.org/1999/xhtml">'
+            '<html:head><html:title>%(code)s</html:title><model><instance><%(code)s id="%(code)s">%(instance)s'
+            '<form_code>%(code)s</form_code></%(code)s></instance>%(binds)s</model></html:head>'
+            '<html:body>%(inputs)s</html:body></html>' %
+            dict(code=form_code, instance=instance, binds=binds, inputs=inputs))
+
+
+def data_sender_mobile_number(index):
+    return '26134%07d' % index
+
+
+def create_data_senders(dbm, count):
+    """
+    Saves count data senders with their mobile numbers and returns their short codes.
+    """
+    short_codes = []
+    documents = []
+    for index in range(count):
+        short_code = '%s%d' % (DATA_SENDER_CODE_PREFIX, index)
+        contact = create_contact(dbm, short_code, location=[LOCATIONS[index % len(LOCATIONS)]], validate=False)
+        contact.set_latest_data([(NAME_FIELD, 'sender %d' % index),
+                                 (MOBILE_NUMBER_FIELD, data_sender_mobile_number(index))])
+        documents.append(contact._doc)
+        short_codes.append(short_code)
+    _save(dbm, documents)
+    return short_codes
+
+
+def create_subjects(dbm, count):
+    """
+    Saves count subjects of SUBJECT_TYPE and returns their short codes.
+    """
+    short_codes = []
+    documents = []
+    for index in range(count):
+        short_code = '%s%d' % (SUBJECT_CODE_PREFIX, index)
+        entity = create_entity(dbm, SUBJECT_TYPE, short_code, location=[LOCATIONS[index % len(LOCATIONS)]],
+                               validate=False)
+        entity.set_latest_data([(NAME_FIELD, 'clinic %d' % index)])
+        documents.append(entity._doc)
+        short_codes.append(short_code)
+    _save(dbm, documents)
+    return short_codes
+
+
+def _save(dbm, documents):
+    for start in range(0, len(documents), BULK_SAVE_SIZE):
+        dbm._save_documents(documents[start:start + BULK_SAVE_SIZE])
+
+
+def answers(rng, fields, subjects, invalid=False, xform=False):
+    """
+    Returns {code: answer} for fields as a data sender would type them. xform answers use the ODK formats.
+    An invalid submission answers the integer question with a word.
+    """
+    values = {}
+    for field in fields:
+        if isinstance(field, UniqueIdField):
+            values[field.code] = rng.choice(subjects)
+        elif isinstance(field, IntegerField):
+            constraint = field.constraints[0]
+            values[field.code] = rng.choice(WORDS) if invalid else str(
+                rng.randint(int(constraint.min), int(constraint.max)))
+        elif isinstance(field, SelectField):
+            options = [option['val'] for option in field.options]
+            if field.single_select_flag:
+                values[field.code] = rng.choice(options)
+            else:
+                chosen = sorted(rng.sample(options, rng.randint(1, len(options))))
+                values[field.code] = (' ' if xform else '').join(chosen)
+        elif isinstance(field, DateField):
+            day, month, year = rng.randint(1, 28), rng.randint(1, 12), rng.randint(2010, 2015)
+            values[field.code] = '%04d-%02d-%02d' % (year, month, day) if xform else '%02d.%02d.%04d' % (
+                day, month, year)
+        elif isinstance(field, FieldSet):
+            values[field.code] = [answers(rng, field.fields, subjects, xform=xform)
+                                  for repeat in range(rng.randint(1, 3))]
+        elif isinstance(field, TextField):
+            values[field.code] = rng.choice(WORDS)
+    return values
+
+
+def _is_invalid(rng, error_rate):
+    return rng.random() < error_rate
+
+
+def sms_corpus(rng, questionnaires, subjects, mobile_numbers, count, error_rate=0.0):
+    """
+    Returns count (mobile number, message) pairs in the ordered SMS format, e.g. 'flat000 bcl3 echo 12 a ab
+    03.04.2012'.
+    """
+    messages = []
+    for index in range(count):
+        form_model = rng.choice(questionnaires)
+        values = answers(rng, form_model.fields, subjects, _is_invalid(rng, error_rate))
+        message = ' '.join([form_model.form_code] + [values[field.code] for field in form_model.fields])
+        messages.append((rng.choice(mobile_numbers), message))
+    return messages
+
+
+def web_corpus(rng, questionnaires, subjects, data_senders, count, error_rate=0.0):
+    """
+    Returns count (data sender, web form post) pairs. A post is {'form_code': ..., code: answer}.
+    """
+    messages = []
+    for index in range(count):
+        form_model = rng.choice(questionnaires)
+        values = answers(rng, form_model.fields, subjects, _is_invalid(rng, error_rate))
+        values['form_code'] = form_model.form_code
+        messages.append((rng.choice(data_senders), values))
+    return messages
+
+
+def xform_corpus(rng, questionnaires, subjects, data_senders, count, error_rate=0.0):
+    """
+    Returns count (data sender, ODK Collect submission document) pairs.
+    """
+    messages = []
+    for index in range(count):
+        form_model = rng.choice(questionnaires)
+        values = answers(rng, form_model.fields, subjects, _is_invalid(rng, error_rate), xform=True)
+        message = '<%(code)s>%(answers)s<form_code>%(code)s</form_code></%(code)s>' % dict(
+            code=form_model.form_code, answers=_xml_answers(form_model.fields, values))
+        messages.append((rng.choice(data_senders), message))
+    return messages
+
+
+def _xml_answers(fields, values):
+    elements = []
+    for field in fields:
+        if isinstance(field, FieldSet):
+            elements.extend('<%s>%s</%s>' % (field.code, _xml_answers(field.fields, repeat), field.code)
+                            for repeat in values[field.code])
+        else:
+            elements.append('<%s>%s</%s>' % (field.code, values[field.code], field.code))
+    return ''.join(elements)
+
+
+REGISTRATION_HEADER = ['form_code', ENTITY_TYPE_FIELD_CODE, NAME_FIELD_CODE, LOCATION_TYPE_FIELD_CODE, GEO_CODE,
+                       MOBILE_NUMBER_FIELD_CODE]
+
+
+def registration_rows(rng, count, first_mobile_number_index):
+    """
+    Returns count data sender registration rows, the header first, for the spreadsheet imports. The mobile
+    numbers follow those of the seeded data senders.
+    """
+    rows = [REGISTRATION_HEADER]
+    for index in range(count):
+        rows.append([REGISTRATION_FORM_CODE, REPORTER_ENTITY_TYPE[0], 'imported %s' % rng.choice(WORDS),
+                     rng.choice(LOCATIONS), '%.4f %.4f' % (rng.uniform(-25, -12), rng.uniform(43, 50)),
+                     data_sender_mobile_number(first_mobile_number_index + index)])
+    return rows
+
+
+def csv_payload(rows):
+    output = StringIO.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue()
+
+
+def xls_payload(rows):
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet('data')
+    for row_number, row in enumerate(rows):
+        for column, value in enumerate(row):
+            sheet.write(row_number, column, value)
+    output = StringIO.StringIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def xlsx_payload(rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    output = StringIO.StringIO()
+    workbook.save(output)
+    return output.getvalue()
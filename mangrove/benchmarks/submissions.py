@@ -0,0 +1,347 @@
+"""
+End-to-end submission throughput benchmarks. Every scenario sends a generated corpus through one channel:
+
+    sms     SMSPlayerV2, ordered SMS for flat questionnaires
+    web     WebPlayerV2, form posts for flat questionnaires
+    xforms  XFormPlayerV2, ODK submissions for repeat questionnaires with and without an xform
+    csv, xls, xlsx
+            the spreadsheet parsers and BulkImportService, data sender registrations
+
+and reports messages per second, p50/p99 latency and where the time went: parsing, each kind of database call
+and the rest, as well as the time of each submission stage timed by the players and SurveyResponseService. Results are written as JSON; pass the file of an earlier run as --baseline to compare against it.
+
+    python -m mangrove.benchmarks.submissions --messages 2000 --output results.json
+    python -m mangrove.benchmarks.submissions --baseline results.json --output next.json
+
+The database is in memory by default, so the numbers measure mangrove itself. --server http://localhost:5984/
+runs against CouchDB instead.
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import StringIO
+import sys
+import time
+from datetime import datetime
+
+from mangrove.benchmarks import fixtures
+from mangrove.bootstrap import initializer
+from mangrove.datastore import settings
+from mangrove.datastore.database import DatabaseManager
+from mangrove.datastore.entity_type import define_type
+from mangrove.datastore.memory import MEMORY_SERVER_URL
+from mangrove.datastore.metrics import InMemoryMetrics
+from mangrove.errors.MangroveException import MangroveException
+from mangrove.transport.contract.request import Request
+from mangrove.transport.contract.transport_info import TransportInfo, Channel
+from mangrove.transport.player.new_players import SMSPlayerV2, WebPlayerV2, XFormPlayerV2
+from mangrove.transport.player.parser import CsvParser, XlsParser, XlsxParser
+from mangrove.transport.services.bulk_import_service import BulkImportService
+from mangrove.transport.services.stage_timer import STAGE
+
+SCENARIOS = [Channel.SMS, Channel.WEB, Channel.XFORMS, Channel.CSV, Channel.XLS, Channel.XLSX]
+SPREADSHEET_PARSERS = {Channel.CSV: CsvParser, Channel.XLS: XlsParser, Channel.XLSX: XlsxParser}
+SPREADSHEET_PAYLOADS = {Channel.CSV: fixtures.csv_payload, Channel.XLS: fixtures.xls_payload,
+                        Channel.XLSX: fixtures.xlsx_payload}
+IMPORT_BATCH_SIZE = 100
+DESTINATION = '5678'
+# a scenario regresses when its throughput drops, or its p99 latency grows, by more than this fraction
+REGRESSION_THRESHOLD = 0.1
+
+logger = logging.getLogger('mangrove.benchmarks')
+
+
+class ExclusiveTimer(object):
+    """
+    Adds up the time spent in the calls it wraps, less the database calls made meanwhile, which the database
+    stages count already. Its record method is registered as a metrics exporter for one scenario. The players'
+    own ('stage', 'parse') timings include those database calls, so they are reported with the submission stages.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self._database_seconds = 0.0
+        self._depth = 0
+
+    def record(self, measurement):
+        if self._depth:
+            self._database_seconds += measurement.seconds
+
+    def wrap(self, function):
+        def timed(*args, **kwargs):
+            self._depth += 1
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds += time.time() - start
+                self._depth -= 1
+        return timed
+
+    @property
+    def exclusive_seconds(self):
+        return self.seconds - self._database_seconds
+
+
+def percentile(values, percent):
+    """
+    Returns the nearest-rank percentile of values, None when there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(percent / 100.0 * len(ordered))) - 1)]
+
+
+def summarize(messages, failures, seconds, latencies, parse_seconds, database_calls, latency_unit='message'):
+    """
+    Builds the result of one scenario. database_calls is a metrics snapshot, {(operation, name): stats}; the
+    submission stages in it include database calls, so they are reported apart.
+    """
+    submission_stages = dict((name, stats['seconds']) for (operation, name), stats in database_calls.items()
+                             if operation == STAGE)
+    database_calls = dict((key, stats) for key, stats in database_calls.items() if key[0] != STAGE)
+    stages = {'parse': parse_seconds}
+    for (operation, name), stats in database_calls.items():
+        stages[operation] = stages.get(operation, 0.0) + stats['seconds']
+    # parallel imports spend more time in the database than passes on the clock
+    stages['other'] = max(0.0, seconds - sum(stages.values()))
+    return {
+        'messages': messages,
+        'failures': failures,
+        'seconds': seconds,
+        'messages_per_second': messages / seconds if seconds else None,
+        'latency': {'unit': latency_unit, 'p50': percentile(latencies, 50), 'p99': percentile(latencies, 99),
+                    'max': max(latencies) if latencies else None,
+                    'mean': sum(latencies) / len(latencies) if latencies else None},
+        'stages': stages,
+        'submission_stages': submission_stages,
+        'database_calls': dict(('%s/%s' % key, {'calls': stats['calls'], 'seconds': stats['seconds']})
+                               for key, stats in database_calls.items()),
+    }
+
+
+class SubmissionBenchmark(object):
+    def __init__(self, server=MEMORY_SERVER_URL, database='mangrove-benchmark', seed=0):
+        self.server = server
+        self.database = database
+        self.random = random.Random(seed)
+        self.metrics = InMemoryMetrics()
+        self.manager = None
+        self._stage_timing = settings.STAGE_TIMING
+        self.mobile_numbers = []
+        self.data_senders = []
+        self.subjects = []
+        self.questionnaires = {}
+
+    def setup(self, questionnaires=3, data_senders=100, subjects=500):
+        # time the submission stages; the histograms go to self.metrics with the database calls
+        settings.STAGE_TIMING = True
+        self.manager = self._fresh_db_manager()
+        initializer.run(self.manager)
+        define_type(self.manager, fixtures.SUBJECT_TYPE)
+        self.data_senders = fixtures.create_data_senders(self.manager, data_senders)
+        self.mobile_numbers = [fixtures.data_sender_mobile_number(index) for index in range(data_senders)]
+        self.subjects = fixtures.create_subjects(self.manager, subjects)
+        for kind in (fixtures.FLAT, fixtures.REPEAT, fixtures.XFORM):
+            self.questionnaires[kind] = fixtures.create_questionnaires(self.manager, questionnaires, kind)
+
+    def _fresh_db_manager(self):
+        manager = DatabaseManager(settings.COUCHDB_CREDENTIALS, self.server, self.database, metrics=self.metrics)
+        del manager.server[self.database]
+        return DatabaseManager(settings.COUCHDB_CREDENTIALS, self.server, self.database, metrics=self.metrics)
+
+    def teardown(self):
+        settings.STAGE_TIMING = self._stage_timing
+        if self.manager is not None and self.database in self.manager.server:
+            del self.manager.server[self.database]
+        self.manager = None
+
+    def run(self, scenarios=SCENARIOS, messages=1000, error_rate=0.05):
+        """
+        Runs the scenarios one after the other on the same database and returns {scenario: result}.
+        """
+        results = {}
+        for index, scenario in enumerate(scenarios):
+            if scenario in SPREADSHEET_PARSERS:
+                # every import registers new data senders, with numbers after the seeded ones and earlier imports
+                first_number = len(self.mobile_numbers) + index * messages
+                results[scenario] = self.run_spreadsheet_import(scenario, messages, first_number)
+            else:
+                results[scenario] = getattr(self, 'run_%s' % scenario)(messages, error_rate)
+            logger.info("%s: %.1f messages/sec" % (scenario, results[scenario]['messages_per_second'] or 0))
+        return results
+
+    def run_sms(self, messages, error_rate):
+        corpus = fixtures.sms_corpus(self.random, self.questionnaires[fixtures.FLAT], self.subjects,
+                                     self.mobile_numbers, messages, error_rate)
+        player = SMSPlayerV2(self.manager, [])
+        parse = self._timed_parse(player)
+        return self._run_messages(corpus, lambda (source, message): player.add_survey_response(
+            Request(message=message, transportInfo=TransportInfo(Channel.SMS, source, DESTINATION))), parse)
+
+    def run_web(self, messages, error_rate):
+        corpus = fixtures.web_corpus(self.random, self.questionnaires[fixtures.FLAT], self.subjects,
+                                     self.data_senders, messages, error_rate)
+        player = WebPlayerV2(self.manager)
+        parse = self._timed_parse(player)
+        return self._run_messages(corpus, lambda (data_sender, message): player.add_survey_response(
+            Request(message=message, transportInfo=TransportInfo(Channel.WEB, data_sender, DESTINATION)),
+            data_sender), parse)
+
+    def run_xforms(self, messages, error_rate):
+        corpus = fixtures.xform_corpus(self.random,
+                                       self.questionnaires[fixtures.REPEAT] + self.questionnaires[fixtures.XFORM],
+                                       self.subjects, self.data_senders, messages, error_rate)
+        player = XFormPlayerV2(self.manager)
+        parse = self._timed_parse(player)
+        return self._run_messages(corpus, lambda (data_sender, message): player.add_survey_response(
+            Request(message=message, transportInfo=TransportInfo(Channel.XFORMS, data_sender, DESTINATION)),
+            data_sender), parse)
+
+    def _timed_parse(self, player):
+        parse = ExclusiveTimer()
+        self.metrics.add_exporter(parse.record)
+        player._parse = parse.wrap(player._parse)
+        return parse
+
+    def _run_messages(self, corpus, submit, parse):
+        self.metrics.reset()
+        latencies = []
+        failures = 0
+        start = time.time()
+        try:
+            for message in corpus:
+                message_start = time.time()
+                try:
+                    failures += 0 if submit(message).success else 1
+                except MangroveException:
+                    failures += 1
+                latencies.append(time.time() - message_start)
+        finally:
+            self.metrics.remove_exporter(parse.record)
+        seconds = time.time() - start
+        return summarize(len(corpus), failures, seconds, latencies, parse.exclusive_seconds, self.metrics.snapshot())
+
+    def run_spreadsheet_import(self, scenario, rows, first_mobile_number_index):
+        payload = SPREADSHEET_PAYLOADS[scenario](fixtures.registration_rows(self.random, rows,
+                                                                            first_mobile_number_index))
+        self.metrics.reset()
+        start = time.time()
+        parsed = list(self._parse_spreadsheet(scenario, payload))
+        parse_seconds = time.time() - start
+        service = BulkImportService(self.manager, fixtures.LocationTree(), batch_size=IMPORT_BATCH_SIZE)
+        latencies = []
+        failures = 0
+        for batch_start in range(0, len(parsed), IMPORT_BATCH_SIZE):
+            batch_started = time.time()
+            report = service.import_rows(parsed[batch_start:batch_start + IMPORT_BATCH_SIZE])
+            latencies.append(time.time() - batch_started)
+            failures += report.rows - report.successful_rows
+        seconds = time.time() - start
+        return summarize(len(parsed), failures, seconds, latencies, parse_seconds, self.metrics.snapshot(),
+                         latency_unit='batch of %d' % IMPORT_BATCH_SIZE)
+
+    def _parse_spreadsheet(self, scenario, payload):
+        rows = SPREADSHEET_PARSERS[scenario]().iter_parse(StringIO.StringIO(payload))
+        if scenario != Channel.XLSX:
+            return rows
+        return self._xlsx_submissions(rows)
+
+    def _xlsx_submissions(self, rows):
+        # XlsxParser yields bare rows, the header first
+        header = [column.lower() for column in next(rows)]
+        for row in rows:
+            values = dict(zip(header, row))
+            yield values.pop(header[0]).lower(), values
+
+
+def run_benchmarks(options):
+    benchmark = SubmissionBenchmark(options.server, options.database, options.seed)
+    benchmark.setup(options.questionnaires, options.data_senders, options.subjects)
+    try:
+        scenarios = benchmark.run(options.scenarios, options.messages, options.error_rate)
+    finally:
+        benchmark.teardown()
+    return {
+        'created': datetime.utcnow().isoformat(),
+        'server': options.server,
+        'parameters': {'messages': options.messages, 'questionnaires': options.questionnaires,
+                       'data_senders': options.data_senders, 'subjects': options.subjects,
+                       'error_rate': options.error_rate, 'seed': options.seed},
+        'scenarios': scenarios,
+    }
+
+
+def regressions(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Returns (scenario, measure, baseline value, current value) for every scenario slower than in baseline.
+    """
+    found = []
+    for scenario, current in sorted(results['scenarios'].items()):
+        previous = baseline['scenarios'].get(scenario)
+        if previous is None:
+            continue
+        if current['messages_per_second'] < previous['messages_per_second'] * (1 - threshold):
+            found.append((scenario, 'messages_per_second', previous['messages_per_second'],
+                          current['messages_per_second']))
+        if current['latency']['p99'] > previous['latency']['p99'] * (1 + threshold):
+            found.append((scenario, 'p99', previous['latency']['p99'], current['latency']['p99']))
+    return found
+
+
+def print_results(results, baseline=None):
+    print "%-8s %10s %10s %10s %9s  %s" % ("scenario", "msgs/sec", "p50 ms", "p99 ms", "failures", "stages (s)")
+    for scenario, result in sorted(results['scenarios'].items()):
+        stages = ", ".join("%s %.2f" % stage for stage in sorted(result['stages'].items(), key=lambda item: -item[1]))
+        print "%-8s %10.1f %10.1f %10.1f %9d  %s" % (scenario, result['messages_per_second'] or 0,
+                                                    _milliseconds(result['latency']['p50']),
+                                                    _milliseconds(result['latency']['p99']), result['failures'], stages)
+        previous = baseline['scenarios'].get(scenario) if baseline is not None else None
+        if previous is not None:
+            print "%-8s %10.1f %10.1f %10.1f" % ("  before", previous['messages_per_second'] or 0,
+                                                 _milliseconds(previous['latency']['p50']),
+                                                 _milliseconds(previous['latency']['p99']))
+
+
+def _milliseconds(seconds):
+    return (seconds or 0) * 1000
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Measures submission throughput through the players.")
+    parser.add_argument('--server', default=MEMORY_SERVER_URL)
+    parser.add_argument('--database', default='mangrove-benchmark')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--messages', type=int, default=1000, help="messages or rows per scenario")
+    parser.add_argument('--questionnaires', type=int, default=3, help="questionnaires of each kind")
+    parser.add_argument('--data-senders', type=int, default=100)
+    parser.add_argument('--subjects', type=int, default=500)
+    parser.add_argument('--error-rate', type=float, default=0.05, help="share of submissions with a wrong answer")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="file to write the results to as JSON")
+    parser.add_argument('--baseline', default=None, help="results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    options = parser.parse_args(args)
+
+    results = run_benchmarks(options)
+    if options.output is not None:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    baseline = None
+    if options.baseline is not None:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+    if baseline is None:
+        return 0
+    found = regressions(results, baseline, options.threshold)
+    for scenario, measure, before, after in found:
+        print "regression: %s %s %.4f -> %.4f" % (scenario, measure, before, after)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import random
+import unittest
+from mangrove.benchmarks import fixtures
+from mangrove.benchmarks.submissions import percentile, summarize, regressions, ExclusiveTimer
+from mangrove.datastore.metrics import Measurement
+
+
+class TestSubmissionBenchmark(unittest.TestCase):
+    def test_should_take_nearest_rank_percentile(self):
+        latencies = [0.5, 0.1, 0.4, 0.2, 0.3]
+
+        self.assertEqual(0.3, percentile(latencies, 50))
+        self.assertEqual(0.5, percentile(latencies, 99))
+        self.assertIsNone(percentile([], 50))
+
+    def test_should_break_down_time_by_stage(self):
+        database_calls = {('view', 'by_short_codes'): {'calls': 2, 'seconds': 1.0},
+                          ('view', 'questionnaire'): {'calls': 1, 'seconds': 0.5},
+                          ('save', 'documents'): {'calls': 1, 'seconds': 1.0},
+                          ('stage', 'validate'): {'calls': 10, 'seconds': 1.2}}
+
+        result = summarize(10, 1, 5.0, [0.5] * 10, 2.0, database_calls)
+
+        self.assertEqual({'parse': 2.0, 'view': 1.5, 'save': 1.0, 'other': 0.5}, result['stages'])
+        self.assertEqual({'validate': 1.2}, result['submission_stages'])
+        self.assertNotIn('stage/validate', result['database_calls'])
+        self.assertEqual(2.0, result['messages_per_second'])
+        self.assertEqual({'calls': 2, 'seconds': 1.0}, result['database_calls']['view/by_short_codes'])
+
+    def test_should_not_count_database_calls_in_wrapped_stage(self):
+        timer = ExclusiveTimer()
+
+        def parse():
+            measurement = Measurement('view', 'questionnaire')
+            measurement.seconds = 0.25
+            timer.record(measurement)
+        timer.wrap(parse)()
+        timer.record(Measurement('save', 'documents'))
+
+        self.assertAlmostEqual(timer.seconds - 0.25, timer.exclusive_seconds)
+
+    def test_should_report_slower_scenarios(self):
+        baseline = {'scenarios': {'sms': {'messages_per_second': 100.0, 'latency': {'p99': 0.1}},
+                                  'web': {'messages_per_second': 100.0, 'latency': {'p99': 0.1}}}}
+        results = {'scenarios': {'sms': {'messages_per_second': 80.0, 'latency': {'p99': 0.105}},
+                                 'web': {'messages_per_second': 95.0, 'latency': {'p99': 0.2}},
+                                 'xforms': {'messages_per_second': 1.0, 'latency': {'p99': 1.0}}}}
+
+        self.assertEqual([('sms', 'messages_per_second', 100.0, 80.0), ('web', 'p99', 0.1, 0.2)],
+                         regressions(results, baseline, threshold=0.1))
+
+    def test_should_generate_ordered_sms_answering_every_question(self):
+        questionnaire = _Questionnaire('flat000', fixtures.questionnaire_fields(fixtures.FLAT))
+
+        messages = fixtures.sms_corpus(random.Random(1), [questionnaire], ['bcl1'], ['261340000001'], 3)
+
+        self.assertEqual(3, len(messages))
+        for mobile_number, message in messages:
+            answers = message.split(' ')
+            self.assertEqual('261340000001', mobile_number)
+            self.assertEqual(['flat000', 'bcl1'], answers[:2])
+            self.assertEqual(len(questionnaire.fields) + 1, len(answers))
+
+    def test_should_generate_xform_submission_with_repeats(self):
+        questionnaire = _Questionnaire('xform000', fixtures.questionnaire_fields(fixtures.XFORM))
+
+        data_sender, message = fixtures.xform_corpus(random.Random(1), [questionnaire], ['bcl1'], ['bds1'], 1)[0]
+
+        self.assertEqual('bds1', data_sender)
+        self.assertTrue(message.startswith('<xform000><q1>bcl1</q1>'))
+        self.assertIn('<q7><q8>', message)
+        self.assertTrue(message.endswith('<form_code>xform000</form_code></xform000>'))
+
+
+class _Questionnaire(object):
+    def __init__(self, form_code, fields):
+        self.form_code = form_code
+        self.fields = fields
@@ -1,15 +1,26 @@
 
 from glob import iglob
+import hashlib
+import json
+import logging
 import string
 import os
+import time
+from threading import Thread
 from views import view_js
 from mangrove.contrib.deletion import create_default_delete_form_model, ENTITY_DELETION_FORM_CODE
 from mangrove.contrib.registration import create_default_reg_form_model
+from mangrove.datastore.design_documents import design_document_of
 from mangrove.datastore.entity_type import define_type
 from mangrove.errors.MangroveException import FormModelDoesNotExistsException, EntityTypeAlreadyDefined
 from mangrove.form_model.form_model import get_form_model_by_code, REGISTRATION_FORM_CODE
 from mangrove.transport.repository.reporters import REPORTER_ENTITY_TYPE
 
+STAGING_SUFFIX = '-staging'
+VIEW_BUILD_POLL_SECONDS = 5
+
+logger = logging.getLogger('mangrove.bootstrap')
+
 
 def initial_data_setup(manager):
     _create_entity_types(manager, [REPORTER_ENTITY_TYPE])
@@ -20,7 +31,8 @@ def initial_data_setup(manager):
 
 
 def run(manager):
-    sync_views(manager)
+    # changed views are indexed and swapped in by a background thread, so startup does not wait on index builds
+    sync_views(manager, wait=False)
     initial_data_setup(manager)
 
 
@@ -50,22 +62,134 @@ def _create_entity_types(manager, entity_types):
 def _create_views(dbm):
     """Creates a standard set of views in the database"""
     database_manager = dbm
+    views = []
     for v in view_js.keys():
         if not _exists_view(v, database_manager):
             funcs = view_js[v]
             map = (funcs['map'] if 'map' in funcs else None)
             reduce = (funcs['reduce'] if 'reduce' in funcs else None)
-            database_manager.create_view(v, map, reduce)
-
-
-def sync_views(dbm):
-    """Updates or Creates a standard set of views in the database"""
+            views.append((v, map, reduce))
+    if views:
+        database_manager.create_views(views)
+
+
+def sync_views(dbm, wait=True):
+    """
+    Brings the design documents in line with bootstrap/views, writing only those whose views changed.
+    A changed design document is first written under a staging id and indexed there; it replaces the live one
+    once its indexes are built, so readers never wait on an index build. With wait=True sync_views returns once
+    every written design document is built, with wait=False a background thread waits and swaps them in.
+    A staging design document left over by an interrupted sync is picked up again by the next one.
+    Returns the names of the written design documents.
+    """
     database_manager = dbm
+    views = {}
     for v in view_js.keys():
         funcs = view_js[v]
-        map = (funcs['map'] if 'map' in funcs else None)
-        reduce = (funcs['reduce'] if 'reduce' in funcs else None)
-        database_manager.create_view(v, map, reduce)
+        design_views = views.setdefault(design_document_of(v), {})
+        design_views[v] = dict((func, funcs[func]) for func in ('map', 'reduce') if func in funcs)
+    written = _stage_design_docs(database_manager, views)
+    if wait:
+        _swap_when_built(database_manager, written)
+    else:
+        thread = Thread(target=_swap_in_background, args=(database_manager, written), name='view-sync')
+        thread.daemon = True
+        thread.start()
+    return [design_document for design_document, staged in written]
+
+
+def _views_hash(views):
+    return hashlib.sha1(json.dumps(views, sort_keys=True)).hexdigest()
+
+
+def _stage_design_docs(dbm, views):
+    """
+    Writes the design documents which do not exist yet and stages the changed ones. Returns
+    (design document, staged) pairs for both.
+    """
+    written = []
+    for design_document, design_views in views.items():
+        live = dbm.database.get('_design/%s' % design_document)
+        if live is None:
+            dbm.database.save({'_id': '_design/%s' % design_document, 'language': 'javascript',
+                               'views': design_views})
+            _start_index_build(dbm, design_document, design_views)
+            written.append((design_document, False))
+            continue
+        if _views_hash(live.get('views', {})) == _views_hash(design_views):
+            continue
+        staging_id = '_design/%s%s' % (design_document, STAGING_SUFFIX)
+        staging = dbm.database.get(staging_id) or {'_id': staging_id, 'language': 'javascript'}
+        if _views_hash(staging.get('views', {})) != _views_hash(design_views):
+            logger.info("staging changed views of %s" % design_document)
+            staging['views'] = design_views
+            dbm.database.save(staging)
+        _start_index_build(dbm, design_document + STAGING_SUFFIX, design_views)
+        written.append((design_document, True))
+    return written
+
+
+def _start_index_build(dbm, design_document, design_views):
+    # stale=update_after answers from the index as it is and builds it after the response
+    dbm.database.view('%s/%s' % (design_document, sorted(design_views)[0]), stale='update_after', limit=0).rows
+
+
+def _swap_when_built(dbm, written, poll_seconds=VIEW_BUILD_POLL_SECONDS):
+    target_seq = _seq_number(dbm.database.info()['update_seq'])
+    pending = list(written)
+    while pending:
+        for design_document, staged in list(pending):
+            if _is_built(dbm, design_document + STAGING_SUFFIX if staged else design_document, target_seq):
+                if staged:
+                    _swap(dbm, design_document)
+                pending.remove((design_document, staged))
+        if pending:
+            time.sleep(poll_seconds)
+    _remove_standalone_design_docs(dbm, view_js.keys())
+    dbm.database.cleanup()
+
+
+def _swap_in_background(dbm, written):
+    try:
+        _swap_when_built(dbm, written)
+    except Exception:
+        # e.g. the database was deleted meanwhile; the next sync picks up the staged design documents again
+        logger.exception("view sync of %s stopped" % dbm.database_name)
+
+
+def _is_built(dbm, design_document, target_seq):
+    view_index = dbm.database.info(design_document)['view_index']
+    return not view_index.get('updater_running') and _seq_number(view_index['update_seq']) >= target_seq
+
+
+def _seq_number(seq):
+    # CouchDB 2 sequences are strings led by their number
+    return int(str(seq).split('-')[0])
+
+
+def _swap(dbm, design_document):
+    """
+    Copies the staged views into the live design document. The index of a design document is identified by
+    its views rather than its id, so the live one uses the index built for the staged one.
+    """
+    staging = dbm.database.get('_design/%s%s' % (design_document, STAGING_SUFFIX))
+    live = dbm.database.get('_design/%s' % design_document)
+    live['views'] = staging['views']
+    dbm.database.save(live)
+    dbm.database.delete(staging)
+    logger.info("swapped in the rebuilt views of %s" % design_document)
+
+
+def _remove_standalone_design_docs(dbm, view_names):
+    """
+    Deletes the design documents views had to themselves before they were grouped, so they stop being indexed.
+    """
+    for view_name in view_names:
+        if design_document_of(view_name) == view_name:
+            continue
+        design_doc = dbm.database.get('_design/%s' % view_name)
+        if design_doc is not None:
+            dbm.database.delete(design_doc)
 
 
 def find_views(view_dir):
@@ -84,7 +208,7 @@ def find_views(view_dir):
 
 def _exists_view(aggregation, database_manager):
     entity_type_views = database_manager.\
-    _load_document('_design/%s' % aggregation)
+    _load_document('_design/%s' % design_document_of(aggregation))
     if entity_type_views is not None and entity_type_views['views'].get(aggregation):
         return True
     return False
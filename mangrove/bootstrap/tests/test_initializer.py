@@ -0,0 +1,85 @@
+from copy import deepcopy
+from unittest import TestCase
+from mock import Mock, patch
+from mangrove.bootstrap import initializer
+from mangrove.bootstrap.initializer import sync_views
+from mangrove.datastore.database import DatabaseManager
+
+VIEWS = {'by_short_codes': {'map': 'function(doc) { emit(doc.short_code, null); }', 'reduce': '_count'},
+         'questionnaire': {'map': 'function(doc) { emit(doc.form_code, null); }'}}
+
+
+class DatabaseStub(object):
+    def __init__(self, docs=None):
+        self.docs = dict((doc['_id'], doc) for doc in docs or [])
+        self.saved = []
+        self.built = set()
+
+    def get(self, id):
+        return deepcopy(self.docs.get(id))
+
+    def save(self, doc):
+        self.saved.append(doc['_id'])
+        self.docs[doc['_id']] = deepcopy(doc)
+
+    def delete(self, doc):
+        del self.docs[doc['_id']]
+
+    def view(self, path, **options):
+        return Mock(rows=[])
+
+    def info(self, ddoc=None):
+        if ddoc is None:
+            return {'update_seq': 10}
+        return {'view_index': {'update_seq': 10 if ddoc in self.built else 0, 'updater_running': False}}
+
+    def cleanup(self):
+        pass
+
+
+class TestSyncViews(TestCase):
+    def setUp(self):
+        self.dbm = Mock(spec=DatabaseManager)
+        self.view_js_patch = patch.object(initializer, 'view_js', VIEWS)
+        self.view_js_patch.start()
+
+    def tearDown(self):
+        self.view_js_patch.stop()
+
+    def test_should_not_write_unchanged_design_documents(self):
+        self.dbm.database = DatabaseStub([
+            {'_id': '_design/entities', 'views': {'by_short_codes': VIEWS['by_short_codes']}},
+            {'_id': '_design/questionnaires', 'views': {'questionnaire': VIEWS['questionnaire']}}])
+
+        self.assertEqual([], sync_views(self.dbm))
+        self.assertEqual([], self.dbm.database.saved)
+
+    def test_should_swap_in_a_changed_design_document_once_its_staged_indexes_are_built(self):
+        old_views = {'by_short_codes': {'map': 'function(doc) { emit(doc._id, doc); }'}}
+        self.dbm.database = DatabaseStub([{'_id': '_design/entities', '_rev': '1-a', 'views': old_views}])
+        self.dbm.database.built = set(['questionnaires'])
+        sleeps = []
+
+        def build(seconds):
+            sleeps.append(seconds)
+            self.assertEqual(old_views, self.dbm.database.docs['_design/entities']['views'])
+            self.dbm.database.built.add('entities-staging')
+
+        with patch('mangrove.bootstrap.initializer.time.sleep', side_effect=build):
+            written = sync_views(self.dbm)
+
+        self.assertEqual(['entities', 'questionnaires'], sorted(written))
+        self.assertEqual(1, len(sleeps))
+        docs = self.dbm.database.docs
+        self.assertEqual({'by_short_codes': VIEWS['by_short_codes']}, docs['_design/entities']['views'])
+        self.assertEqual({'questionnaire': VIEWS['questionnaire']}, docs['_design/questionnaires']['views'])
+        self.assertNotIn('_design/entities-staging', docs)
+        self.assertEqual(['_design/questionnaires', '_design/entities-staging', '_design/entities'],
+                         self.dbm.database.saved)
+
+    def test_should_not_wait_for_index_builds_at_startup(self):
+        with patch('mangrove.bootstrap.initializer.sync_views') as sync, \
+                patch('mangrove.bootstrap.initializer.initial_data_setup'):
+            initializer.run(self.dbm)
+
+        sync.assert_called_once_with(self.dbm, wait=False)
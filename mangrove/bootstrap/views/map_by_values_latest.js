@@ -8,11 +8,8 @@ function(doc) {
         var entity_id = entity._id;
         var form_code = doc.submission.form_code;
         for (k in doc.data) {
-            value = {};
             key = [entity_type,entity_id,k,form_code,date];
-            value["timestamp"] = date;
-            value["value"] = doc.data[k].value;
-            emit(key, value);
+            emit(key, doc.data[k].value);
         }
     }
 }
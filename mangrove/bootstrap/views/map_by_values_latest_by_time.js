@@ -7,11 +7,8 @@ function(doc) {
         var entity_type = entity.aggregation_paths['_type'];
         var entity_id = entity._id;
         for (k in doc.data) {
-            value = {};
             key = [entity_type,entity_id,k,date];
-            value["timestamp"] = date;
-            value["value"] = doc.data[k].value;
-            emit(key, value);
+            emit(key, doc.data[k].value);
         }
     }
 }
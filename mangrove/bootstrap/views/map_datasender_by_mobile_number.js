@@ -0,0 +1,5 @@
+function(doc) {
+    if (doc.document_type == "Contact" && doc.aggregation_paths._type[0] == 'reporter' && !doc.void) {
+        emit(doc.data.mobile_number.value, null);
+    }
+}
\ No newline at end of file
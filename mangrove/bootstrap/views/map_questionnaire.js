@@ -1,5 +1,5 @@
 function(doc) {
     if (doc.document_type == 'FormModel' && !doc.void) {
-        emit(doc.form_code, doc);
+        emit(doc.form_code, null);
     }
 }
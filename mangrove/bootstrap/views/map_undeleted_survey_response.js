@@ -1,5 +1,5 @@
 function(doc) {
     if (doc.document_type == 'SurveyResponse' && !doc.void) {
-        emit([doc.form_model_id, Date.parse(doc.created)], doc);
+        emit([doc.form_model_id, Date.parse(doc.created)], doc.status ? 1 : 0);
     }
 }
\ No newline at end of file
@@ -1,129 +1,159 @@
+"""
+Measures how long CouchDB takes to build the indexes of the design documents holding the views in
+bootstrap/views on a generated dataset.
+
+    python measure_view_generation_times.py --entities 1000 --records-per-entity 8 --survey-responses 10000
+
+Pass --baseline-views with a directory holding the view files of an earlier release (e.g. exported with
+git archive) to build both sets on the same data and print the times side by side, e.g. to compare JavaScript
+reduce functions with the built-in _count, _sum and _stats reducers.
+"""
+import argparse
 import datetime
-from mangrove.datastore.database import get_db_manager,\
-    _delete_db_and_remove_db_manager
-from mangrove.bootstrap.initializer import _find_views
-from pytz import UTC
 import random
-from mangrove.datastore.entity import Entity
+import time
 from collections import defaultdict
+from itertools import islice
 
+from pytz import UTC
+
+from mangrove.bootstrap.initializer import find_views
+from mangrove.datastore.database import get_db_manager, _delete_db_and_remove_db_manager
+from mangrove.datastore.design_documents import design_document_of
+from mangrove.datastore.documents import DataRecordDocument, SurveyResponseDocument
+from mangrove.datastore.entity import Entity
+
+BULK_SAVE_SIZE = 1000
+
+ENTITY_TYPE = ["Health_Facility", "Clinic"]
+AGGREGATION_PATH_NAME = "governance"
+LOCATIONS = [
+    ['India', 'MH', 'Pune'],
+    ['India', 'MH', 'Mumbai'],
+    ['India', 'Karnataka', 'Bangalore'],
+    ['India', 'Karnataka', 'Hubli'],
+    ['India', 'Kerala', 'Kochi'],
+]
+AGGREGATION_PATHS = [
+    ["Director", "Med_Supervisor", "Surgeon"],
+    ["Director", "Med_Supervisor", "Nurse"],
+    ["Director", "Med_Officer", "Doctor"],
+    ["Director", "Med_Officer", "Surgeon"],
+    ["Director", "Med_Officer", "Nurse"],
+]
+FORM_CODES = ["cli001", "cli002"]
+FORM_MODEL_IDS = ["form_model_1", "form_model_2", "form_model_3"]
 
-class ViewGenerationTimer(object):
-    def _set_db_manager(self):
-        self.manager = get_db_manager('http://localhost:5984/',
-                                      'mangrove-test')
 
-    def _delete_db_and_remove_db_manager(self):
-        _delete_db_and_remove_db_manager(self.manager)
+class ViewGenerationTimer(object):
+    def __init__(self, server='http://localhost:5984/', database='mangrove-view-generation-times'):
+        self.server = server
+        self.database = database
+        self.manager = None
 
     def _refresh_db_manager(self):
-        self._set_db_manager()
-        self._delete_db_and_remove_db_manager()
-        self._set_db_manager()
+        manager = get_db_manager(self.server, self.database)
+        _delete_db_and_remove_db_manager(manager)
+        self.manager = get_db_manager(self.server, self.database)
 
-    def _reset(self, number_of_entities=0, number_of_data_records_per_entity=8):
-        self._number_of_entities = number_of_entities
+    def reset(self, number_of_entities, number_of_data_records_per_entity, number_of_survey_responses):
         self._refresh_db_manager()
-        self._setup_entities()
-        self._setup_datadict_types()
-        self._add_data_to_entities(number_of_data_records_per_entity)
-
-    def _setup_entities(self):
-        ENTITY_TYPE = ["Health_Facility", "Clinic"]
-        AGGREGATION_PATH_NAME = "governance"
-
-        # Entities for State 1: Maharashtra
-        # location, aggregation_path
-        locations = [
-            ['India', 'MH', 'Pune'],
-            ['India', 'MH', 'Mumbai'],
-            ['India', 'Karnataka', 'Bangalore'],
-            ['India', 'Karnataka', 'Hubli'],
-            ['India', 'Kerala', 'Kochi'],
-        ]
-        aggregation_paths = [
-            ["Director", "Med_Supervisor", "Surgeon"],
-            ["Director", "Med_Supervisor", "Nurse"],
-            ["Director", "Med_Officer", "Doctor"],
-            ["Director", "Med_Officer", "Surgeon"],
-            ["Director", "Med_Officer", "Nurse"],
-        ]
-
-        self.entities = []
-        for i in range(self._number_of_entities):
-            location = random.choice(locations)
-            aggregation_path = random.choice(aggregation_paths)
-            e = Entity(self.manager, entity_type=ENTITY_TYPE, location=location)
-            e.set_aggregation_path(AGGREGATION_PATH_NAME, aggregation_path)
-            e.save()
-            self.entities.append(e)
-
-    def _add_data_to_entities(self, number_of_data_records_per_entity):
-        months = [1]
-        number_of_years = number_of_data_records_per_entity / (
-            len(self.dd_types) * len(months)
-            )
-        years = range(2011 - max(1, number_of_years), 2011)
-        event_times = []
-        for year in years:
-            for month in months:
-                event_time = datetime.datetime(year, month, 1, tzinfo=UTC)
-                event_times.append(event_time)
-
-        #for e in self.entities:
-        #    for dd_type in self.dd_types.values():
-        #        for event_time in event_times:
-        #            slug = dd_type.slug
-        #            value = random.random()
-        #            e.add_data(
-        #                data=[(slug, value, self.dd_types[slug])],
-        #                event_time=event_time
-        #            )
-
-    def print_csv_of_view_generation_times(self):
-        iterations = [20, 40, 60, 80, 100]
-        times_by_view_name = defaultdict(dict)
-        for number_of_entities in iterations:
-            times = self._calculate_view_generation_time(number_of_entities, 8)
-            for k, v in times.items():
-                times_by_view_name[k][number_of_entities] = str(v)
-        print ",".join(["number of entities"] + [str(i) for i in iterations])
-        for name, times in times_by_view_name.items():
-            row = [name] + [times_by_view_name[name][number_of_entities] for number_of_entities in iterations]
-            print ",".join(row)
-
-    def print_view_generation_times(self):
-        times = self._calculate_view_generation_time(100, 8)
-        import operator
-
-        sorted_times = sorted(times.iteritems(), key=operator.itemgetter(1))
-        for view_name, generation_time in sorted_times:
-            print view_name + ": " + str(generation_time)
-
-    def _calculate_view_generation_time(self, number_of_entities, number_of_data_records_per_entity):
-        self._reset(number_of_entities, number_of_data_records_per_entity)
-
-        js_views = _find_views()
+        entities = self._setup_entities(number_of_entities)
+        self._save(self._data_records(entities, number_of_data_records_per_entity))
+        self._save(self._survey_responses(number_of_survey_responses))
+
+    def _save(self, documents):
+        documents = iter(documents)
+        while True:
+            batch = list(islice(documents, BULK_SAVE_SIZE))
+            if not batch:
+                return
+            self.manager._save_documents(batch)
+
+    def _setup_entities(self, number_of_entities):
+        entities = []
+        for index in range(number_of_entities):
+            entity = Entity(self.manager, entity_type=ENTITY_TYPE, location=random.choice(LOCATIONS),
+                            short_code="cli%d" % index)
+            entity.set_aggregation_path(AGGREGATION_PATH_NAME, random.choice(AGGREGATION_PATHS))
+            entities.append(entity)
+        self._save([entity._doc for entity in entities])
+        return entities
+
+    def _data_records(self, entities, number_of_data_records_per_entity):
+        for entity in entities:
+            for index in range(number_of_data_records_per_entity):
+                event_time = datetime.datetime(2010 + index % 3, 1 + index % 12, 1 + index % 28, tzinfo=UTC)
+                data = [("beds", random.randint(0, 500)), ("meds", random.randint(0, 50)),
+                        ("director", random.choice(["Dr. A", "Dr. B", "Dr. C"]))]
+                yield DataRecordDocument(entity_doc=entity._doc, event_time=event_time, data=data,
+                                         submission=dict(submission_id=str(index),
+                                                         form_code=random.choice(FORM_CODES)))
+
+    def _survey_responses(self, number_of_survey_responses):
+        for index in range(number_of_survey_responses):
+            yield SurveyResponseDocument(channel=random.choice(["sms", "web"]), destination="5678",
+                                         values={"q1": "cli%d" % index, "q2": str(random.randint(0, 100))},
+                                         status=random.random() < 0.8, error_message="",
+                                         form_model_id=random.choice(FORM_MODEL_IDS))
+
+    def view_generation_times(self, views):
+        """
+        Creates every view and returns {design document: seconds until its indexes were built}. The views of a
+        design document are indexed together, so they are timed together.
+        """
+        by_design_document = defaultdict(list)
+        for view_name, funcs in views.items():
+            by_design_document[design_document_of(view_name)].append(
+                (view_name, funcs.get('map'), funcs.get('reduce')))
         times = {}
-        for v in js_views.keys():
-            funcs = js_views[v]
-            js_map = (funcs['map'] if 'map' in funcs else None)
-            js_reduce = (funcs['reduce'] if 'reduce' in funcs else None)
-            start = datetime.datetime.now()
-            self.manager.create_view(v, js_map, js_reduce, view_document=v)
-            all_rows = self.manager.load_all_rows_in_view(v + "/" + v)
-            # we need to hit the view to make sure it compiles
-            number_of_rows = len(all_rows)
-            end = datetime.datetime.now()
-            times[v] = (end - start).total_seconds()
+        for design_document, design_document_views in sorted(by_design_document.items()):
+            start = time.time()
+            self.manager.create_views(design_document_views)
+            # the indexes are built on the first query to any view of the design document
+            self.manager.load_all_rows_in_view(design_document_views[0][0], limit=0)
+            times[design_document] = time.time() - start
         return times
 
 
+def print_view_generation_times(current, baseline=None):
+    if baseline is None:
+        for design_document, seconds in sorted(current.items(), key=lambda item: item[1], reverse=True):
+            print "%-45s %8.3f" % (design_document, seconds)
+        print "%-45s %8.3f" % ("total", sum(current.values()))
+        return
+    print "%-45s %8s %8s" % ("design document", "baseline", "current")
+    for design_document in sorted(set(current) | set(baseline)):
+        print "%-45s %8s %8s" % (design_document, _seconds(baseline.get(design_document)),
+                                 _seconds(current.get(design_document)))
+    print "%-45s %8.3f %8.3f" % ("total", sum(baseline.values()), sum(current.values()))
+
+
+def _seconds(seconds):
+    return "-" if seconds is None else "%.3f" % seconds
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Measures view index build times on a generated dataset.")
+    parser.add_argument('--server', default='http://localhost:5984/')
+    parser.add_argument('--database', default='mangrove-view-generation-times')
+    parser.add_argument('--entities', type=int, default=100)
+    parser.add_argument('--records-per-entity', type=int, default=8)
+    parser.add_argument('--survey-responses', type=int, default=1000)
+    parser.add_argument('--baseline-views', default=None,
+                        help="directory of the map_*.js and reduce_*.js files to compare against")
+    options = parser.parse_args(args)
+
+    timer = ViewGenerationTimer(options.server, options.database)
+    baseline = None
+    if options.baseline_views is not None:
+        timer.reset(options.entities, options.records_per_entity, options.survey_responses)
+        baseline = timer.view_generation_times(find_views(options.baseline_views))
+    timer.reset(options.entities, options.records_per_entity, options.survey_responses)
+    current = timer.view_generation_times(find_views('views'))
+    _delete_db_and_remove_db_manager(timer.manager)
+    print_view_generation_times(current, baseline)
+
+
 if __name__ == "__main__":
-    divider = "-" * 70
-    timer = ViewGenerationTimer()
-    print divider
-    timer.print_view_generation_times()
-    print divider
-    timer.print_csv_of_view_generation_times()
-    print divider
+    main()
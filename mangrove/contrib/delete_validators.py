@@ -6,11 +6,14 @@ from collections import OrderedDict
 
 
 class EntityShouldExistValidator(object):
-    def validate(self, values, fields, dbm):
+    def validate(self, values, fields, dbm, entity_resolver=None):
         errors = OrderedDict()
         entity_type_field, entity_id_field = self._get_field_codes(fields)
         try:
-            get_by_short_code(dbm, entity_id_field.value, [entity_type_field.value])
+            if entity_resolver is not None:
+                entity_resolver.get_by_short_code(entity_id_field.value, [entity_type_field.value])
+            else:
+                get_by_short_code(dbm, entity_id_field.value, [entity_type_field.value])
         except DataObjectNotFound as exception:
             errors[entity_type_field.code] = exception.message
             errors[entity_id_field.code] = exception.message
@@ -7,7 +7,7 @@ from mangrove.utils.types import is_empty
 
 
 class AtLeastOneLocationFieldMustBeAnsweredValidator(object):
-    def validate(self, values, fields=None, dbm=None):
+    def validate(self, values, fields=None, dbm=None, entity_resolver=None):
         from mangrove.form_model.form_model import GEO_CODE, LOCATION_TYPE_FIELD_CODE
 
         if is_empty(case_insensitive_lookup(values, GEO_CODE)) and is_empty(
@@ -28,7 +28,7 @@ class AtLeastOneLocationFieldMustBeAnsweredValidator(object):
 
 
 class MobileNumberValidationsForReporterRegistrationValidator(object):
-    def validate(self, values, fields, dbm):
+    def validate(self, values, fields, dbm, entity_resolver=None):
         from mangrove.form_model.form_model import MOBILE_NUMBER_FIELD_CODE, SHORT_CODE
 
         errors = OrderedDict()
@@ -1,7 +1,92 @@
+import logging
+from Queue import Empty
+from threading import Lock
+
 import pylibmc
-from mangrove.datastore.settings import CACHE_SERVERS
+from mangrove.datastore.settings import CACHE_SERVERS, CACHE_POOL_SIZE, CACHE_POOL_TIMEOUT
 
+logger = logging.getLogger('mangrove.cache')
 
-def get_cache_manager():
-    return pylibmc.Client(CACHE_SERVERS, binary=True, behaviors={"tcp_nodelay": True, "ketama": True})
+_cache_manager = None
+_cache_manager_lock = Lock()
+
+
+# the default of an operation whose failures are raised rather than reported as a cache miss
+_RAISE = object()
+
+
+class PooledCacheClient(object):
+    """
+    Thread safe memcached client shared by the whole process.
+
+    Every operation borrows a client from a pylibmc.ClientPool. Memcached is
+    only a cache in front of CouchDB, so failures of get, add and set are
+    logged and reported as a cache miss instead of being raised into the
+    submission path. The borrowed client is disconnected on failure and
+    reconnects on next use. When every client stays borrowed for
+    pool_timeout seconds the operation is a cache miss too.
+
+    A failed delete or flush_all would leave stale entries behind, so it is
+    retried once on a fresh connection and then raised, as are failures of
+    the other pylibmc.Client operations, which are passed through.
+    """
+
+    def __init__(self, servers, pool_size=CACHE_POOL_SIZE, pool_timeout=CACHE_POOL_TIMEOUT):
+        assert pool_size > 0
+        self.servers = servers
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self._pool = pylibmc.ClientPool()
+        self._pool.fill(self._create_client(), pool_size)
+
+    def _create_client(self):
+        return pylibmc.Client(self.servers, binary=True, behaviors={"tcp_nodelay": True, "ketama": True})
 
+    def _execute(self, operation, default, *args, **kwargs):
+        try:
+            # an operation which must not be skipped waits for the clients in use, which are always given back
+            client = self._pool.get(True, None if default is _RAISE else self.pool_timeout)
+        except Empty:
+            logger.warning("memcached %s skipped: all %d pooled clients are busy" % (operation, self.pool_size))
+            return default
+        try:
+            try:
+                return getattr(client, operation)(*args, **kwargs)
+            except pylibmc.Error as e:
+                client.disconnect_all()
+                if default is not _RAISE:
+                    logger.warning("memcached %s failed: %s" % (operation, e))
+                    return default
+                logger.error("memcached %s failed, retrying: %s" % (operation, e))
+                return getattr(client, operation)(*args, **kwargs)
+        finally:
+            self._pool.put(client)
+
+    def __getattr__(self, operation):
+        if operation.startswith('_') or not hasattr(pylibmc.Client, operation):
+            raise AttributeError(operation)
+        return lambda *args, **kwargs: self._execute(operation, _RAISE, *args, **kwargs)
+
+    def get(self, key):
+        return self._execute('get', None, key)
+
+    def set(self, key, value, time=0):
+        return self._execute('set', False, key, value, time=time)
+
+    def add(self, key, value, time=0):
+        return self._execute('add', False, key, value, time=time)
+
+    def delete(self, key):
+        return self._execute('delete', _RAISE, key)
+
+    def flush_all(self):
+        return self._execute('flush_all', _RAISE)
+
+
+def get_cache_manager():
+    global _cache_manager
+    if _cache_manager is None:
+        with _cache_manager_lock:
+            if _cache_manager is None:
+                _cache_manager = PooledCacheClient(CACHE_SERVERS, CACHE_POOL_SIZE)
+    return _cache_manager
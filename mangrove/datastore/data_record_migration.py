@@ -0,0 +1,54 @@
+import argparse
+import logging
+from itertools import islice
+
+from mangrove.datastore.database import get_db_manager
+from mangrove.datastore.documents import compact_entity, is_compact_entity
+
+DATA_RECORD_MIGRATION_BATCH_SIZE = 1000
+
+logger = logging.getLogger('mangrove.migration')
+
+
+def compact_data_records(dbm, batch_size=DATA_RECORD_MIGRATION_BATCH_SIZE):
+    """
+    Rewrites the data records still embedding a full entity document so they keep only its compact form.
+    Pages through the data_record_by_form_code view and writes every page with one bulk update. Records are
+    updated as they are, so their modified time is kept.
+    Returns the number of data records read and the number rewritten.
+    """
+    rows = dbm.iter_view('data_record_by_form_code', batch_size)
+    read = rewritten = 0
+    while True:
+        page = list(islice(rows, batch_size))
+        if not page:
+            return read, rewritten
+        documents = []
+        for row in page:
+            document = row['value']
+            if document.get('entity') and not is_compact_entity(document['entity']):
+                document['entity'] = compact_entity(document['entity'])
+                documents.append(document)
+        if documents:
+            for success, document_id, result in dbm.database.update(documents):
+                if success:
+                    rewritten += 1
+                else:
+                    logger.error("could not compact data record %s: %s" % (document_id, result))
+        read += len(page)
+        logger.info("compacted %s of %s data records" % (rewritten, read))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Stops data records from embedding full entity documents.")
+    parser.add_argument('database')
+    parser.add_argument('--server', default=None)
+    parser.add_argument('--batch-size', type=int, default=DATA_RECORD_MIGRATION_BATCH_SIZE)
+    options = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO)
+
+    compact_data_records(get_db_manager(options.server, options.database), options.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 
 
+import base64
+import json
 from threading import Lock
 from couchdb import http
 
@@ -10,6 +12,9 @@ import couchdb.client
 import settings
 from documents import DocumentBase
 from datetime import datetime
+from mangrove.datastore.design_documents import design_document_of, view_path
+from mangrove.datastore.memory import get_memory_server, is_memory_server
+from mangrove.datastore.metrics import get_metrics, measure
 from mangrove.utils import dates
 from mangrove.utils.types import is_empty, is_sequence
 from mangrove.errors.MangroveException import NoDocumentError, DataObjectNotFound, FailedToSaveDataObject
@@ -18,6 +23,29 @@ from mangrove.errors.MangroveException import NoDocumentError, DataObjectNotFoun
 _dbms = {}
 _dbms_lock = Lock()
 
+VIEW_PAGE_SIZE = 1000
+
+# Read policies of views: strict reads wait for the index to take in every write, stale reads answer from the
+# index as it is, update_after also starts its update after answering.
+READ_STRICT = 'strict'
+READ_STALE_OK = 'ok'
+READ_UPDATE_AFTER = 'update_after'
+
+
+def encode_page_token(key, docid):
+    """
+    Returns an opaque, url safe token for the view row (key, docid) a page starts at.
+    """
+    return base64.urlsafe_b64encode(json.dumps([key, docid], separators=(',', ':')))
+
+
+def decode_page_token(page_token):
+    try:
+        key, docid = json.loads(base64.urlsafe_b64decode(str(page_token)))
+    except (TypeError, ValueError):
+        raise ValueError("invalid page token: %r" % page_token)
+    return key, docid
+
 
 def get_db_manager(server=None, database=None, credentials=settings.COUCHDB_CREDENTIALS):
     global _dbms
@@ -139,19 +167,30 @@ class DataObject(object):
         return self._doc.created
 
 
+def _apply_read_policy(read_policies, view_name, values):
+    """
+    Adds the stale option of the read policy of view_name unless the caller gave one. stale=None or
+    stale=READ_STRICT asks for a strict read whatever the policy.
+    """
+    if 'stale' not in values:
+        values['stale'] = read_policies.get(view_name, READ_STRICT)
+    if values['stale'] in (None, READ_STRICT):
+        del values['stale']
+    return values
+
+
 class View(object):
-    def __init__(self, database):
+    def __init__(self, database, metrics=None, read_policies=None):
         self.database = database
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.read_policies = read_policies if read_policies is not None else {}
 
     def _load_all_rows_in_view(self, **values):
-        full_view_name = self.name + '/' + self.name
-        print '[DEBUG] loading view: %s' % full_view_name
-        start = datetime.now()
-        rows = self.database.view(full_view_name, **values).rows
-        end = datetime.now()
-        delta_t = (end - start)
-        print "[DEBUG] --- took %s.%s seconds (%s rows)" %\
-              (delta_t.seconds, delta_t.microseconds, len(rows))
+        name = self.name
+        _apply_read_policy(self.read_policies, name, values)
+        with measure(self.metrics, 'view', name) as measurement:
+            rows = self.database.view(view_path(name), **values).rows
+            measurement.rows = len(rows)
         return rows
 
     def _execute(self, **values):
@@ -163,22 +202,33 @@ class View(object):
 
 
 class DatabaseManager(object):
-    def __init__(self, credentials, server=None, database=None  ):
+    index_warmer = None
+
+    def __init__(self, credentials, server=None, database=None, metrics=None, read_policies=None):
         """
         Connect to the CouchDB server. If no database name is given,
-        use the name provided in the settings
+        use the name provided in the settings. Timings of the database
+        calls go to metrics, by default the shared in-memory sink.
+        read_policies maps view names to READ_STALE_OK or READ_UPDATE_AFTER,
+        by default the VIEW_READ_POLICIES setting; other views are read strictly.
+        A memory:// server keeps the database in process, see mangrove.datastore.memory.
         """
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.read_policies = dict(settings.VIEW_READ_POLICIES if read_policies is None else read_policies)
 
         self.url = (server if server is not None else settings.SERVER)
         self.database_name = database or settings.DATABASE
-        self.server = couchdb.client.Server(self.url, session=http.Session(retry_delays=[5, 30]))
-        self.server.resource.credentials = credentials
+        if is_memory_server(self.url):
+            self.server = get_memory_server(self.url)
+        else:
+            self.server = couchdb.client.Server(self.url, session=http.Session(retry_delays=[5, 30]))
+            self.server.resource.credentials = credentials
         try:
             self.database = self.server[self.database_name]
         except ResourceNotFound:
             self.database = self.server.create(self.database_name)
 
-        self.view = View(self.database)
+        self.view = View(self.database, self.metrics, self.read_policies)
 
 
     def __unicode__(self):
@@ -190,22 +240,77 @@ class DatabaseManager(object):
     def __repr__(self):
         return repr(self.database)
 
+    def set_read_policy(self, view_name, policy):
+        assert policy in (READ_STRICT, READ_STALE_OK, READ_UPDATE_AFTER)
+        self.read_policies[view_name] = policy
+
     def load_all_rows_in_view(self, view_name, **values):
-        full_view_name = view_name + '/' + view_name
-        print '[DEBUG] loading view: %s' % full_view_name
-        start = datetime.now()
-        rows = self.database.view(full_view_name, **values).rows
-        end = datetime.now()
-        delta_t = (end - start)
-        print "[DEBUG] --- took %s.%s seconds (%s rows)" %\
-              (delta_t.seconds, delta_t.microseconds, len(rows))
+        _apply_read_policy(self.read_policies, view_name, values)
+        with measure(self.metrics, 'view', view_name) as measurement:
+            rows = self.database.view(view_path(view_name), **values).rows
+            measurement.rows = len(rows)
         return rows
 
+    def iter_view(self, view_name, page_size=VIEW_PAGE_SIZE, **values):
+        """
+        Yields the rows of a view lazily, page_size rows per request. Pages are chained with a
+        (startkey, startkey_docid) cursor instead of skip, so every page costs the same however deep it is.
+        limit caps the total number of rows; skip only applies to the first page.
+        """
+        assert page_size > 0
+        assert 'keys' not in values, "multi-key queries can not be paged with a cursor"
+        limit = values.pop('limit', None)
+        while limit is None or limit > 0:
+            size = page_size if limit is None else min(page_size, limit)
+            rows = self.load_all_rows_in_view(view_name, limit=size + 1, **values)
+            for row in rows[:size]:
+                yield row
+            if len(rows) <= size:
+                return
+            if limit is not None:
+                limit -= size
+            values.pop('skip', None)
+            values['startkey'] = rows[size]['key']
+            values['startkey_docid'] = rows[size]['id']
+
+    def load_view_page(self, view_name, page_size, page_token=None, **values):
+        """
+        Returns one page of view rows and the token of the next page, None on the last page. The token
+        carries the (key, docid) of the next row, so a page is found with a keyed lookup rather than by
+        skipping every row before it. Pass the same view options with every page of a listing.
+        """
+        assert page_size > 0
+        assert 'keys' not in values and 'skip' not in values, "a view page is found by its token only"
+        if page_token is not None:
+            values['startkey'], values['startkey_docid'] = decode_page_token(page_token)
+        rows = self.load_all_rows_in_view(view_name, limit=page_size + 1, **values)
+        if len(rows) <= page_size:
+            return rows, None
+        return rows[:page_size], encode_page_token(rows[page_size]['key'], rows[page_size]['id'])
+
+    def iter_objects(self, view_name, object_class, page_size=VIEW_PAGE_SIZE, **values):
+        """
+        Yields the documents of a view's rows wrapped as object_class, one page at a time.
+        """
+        assert issubclass(object_class, DataObject)
+        values['include_docs'] = True
+        for row in self.iter_view(view_name, page_size, **values):
+            if row.get('doc') is not None:
+                yield object_class.new_from_doc(self, object_class.__document_class__.wrap(row['doc']))
+
     def create_view(self, view_name, map, reduce):
-        view_document = view_name # views get their own design doc for the time being
-        view = ViewDefinition(view_document, view_name, map, reduce)
+        view = ViewDefinition(design_document_of(view_name), view_name, map, reduce)
         view.sync(self.database)
 
+    def create_views(self, views):
+        """
+        Creates or updates (view_name, map, reduce) views in one bulk update. Design documents whose views are
+        unchanged are not written.
+        """
+        definitions = [ViewDefinition(design_document_of(view_name), view_name, map, reduce)
+                       for view_name, map, reduce in views]
+        return ViewDefinition.sync_many(self.database, definitions)
+
     def test_views(self):
         self._delete_design_docs()
         self.create_default_views()
@@ -229,7 +334,7 @@ class DatabaseManager(object):
         # second item is doc ID
         return result[1]
 
-    def _save_documents(self, documents, modified=None):
+    def _save_documents(self, documents, modified=None, process_post_update=False):
         assert is_sequence(documents)
         assert modified is None or isinstance(modified, datetime)
         for doc in documents:
@@ -245,26 +350,36 @@ class DatabaseManager(object):
         # an exception instance (e.g. `ResourceConflict`) if the update failed.
 
         # Fix up rev, 'cause bulk update seems not to do that
-        results = self.database.update(documents)
+        with measure(self.metrics, 'save', 'documents') as measurement:
+            results = self.database.update(documents)
+            measurement.rows = len(results)
+            measurement.error = not all(result[0] for result in results)
+        self._written()
         for x in range(len(results)):
             if results[x][0]:
                 documents[x]._data['_rev'] = results[x][2]
+                if process_post_update:
+                    documents[x].post_update(self, None)
         return results
 
     def put_attachment(self, document, attachment, attachment_name=None):
         if attachment_name is not None:
-            return self.database.put_attachment(document, attachment, attachment_name)
+            with measure(self.metrics, 'attachment', 'put'):
+                return self.database.put_attachment(document, attachment, attachment_name)
 
     def delete_attachment(self, document, attachment_name):
         if attachment_name is not None:
-            return self.database.delete_attachment(document, attachment_name)
+            with measure(self.metrics, 'attachment', 'delete'):
+                return self.database.delete_attachment(document, attachment_name)
 
     def get_attachments(self, id, attachment_name=None):
         if attachment_name is not None:
-            file = self.database.get_attachment(id, attachment_name, 'Not Found')
-            if isinstance(file, basestring):
-                raise LookupError("Attachment not found")
-            return file.read()
+            with measure(self.metrics, 'attachment', 'get'):
+                file = self.database.get_attachment(id, attachment_name, 'Not Found')
+                if isinstance(file, basestring):
+                    raise LookupError("Attachment not found")
+                content = file.read()
+            return content
 
     def invalidate(self, uid):
         doc = self._load_document(uid)
@@ -273,6 +388,11 @@ class DatabaseManager(object):
 
     def _delete_document(self, document):
         self.database.delete(document)
+        self._written()
+
+    def _written(self):
+        if self.index_warmer is not None:
+            self.index_warmer.notify()
 
     def _load_document(self, id, document_class=DocumentBase):
         """
@@ -283,8 +403,22 @@ class DatabaseManager(object):
         """
         if is_empty(id):
             return None
-        else:
-            return document_class.load(self.database, id=id)
+        with measure(self.metrics, 'load', document_class.__name__) as measurement:
+            document = document_class.load(self.database, id=id)
+            measurement.rows = 0 if document is None else 1
+        return document
+
+    def _load_documents(self, ids, document_class=DocumentBase):
+        """
+        Load many documents with a single _all_docs query. Missing and deleted documents are left out.
+        """
+        assert is_sequence(ids)
+        if is_empty(ids):
+            return []
+        with measure(self.metrics, 'load', document_class.__name__) as measurement:
+            rows = self.database.view('_all_docs', keys=ids, include_docs=True).rows
+            measurement.rows = len(rows)
+        return [document_class.wrap(row['doc']) for row in rows if 'error' not in row and row.get('doc') is not None]
 
     def get_many(self, ids, object_class):
         """
@@ -297,7 +431,9 @@ class DatabaseManager(object):
         assert is_sequence(ids)
 
         objs = []
-        rows = self.database.view('_all_docs', keys=ids, include_docs=True)
+        with measure(self.metrics, 'get_many', object_class.__name__) as measurement:
+            rows = self.database.view('_all_docs', keys=ids, include_docs=True).rows
+            measurement.rows = len(rows)
         for row in rows:
             if 'error' in row:
                 continue
@@ -341,3 +477,4 @@ class DatabaseManager(object):
 
         id = d_obj._doc.id
         self.database.delete(d_obj._doc)
+        self._written()
@@ -0,0 +1,35 @@
+# Every design document has its own indexer, which reads each changed document of the database. Views over the
+# same kind of documents share a design document so that one pass updates all of them. A change to any view
+# of a design document rebuilds the whole design document.
+DESIGN_DOCUMENTS = {
+    'entities': ['all_subjects', 'by_location', 'by_short_codes', 'by_type', 'count_entities_by_type',
+                 'count_non_voided_entities_by_type', 'datasender_by_mobile', 'datasender_by_mobile_number',
+                 'entity_by_short_code', 'get_entity_attributes'],
+    'data_records': ['by_aggregation_path', 'by_form_code_time', 'by_label_value', 'by_values', 'by_values_latest',
+                     'by_values_latest_by_time', 'data_record_by_form_code', 'entity_by_label_value', 'entity_data',
+                     'entity_datatypes', 'entity_datatypes_by_tag'],
+    'aggregates': ['daily_aggregate_latest', 'daily_aggregate_stats', 'weekly_aggregate_latest',
+                   'weekly_aggregate_stats', 'monthly_aggregate_latest', 'monthly_aggregate_stats',
+                   'yearly_aggregate_latest', 'yearly_aggregate_stats'],
+    'survey_responses': ['survey_response_by_survey_response_id', 'survey_response_for_activity_period',
+                         'surveyresponse', 'surveyresponse_by_questionnaire_id', 'undeleted_survey_response'],
+    'questionnaires': ['all_questionnaire', 'media_questionnaire', 'questionnaire',
+                       'registration_form_model_by_entity_type', 'all_media_details', 'media_attachment'],
+    'preferences': ['all_questionnaire_by_user_permission', 'all_report_configs', 'entity_preference',
+                    'entity_preference_by_share_token', 'group_by_name', 'user_permission',
+                    'user_questionnaire_preference'],
+}
+
+VIEW_DESIGN_DOCUMENTS = dict((view_name, design_document) for design_document, view_names in DESIGN_DOCUMENTS.items()
+                             for view_name in view_names)
+
+
+def design_document_of(view_name):
+    """
+    Returns the design document holding view_name. Views not listed, such as report views, get their own.
+    """
+    return VIEW_DESIGN_DOCUMENTS.get(view_name, view_name)
+
+
+def view_path(view_name):
+    return '%s/%s' % (design_document_of(view_name), view_name)
@@ -7,6 +7,7 @@ from uuid import uuid1
 from couchdb.mapping import TextField, Document, DateTimeField, DictField, BooleanField, ListField, FloatField, \
     IntegerField
 
+from mangrove.datastore import settings
 from mangrove.utils.dates import py_datetime_to_js_datestring, js_datestring_to_py_datetime, utcnow
 
 
@@ -203,7 +204,7 @@ class DataRecordDocument(DocumentBase):
     event_time = TZAwareDateTimeField()
     submission = DictField()
 
-    def __init__(self, id=None, entity_doc=None, event_time=None, data=None, submission=None):
+    def __init__(self, id=None, entity_doc=None, event_time=None, data=None, submission=None, compact=None):
         DocumentBase.__init__(self, id, 'DataRecord')
         data_record = {}
         if data is not None:
@@ -213,11 +214,28 @@ class DataRecordDocument(DocumentBase):
         self.event_time = event_time
 
         if entity_doc:
-            self.entity = entity_doc.unwrap()
+            compact = settings.COMPACT_DATA_RECORDS if compact is None else compact
+            self.entity = compact_entity(entity_doc.unwrap()) if compact else entity_doc.unwrap()
         if submission:
             self.submission = submission
 
 
+def compact_entity(entity):
+    """
+    Returns the part of an entity document a data record keeps in compact mode: the id, the short code and
+    the type path, in the same layout as the full document so the views read both alike.
+    """
+    compact = {'_id': entity.get('_id'), 'short_code': entity.get('short_code')}
+    aggregation_paths = entity.get(attributes.AGG_PATHS) or {}
+    if attributes.TYPE_PATH in aggregation_paths:
+        compact[attributes.AGG_PATHS] = {attributes.TYPE_PATH: aggregation_paths[attributes.TYPE_PATH]}
+    return compact
+
+
+def is_compact_entity(entity):
+    return entity == compact_entity(entity)
+
+
 class FormModelDocument(DocumentBase):
     metadata = DictField()
     name = TextField()
@@ -411,6 +429,24 @@ class EntityActionDocument(DocumentBase):
         self.action = action
 
 
+class ShortCodeCounterDocument(DocumentBase):
+    """
+    Next free counter value used to generate short codes for an entity type
+    """
+    entity_type = TextField()
+    next_value = IntegerField()
+
+    def __init__(self, entity_type=None, next_value=None):
+        DocumentBase.__init__(self, id=short_code_counter_id(entity_type) if entity_type else None,
+                              document_type='ShortCodeCounter')
+        self.entity_type = entity_type
+        self.next_value = next_value
+
+
+def short_code_counter_id(entity_type):
+    return 'short_code_counter_%s' % entity_type.lower()
+
+
 class GroupDocument(DocumentBase):
     name = TextField()
 
@@ -1,12 +1,17 @@
 # vim: ai ts=4 sts=4 et sw= encoding=utf-8
 
 import copy
+from collections import OrderedDict
 from datetime import datetime
+from threading import Lock
+
+from couchdb.http import ResourceConflict
 
 from database import DatabaseManager, DataObject
 from documents import EntityDocument, DataRecordDocument, attributes, ContactDocument
 from mangrove.datastore.entity_type import entity_type_already_defined
-from mangrove.errors.MangroveException import DataObjectAlreadyExists, EntityTypeDoesNotExistsException, DataObjectNotFound
+from mangrove.errors.MangroveException import DataObjectAlreadyExists, EntityTypeDoesNotExistsException, DataObjectNotFound, \
+    FailedToSaveDataObject
 from mangrove.utils.dates import utcnow, convert_date_time_to_epoch
 from mangrove.utils.types import is_empty
 from mangrove.utils.types import is_not_empty, is_sequence, is_string
@@ -24,17 +29,18 @@ def void_contact(dbm, short_code):
     entity.void()
 
 
-def create_entity(dbm, entity_type, short_code, location=None, aggregation_paths=None, geometry=None):
+def create_entity(dbm, entity_type, short_code, location=None, aggregation_paths=None, geometry=None, validate=True):
     """
     Initialize and save an entity to the database. Return the entity
     created unless the short code used is not unique or this entity
-    type has not been defined yet.
+    type has not been defined yet. validate=False skips both checks, for
+    callers that already did them for a whole batch.
     """
     assert is_string(short_code) and not is_empty(short_code)
     assert type(entity_type) is list and not is_empty(entity_type)
-    if not entity_type_already_defined(dbm, entity_type):
+    if validate and not entity_type_already_defined(dbm, entity_type):
         raise EntityTypeDoesNotExistsException(entity_type)
-    existing = _check_if_entity_exists(dbm, entity_type, short_code, return_entity=True)
+    existing = _check_if_entity_exists(dbm, entity_type, short_code, return_entity=True) if validate else None
     if existing:
         entity_name = existing.data.get('name', {'value': ''}).get('value')
         raise DataObjectAlreadyExists(entity_type[0].capitalize(), "Unique ID Number", short_code,
@@ -45,17 +51,19 @@ def create_entity(dbm, entity_type, short_code, location=None, aggregation_paths
     return e
 
 
-def create_contact(dbm, short_code, location=None, aggregation_paths=None, geometry=None, is_datasender=True):
+def create_contact(dbm, short_code, location=None, aggregation_paths=None, geometry=None, is_datasender=True,
+                   validate=True):
     """
     Initialize and save an entity to the database. Return the entity
     created unless the short code used is not unique or this entity
-    type has not been defined yet.
+    type has not been defined yet. validate=False skips both checks, for
+    callers that already did them for a whole batch.
     """
     contact_type = ["reporter"]
     assert is_string(short_code) and not is_empty(short_code)
-    if not entity_type_already_defined(dbm, contact_type):
+    if validate and not entity_type_already_defined(dbm, contact_type):
         raise EntityTypeDoesNotExistsException(contact_type)
-    existing = _check_if_entity_exists(dbm, contact_type, short_code, return_entity=True)
+    existing = _check_if_entity_exists(dbm, contact_type, short_code, return_entity=True) if validate else None
     if existing:
         entity_name = existing.data.get('name', {'value': ''}).get('value')
         raise DataObjectAlreadyExists(contact_type[0].capitalize(), "Unique ID Number", short_code,
@@ -112,6 +120,62 @@ def by_short_codes(dbm, short_codes, entity_type, limit=None):
     docs = [EntityDocument.wrap(row['doc']) for row in rows]
     return [Entity.new_from_doc(dbm, doc) for doc in docs]
 
+def by_short_code_keys(dbm, type_and_short_codes):
+    """
+    Finds the entities for many (entity_type, short_code) pairs with a single by_short_codes query.
+    Returns a dict of (tuple(entity_type), short_code) to Entity. Pairs without an entity are left out.
+    """
+    pairs = set([(tuple(entity_type), short_code) for entity_type, short_code in type_and_short_codes])
+    if not pairs:
+        return {}
+    keys = [[list(entity_type), short_code] for entity_type, short_code in pairs]
+    rows = dbm.view.by_short_codes(keys=keys, reduce=False, include_docs=True)
+    entities = {}
+    for row in rows:
+        entity_type, short_code = row['key']
+        entities[(tuple(entity_type), short_code)] = Entity.new_from_doc(dbm, EntityDocument.wrap(row['doc']))
+    return entities
+
+
+class EntityResolver(object):
+    """
+    Request scoped lookup of entities by entity type and short code. prefetch loads many subjects with one
+    by_short_codes query and every answer is memoized, so the subjects of a submission are read once for
+    validation, saving and feed enrichment.
+    """
+
+    def __init__(self, dbm):
+        self.dbm = dbm
+        self._entities = {}
+
+    def prefetch(self, type_and_short_codes):
+        keys = set([(tuple(entity_type), short_code.lower()) for entity_type, short_code in type_and_short_codes])
+        missing = [key for key in keys if key not in self._entities]
+        if len(missing) == 1:
+            self._resolve(missing[0])
+            return
+        found = by_short_code_keys(self.dbm, missing)
+        for key in missing:
+            self._entities[key] = found.get(key)
+
+    def get_by_short_code(self, short_code, entity_type):
+        assert is_string(short_code)
+        assert is_sequence(entity_type)
+        key = (tuple(entity_type), short_code.lower())
+        if key not in self._entities:
+            self._resolve(key)
+        if self._entities[key] is None:
+            raise DataObjectNotFound(entity_type[0], "Unique Identification Number (ID)", key[1])
+        return self._entities[key]
+
+    def _resolve(self, key):
+        entity_type, short_code = key
+        try:
+            self._entities[key] = by_short_code(self.dbm, short_code, list(entity_type))
+        except DataObjectNotFound:
+            self._entities[key] = None
+
+
 def _entity_by_short_code(dbm, short_code, entity_type):
     rows = dbm.view.entity_by_short_code(key=[entity_type, short_code], include_docs=True)
     if is_empty(rows):
@@ -131,6 +195,16 @@ def get_by_short_code_include_voided(dbm, short_code, entity_type):
     assert is_sequence(entity_type)
     return _entity_by_short_code(dbm, short_code.lower(), entity_type)
 
+def get_short_codes_in_use(dbm, entity_type, short_codes):
+    """
+    Returns the subset of short_codes already used by an entity of entity_type, voided ones included,
+    with a single entity_by_short_code query.
+    """
+    if not short_codes:
+        return set()
+    rows = dbm.view.entity_by_short_code(keys=[[entity_type, short_code] for short_code in short_codes])
+    return set(row['key'][1] for row in rows)
+
 def get_all_entities(dbm, entity_type=None, limit=None, filters=None, reverse_filters=None):
     """
     Returns all the entities in the Database
@@ -294,7 +368,7 @@ class Entity(DataObject):
         # aggregation paths on data records, in which case we need to
         # set a dirty flag and handle this in save.
 
-    def add_data(self, data=(), event_time=None, submission=None, multiple_records=False):
+    def add_data(self, data=(), event_time=None, submission=None, multiple_records=False, latest_data_updates=None):
         """
         Add a new datarecord to this Entity and return a UUID for the datarecord.
         Arguments:
@@ -303,6 +377,8 @@ class Entity(DataObject):
                 when it was reported
             submission_id: an id to a 'submission' document in the
                 submission log from which this data came
+            latest_data_updates: a LatestDataUpdates collecting the new
+                latest values instead of saving them with the datarecord
         """
         assert is_sequence(data)
         assert event_time is None or isinstance(event_time, datetime)
@@ -316,31 +392,15 @@ class Entity(DataObject):
         for (label, value) in data:
             if is_empty(label):
                 raise ValueError(u'Data must be of the form (label, value).')
-        self.update_latest_data(data=data)
-        if multiple_records:
-            data_list = []
-            for (label, value) in data:
-                data_record = DataRecordDocument(
-                    entity_doc=self._doc,
-                    event_time=event_time,
-                    data=[(label, value)],
-                    submission=submission
-                )
-                data_list.append(data_record)
-            return self._dbm._save_documents(data_list)
-        else:
-            data_record_doc = DataRecordDocument(
-                entity_doc=self._doc,
-                event_time=event_time,
-                data=data,
-                submission=submission
-            )
-            return self._dbm._save_document(data_record_doc)
+        return _save_data_records(self, data, event_time, submission, multiple_records, latest_data_updates)
 
     def update_latest_data(self, data):
+        self.set_latest_data(data)
+        self.save()
+
+    def set_latest_data(self, data):
         for (label, value) in data:
             self.data[label] = {'value': value}
-        self.save()
 
     def invalidate_data(self, uid):
         """
@@ -411,20 +471,14 @@ class Entity(DataObject):
     def _get_aggregate_value(self, field, aggregate_fn, date):
         entity_id = self._doc.id
         time_since_epoch_of_date = convert_date_time_to_epoch(date)
-        rows = self._dbm.load_all_rows_in_view(aggregate_fn, group_level=3, descending=False,
-                                               startkey=[self.type_path, entity_id, field],
-                                               endkey=[self.type_path, entity_id, field, time_since_epoch_of_date])
-
-        # The above will return rows in the format described:
-        # Row key=['clinic', 'e4540e0ae93042f4b583b54b6fa7d77a'],
-        #   value={'beds': {'timestamp_for_view': 1420070400000, 'value': '15'},
-        #           'entity_id': {'value': 'e4540e0ae93042f4b583b54b6fa7d77a'}, 'document_type': {'value': 'Entity'},
-        #           'arv': {'timestamp_for_view': 1420070400000, 'value': '100'}, 'entity_type': {'value': 'clinic'}
-        #           }
-        #  The aggregation map-reduce view will return only one row for an entity-id
-        # From this we return the field we are interested in.
+        rows = self._dbm.load_all_rows_in_view(aggregate_fn, descending=True, limit=1,
+                                               startkey=[self.type_path, entity_id, field, time_since_epoch_of_date],
+                                               endkey=[self.type_path, entity_id, field])
+
+        # The view is keyed by [type_path, entity_id, field, event time] with the field value as row value, so
+        # reading it backwards from date the first row holds the latest value.
         # TODO: Hardcoding to 'latest' for now. Generalize to any aggregation function.
-        return rows[0][u'value'][u'latest'] if len(rows) else None
+        return rows[0][u'value'] if len(rows) else None
 
     def _translate(self, aggregate_fn):
         view_names = {u"latest": u"by_values_latest_by_time"}
@@ -619,7 +673,7 @@ class Contact(DataObject):
         # aggregation paths on data records, in which case we need to
         # set a dirty flag and handle this in save.
 
-    def add_data(self, data=(), event_time=None, submission=None, multiple_records=False):
+    def add_data(self, data=(), event_time=None, submission=None, multiple_records=False, latest_data_updates=None):
         """
         Add a new datarecord to this Entity and return a UUID for the datarecord.
         Arguments:
@@ -628,6 +682,8 @@ class Contact(DataObject):
                 when it was reported
             submission_id: an id to a 'submission' document in the
                 submission log from which this data came
+            latest_data_updates: a LatestDataUpdates collecting the new
+                latest values instead of saving them with the datarecord
         """
         assert is_sequence(data)
         assert event_time is None or isinstance(event_time, datetime)
@@ -641,31 +697,15 @@ class Contact(DataObject):
         for (label, value) in data:
             if is_empty(label):
                 raise ValueError(u'Data must be of the form (label, value).')
-        self.update_latest_data(data=data)
-        if multiple_records:
-            data_list = []
-            for (label, value) in data:
-                data_record = DataRecordDocument(
-                    entity_doc=self._doc,
-                    event_time=event_time,
-                    data=[(label, value)],
-                    submission=submission
-                )
-                data_list.append(data_record)
-            return self._dbm._save_documents(data_list)
-        else:
-            data_record_doc = DataRecordDocument(
-                entity_doc=self._doc,
-                event_time=event_time,
-                data=data,
-                submission=submission
-            )
-            return self._dbm._save_document(data_record_doc)
+        return _save_data_records(self, data, event_time, submission, multiple_records, latest_data_updates)
 
     def update_latest_data(self, data):
+        self.set_latest_data(data)
+        self.save()
+
+    def set_latest_data(self, data):
         for (label, value) in data:
             self.data[label] = {'value': value}
-        self.save()
 
     def invalidate_data(self, uid):
         """
@@ -736,20 +776,14 @@ class Contact(DataObject):
     def _get_aggregate_value(self, field, aggregate_fn, date):
         entity_id = self._doc.id
         time_since_epoch_of_date = convert_date_time_to_epoch(date)
-        rows = self._dbm.load_all_rows_in_view(aggregate_fn, group_level=3, descending=False,
-                                               startkey=[self.type_path, entity_id, field],
-                                               endkey=[self.type_path, entity_id, field, time_since_epoch_of_date])
-
-        # The above will return rows in the format described:
-        # Row key=['clinic', 'e4540e0ae93042f4b583b54b6fa7d77a'],
-        #   value={'beds': {'timestamp_for_view': 1420070400000, 'value': '15'},
-        #           'entity_id': {'value': 'e4540e0ae93042f4b583b54b6fa7d77a'}, 'document_type': {'value': 'Entity'},
-        #           'arv': {'timestamp_for_view': 1420070400000, 'value': '100'}, 'entity_type': {'value': 'clinic'}
-        #           }
-        #  The aggregation map-reduce view will return only one row for an entity-id
-        # From this we return the field we are interested in.
+        rows = self._dbm.load_all_rows_in_view(aggregate_fn, descending=True, limit=1,
+                                               startkey=[self.type_path, entity_id, field, time_since_epoch_of_date],
+                                               endkey=[self.type_path, entity_id, field])
+
+        # The view is keyed by [type_path, entity_id, field, event time] with the field value as row value, so
+        # reading it backwards from date the first row holds the latest value.
         # TODO: Hardcoding to 'latest' for now. Generalize to any aggregation function.
-        return rows[0][u'value'][u'latest'] if len(rows) else None
+        return rows[0][u'value'] if len(rows) else None
 
     def _translate(self, aggregate_fn):
         view_names = {u"latest": u"by_values_latest_by_time"}
@@ -841,6 +875,106 @@ class DataRecord(DataObject):
         return self._doc.void
 
 
+def _save_data_records(data_object, data, event_time, submission, multiple_records, latest_data_updates):
+    """
+    Writes the data records of an Entity or Contact together with its new latest values in one bulk update.
+    With latest_data_updates the latest values are handed to it and only the data records are written.
+    """
+    if multiple_records:
+        records = [DataRecordDocument(entity_doc=data_object._doc, event_time=event_time, data=[(label, value)],
+                                      submission=submission) for (label, value) in data]
+    else:
+        records = [DataRecordDocument(entity_doc=data_object._doc, event_time=event_time, data=data,
+                                      submission=submission)]
+    if latest_data_updates is not None:
+        latest_data_updates.add(data_object, data)
+        results = data_object._dbm._save_documents(records)
+    else:
+        data_object.set_latest_data(data)
+        results = data_object._dbm._save_documents([data_object._doc] + records)
+        _check_latest_data_saved(data_object, data, results.pop(0))
+    if multiple_records:
+        return results
+    if not results[0][0]:
+        raise FailedToSaveDataObject(str(results[0]))
+    records[0].post_update(data_object._dbm, None)
+    return results[0][1]
+
+
+def _check_latest_data_saved(data_object, data, result):
+    success, document_id, rev_or_exception = result
+    if success:
+        data_object._doc.post_update(data_object._dbm, None)
+        return
+    if not isinstance(rev_or_exception, ResourceConflict):
+        raise FailedToSaveDataObject(str(result))
+    # the entity was changed meanwhile: apply the latest values to the stored version
+    data_object._set_document(data_object._dbm._load_document(data_object.id, data_object.__document_class__))
+    data_object.update_latest_data(data)
+
+
+class LatestDataUpdates(object):
+    """
+    Collects the latest values of entities receiving data records so they are written in batches. flush saves
+    every entity touched since the last flush once, with the values of its latest data records, in one bulk
+    update. Entities whose save fails stay pending for the next flush.
+    """
+
+    def __init__(self, dbm):
+        self.dbm = dbm
+        self._updates = OrderedDict()
+        self._lock = Lock()
+
+    def add(self, data_object, data):
+        with self._lock:
+            object_class, values = self._updates.setdefault(data_object.id, (data_object.__class__, OrderedDict()))
+            for (label, value) in data:
+                values[label] = value
+
+    @property
+    def pending(self):
+        return len(self._updates)
+
+    def flush(self):
+        """
+        Returns the number of entities saved. Raises FailedToSaveDataObject with every failure after putting the
+        entities which were not saved back, so the next flush saves them.
+        """
+        with self._lock:
+            updates, self._updates = self._updates, OrderedDict()
+        try:
+            ids_by_class = OrderedDict()
+            for object_id, (object_class, values) in updates.items():
+                ids_by_class.setdefault(object_class, []).append(object_id)
+            data_objects = [data_object for object_class, ids in ids_by_class.items()
+                            for data_object in self.dbm.get_many(ids, object_class)]
+            for data_object in data_objects:
+                data_object.set_latest_data(updates[data_object.id][1].items())
+            if not data_objects:
+                return 0
+            results = self.dbm._save_documents([data_object._doc for data_object in data_objects],
+                                               process_post_update=True)
+        except Exception:
+            self._requeue(updates, updates.keys())
+            raise
+        failures = [(object_id, rev_or_exception) for success, object_id, rev_or_exception in results
+                    if not success]
+        self._requeue(updates, [object_id for object_id, rev_or_exception in failures])
+        errors = [rev_or_exception for object_id, rev_or_exception in failures
+                  if not isinstance(rev_or_exception, ResourceConflict)]
+        if errors:
+            raise FailedToSaveDataObject("; ".join(str(error) for error in errors))
+        return len(results) - len(failures)
+
+    def _requeue(self, updates, object_ids):
+        # values added since the flush began are newer, so they win over the requeued ones
+        with self._lock:
+            for object_id in object_ids:
+                object_class, values = updates[object_id]
+                values.update(self._updates.get(object_id, (object_class, OrderedDict()))[1])
+                self._updates[object_id] = (object_class, values)
+
+
 def delete_data_record(dbm, form_code, short_code):
     data_records = dbm.view.data_record_by_form_code(key=[form_code, short_code])
     for data_record in data_records:
@@ -884,11 +1018,18 @@ def _get_all_entities(dbm, limit=None):
     if limit:
         kwargs['limit'] = limit
 
-    rows = dbm.view.by_short_codes(**kwargs)
-    return [from_row_to_entity(dbm, row) for row in rows]
+    return list(dbm.iter_objects('by_short_codes', Entity, **kwargs))
 
 
 def _get_all_entities_of_type(dbm, entity_type, limit=None, filters=None, reverse_filters=None):
+    return list(iter_all_entities(dbm, entity_type, limit, filters, reverse_filters))
+
+
+def iter_all_entities(dbm, entity_type, limit=None, filters=None, reverse_filters=None):
+    """
+    Yields the entities of entity_type one page of the by_short_codes view at a time, for listings and
+    exports that should not hold every entity in memory.
+    """
     kwargs = {
                 'startkey': [entity_type],
                 'endkey': [entity_type, {}],
@@ -898,8 +1039,9 @@ def _get_all_entities_of_type(dbm, entity_type, limit=None, filters=None, revers
     if limit:
         kwargs['limit'] = limit
 
-    rows = dbm.view.by_short_codes(**kwargs)
-    return [from_row_to_entity(dbm, row) for row in rows if filters is None or _is_filtered(row, filters, reverse_filters)]
+    for row in dbm.iter_view('by_short_codes', **kwargs):
+        if filters is None or _is_filtered(row, filters, reverse_filters):
+            yield from_row_to_entity(dbm, row)
 
 
 def _is_filtered(row, filters, reverse_filters=[]):
@@ -920,10 +1062,7 @@ def _is_filtered(row, filters, reverse_filters=[]):
 def get_all_entities_include_voided(dbm, entity_type):
     startkey = [entity_type]
     endkey = [entity_type, {}]
-    rows = dbm.database.iterview('entity_by_short_code/entity_by_short_code', 1000, reduce=False, include_docs=True,
-                                 startkey=startkey, endkey=endkey)
-    for row in rows:
-        yield from_row_to_entity(dbm, row)
+    return dbm.iter_objects('entity_by_short_code', Entity, reduce=False, startkey=startkey, endkey=endkey)
 
 
 def from_row_to_entity(dbm, row):
@@ -0,0 +1,66 @@
+import logging
+from threading import Thread, Event
+
+from mangrove.datastore.design_documents import design_document_of
+
+# Views read while handling a submission; keeping their indexes current lets those reads skip the index update.
+HOT_VIEWS = ['by_short_codes', 'entity_by_short_code', 'datasender_by_mobile', 'datasender_by_mobile_number',
+             'questionnaire']
+INDEX_WARMER_DELAY_SECONDS = 1.0
+
+logger = logging.getLogger('mangrove.datastore')
+
+
+class IndexWarmer(object):
+    """
+    Keeps the indexes of hot views up to date in the background. DatabaseManager calls notify after every
+    write; the warmer waits delay seconds for the burst of writes to settle, then queries one view of each
+    design document holding hot views, which brings all its indexes up to date. Reads with a stale policy then
+    find the index current, and strict reads do not wait on the update.
+
+        dbm.index_warmer = IndexWarmer(dbm)
+        dbm.index_warmer.start()
+    """
+
+    def __init__(self, dbm, view_names=None, delay=INDEX_WARMER_DELAY_SECONDS):
+        self.dbm = dbm
+        self.delay = delay
+        # the views of a design document are indexed together, so one query per design document is enough
+        design_documents = {}
+        for view_name in view_names if view_names is not None else HOT_VIEWS:
+            design_documents.setdefault(design_document_of(view_name), view_name)
+        self.view_names = sorted(design_documents.values())
+        self._written = Event()
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, name='index-warmer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def notify(self):
+        self._written.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._written.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            self._written.wait()
+            if self._stopped.wait(self.delay):
+                return
+            self._written.clear()
+            self.warm()
+
+    def warm(self):
+        for view_name in self.view_names:
+            try:
+                self.dbm.load_all_rows_in_view(view_name, stale=None, limit=0)
+            except Exception:
+                logger.exception("could not warm the index of %s" % view_name)
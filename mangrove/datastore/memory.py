@@ -0,0 +1,515 @@
+"""
+An in-process stand-in for a CouchDB server, selected by giving DatabaseManager a memory:// server url.
+
+    dbm = get_db_manager('memory://', 'benchmark')
+
+InMemoryDatabase implements the parts of couchdb.client.Database mangrove uses: documents with revisions and
+conflicts, bulk update, attachments, _all_docs and view queries. Views run the Python ports of the bootstrap
+views in memory_views with the built-in _count, _sum and _stats reducers or the ports of their JavaScript
+reduces. Like CouchDB, a view index is brought up to date with the documents changed since its last query when
+it is next read, and is shared by design documents with the same map function. Data lives as long as the process.
+"""
+import hashlib
+import json
+import uuid
+from bisect import bisect_left, insort
+from StringIO import StringIO
+from threading import Lock, RLock
+
+import couchdb.json
+from couchdb.client import Document, Row
+from couchdb.http import ResourceConflict, ResourceNotFound, PreconditionFailed
+
+from mangrove.datastore.memory_views import MAP_FUNCTIONS, REDUCE_FUNCTIONS
+
+MEMORY_SERVER_URL = 'memory://'
+
+_servers = {}
+_servers_lock = Lock()
+
+
+def get_memory_server(url=MEMORY_SERVER_URL):
+    with _servers_lock:
+        if url not in _servers:
+            _servers[url] = InMemoryServer(url)
+        return _servers[url]
+
+
+def is_memory_server(url):
+    return url is not None and url.startswith(MEMORY_SERVER_URL)
+
+
+class _Max(object):
+    """Sorts after any document id."""
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return other is self
+
+    def __gt__(self, other):
+        return other is not self
+
+    def __ge__(self, other):
+        return True
+
+    def __eq__(self, other):
+        return other is self
+
+    def __ne__(self, other):
+        return other is not self
+
+
+_MAX = _Max()
+_MISSING = object()
+
+
+def collation_key(value):
+    """
+    Returns a sort key ordering JSON values the way CouchDB collates view keys: null, false, true, numbers,
+    strings, arrays then objects. Strings approximate the ICU order, lowercase before uppercase.
+    """
+    if value is None:
+        return (0,)
+    if value is False:
+        return (1,)
+    if value is True:
+        return (2,)
+    if isinstance(value, (int, long, float)):
+        return (3, value)
+    if isinstance(value, basestring):
+        return (4, value.lower(), value.swapcase())
+    if isinstance(value, (list, tuple)):
+        return (5, tuple(collation_key(item) for item in value))
+    if isinstance(value, dict):
+        return (6, tuple((collation_key(key), collation_key(item)) for key, item in value.items()))
+    raise TypeError("can not collate %r" % (value,))
+
+
+def _stored(value):
+    # documents are kept as plain JSON, as CouchDB keeps them
+    return json.loads(couchdb.json.encode(value))
+
+
+def _loaded(value):
+    # and handed out through the JSON decoder in use, as the HTTP client would
+    return couchdb.json.decode(json.dumps(value))
+
+
+def _sum(values):
+    if values and isinstance(values[0], list):
+        return [sum(column) for column in map(None, *values)]
+    return sum(values)
+
+
+def _stats(values):
+    if values and isinstance(values[0], dict):
+        return {'sum': sum(stats['sum'] for stats in values), 'count': sum(stats['count'] for stats in values),
+                'min': min(stats['min'] for stats in values), 'max': max(stats['max'] for stats in values),
+                'sumsqr': sum(stats['sumsqr'] for stats in values)}
+    return {'sum': sum(values), 'count': len(values), 'min': min(values), 'max': max(values),
+            'sumsqr': sum(value * value for value in values)}
+
+
+BUILT_IN_REDUCERS = {'_count': len, '_sum': _sum, '_stats': _stats}
+
+
+class ViewResults(object):
+    def __init__(self, rows, total_rows=None, offset=None):
+        self.rows = rows
+        self.total_rows = total_rows
+        self.offset = offset
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+
+class ViewIndex(object):
+    """
+    The sorted rows of one map function. Entries are (collation key, document id, emit number, key, value).
+    """
+
+    def __init__(self, map_function):
+        self.map_function = map_function
+        self.entries = []
+        self.by_document = {}
+        self.update_seq = 0
+
+    def update(self, database):
+        changed = database.changes_since(self.update_seq)
+        for document_id in changed:
+            for entry in self.by_document.pop(document_id, []):
+                del self.entries[bisect_left(self.entries, entry)]
+            doc = database.documents.get(document_id)
+            if doc is None or document_id.startswith('_design/'):
+                continue
+            try:
+                emitted = list(self.map_function(doc))
+            except Exception:
+                # CouchDB leaves out the documents its map function fails on
+                continue
+            entries = [(collation_key(key), document_id, number, key, value)
+                       for number, (key, value) in enumerate(emitted)]
+            for entry in entries:
+                insort(self.entries, entry)
+            if entries:
+                self.by_document[document_id] = entries
+        self.update_seq = database.update_seq
+
+    def select(self, options):
+        if 'keys' in options or 'key' in options:
+            keys = options['keys'] if 'keys' in options else [options['key']]
+            selected = []
+            for key in keys:
+                key_entries = self.entries[bisect_left(self.entries, (collation_key(key),)):
+                                           bisect_left(self.entries, (collation_key(key), _MAX))]
+                selected.extend(reversed(key_entries) if options.get('descending') else key_entries)
+            return selected
+        startkey = options.get('startkey', options.get('start_key', _MISSING))
+        endkey = options.get('endkey', options.get('end_key', _MISSING))
+        startkey_docid = options.get('startkey_docid', options.get('start_key_doc_id'))
+        endkey_docid = options.get('endkey_docid', options.get('end_key_doc_id'))
+        inclusive_end = options.get('inclusive_end', True)
+        if options.get('descending'):
+            high = len(self.entries) if startkey is _MISSING else bisect_left(
+                self.entries, (collation_key(startkey),) + ((startkey_docid, _MAX) if startkey_docid else (_MAX,)))
+            if endkey is _MISSING:
+                low = 0
+            elif inclusive_end:
+                low = bisect_left(self.entries, (collation_key(endkey),) + ((endkey_docid,) if endkey_docid else ()))
+            else:
+                low = bisect_left(self.entries,
+                                  (collation_key(endkey),) + ((endkey_docid, _MAX) if endkey_docid else (_MAX,)))
+            return list(reversed(self.entries[low:high]))
+        low = 0 if startkey is _MISSING else bisect_left(
+            self.entries, (collation_key(startkey),) + ((startkey_docid,) if startkey_docid else ()))
+        if endkey is _MISSING:
+            high = len(self.entries)
+        elif inclusive_end:
+            high = bisect_left(self.entries,
+                               (collation_key(endkey),) + ((endkey_docid, _MAX) if endkey_docid else (_MAX,)))
+        else:
+            high = bisect_left(self.entries, (collation_key(endkey),) + ((endkey_docid,) if endkey_docid else ()))
+        return self.entries[low:high]
+
+
+class InMemoryDatabase(object):
+    def __init__(self, name):
+        self._name = name
+        self.documents = {}
+        self.update_seq = 0
+        self._changes = []
+        self._deleted = {}
+        self._attachments = {}
+        self._indexes = {}
+        self._lock = RLock()
+
+    @property
+    def name(self):
+        return self._name
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self._name)
+
+    def __contains__(self, id):
+        return id in self.documents
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __getitem__(self, id):
+        doc = self.get(id)
+        if doc is None:
+            raise ResourceNotFound(('not_found', 'missing'))
+        return doc
+
+    def __delitem__(self, id):
+        with self._lock:
+            doc = self[id]
+            self.delete(doc)
+
+    def get(self, id, default=None, **options):
+        with self._lock:
+            doc = self.documents.get(id)
+            return Document(_loaded(doc)) if doc is not None else default
+
+    def save(self, doc, **options):
+        with self._lock:
+            success, id, rev = self._write(doc)
+            if not success:
+                raise rev
+            doc.update({'_id': id, '_rev': rev})
+            return id, rev
+
+    def update(self, documents, **options):
+        with self._lock:
+            results = []
+            for doc in documents:
+                if isinstance(doc, dict):
+                    content = doc
+                elif hasattr(doc, 'items'):
+                    content = dict(doc.items())
+                else:
+                    raise TypeError('expected dict, got %s' % type(doc))
+                result = self._write(content)
+                if result[0] and isinstance(doc, dict):
+                    doc.update({'_id': result[1], '_rev': result[2]})
+                results.append(result)
+            return results
+
+    def delete(self, doc):
+        with self._lock:
+            success, id, rev = self._write(dict(_id=doc['_id'], _rev=doc.get('_rev'), _deleted=True))
+            if not success:
+                raise rev
+
+    def _write(self, doc):
+        doc = _stored(doc)
+        id = doc.get('_id') or uuid.uuid4().hex
+        current = self.documents.get(id)
+        current_rev = current['_rev'] if current is not None else self._deleted.get(id)
+        if doc.get('_rev') != current_rev and (current is not None or doc.get('_rev') is not None):
+            return False, id, ResourceConflict(('conflict', 'Document update conflict.'))
+        generation = int(current_rev.split('-')[0]) if current_rev else 0
+        rev = '%d-%s' % (generation + 1, uuid.uuid4().hex)
+        if doc.get('_deleted'):
+            if current is None:
+                return False, id, ResourceNotFound(('not_found', 'missing'))
+            del self.documents[id]
+            self._attachments.pop(id, None)
+            self._deleted[id] = rev
+        else:
+            doc.update({'_id': id, '_rev': rev})
+            # like CouchDB, attachments not kept in the new revision's stubs are dropped
+            kept = doc.get('_attachments') or {}
+            attachments = self._attachments.get(id, {})
+            self._attachments[id] = dict((name, attachment) for name, attachment in attachments.items()
+                                         if name in kept)
+            self._set_attachment_stubs(doc)
+            self.documents[id] = doc
+            self._deleted.pop(id, None)
+        self._changed(id)
+        return True, id, rev
+
+    def _set_attachment_stubs(self, doc):
+        attachments = self._attachments.get(doc['_id'])
+        if attachments:
+            doc['_attachments'] = dict((name, {'content_type': content_type, 'length': len(content), 'stub': True})
+                                       for name, (content_type, content) in attachments.items())
+        else:
+            doc.pop('_attachments', None)
+
+    def _changed(self, id):
+        self.update_seq += 1
+        self._changes.append(id)
+
+    def changes_since(self, seq):
+        """
+        Returns the ids of the documents written after update sequence seq, each once.
+        """
+        seen = set()
+        changed = []
+        for id in self._changes[seq:]:
+            if id not in seen:
+                seen.add(id)
+                changed.append(id)
+        return changed
+
+    def put_attachment(self, doc, content, filename=None, content_type=None):
+        with self._lock:
+            if hasattr(content, 'read'):
+                content = content.read()
+            if filename is None:
+                filename = getattr(content, 'name', None)
+            current = self.documents.get(doc['_id'])
+            if current is None or current['_rev'] != doc.get('_rev'):
+                raise ResourceConflict(('conflict', 'Document update conflict.'))
+            self._attachments.setdefault(doc['_id'], {})[filename] = (
+                content_type or 'application/octet-stream', content)
+            current = dict(current)
+            current['_attachments'] = dict(current.get('_attachments') or {})
+            current['_attachments'][filename] = {'stub': True}
+            success, id, rev = self._write(current)
+            doc['_rev'] = rev
+
+    def get_attachment(self, id_or_doc, filename, default=None):
+        with self._lock:
+            id = id_or_doc['_id'] if isinstance(id_or_doc, dict) else id_or_doc
+            attachment = self._attachments.get(id, {}).get(filename)
+            return StringIO(attachment[1]) if attachment is not None else default
+
+    def delete_attachment(self, doc, filename):
+        with self._lock:
+            current = self.documents.get(doc['_id'])
+            if current is None or current['_rev'] != doc.get('_rev'):
+                raise ResourceConflict(('conflict', 'Document update conflict.'))
+            self._attachments.get(doc['_id'], {}).pop(filename, None)
+            current = dict(current)
+            current['_attachments'] = dict((name, {'stub': True}) for name in self._attachments.get(doc['_id'], {}))
+            success, id, rev = self._write(current)
+            doc['_rev'] = rev
+
+    def info(self, ddoc=None):
+        with self._lock:
+            if ddoc is None:
+                return {'db_name': self._name, 'doc_count': len(self.documents), 'update_seq': self.update_seq}
+            design_doc = self.documents.get('_design/%s' % ddoc)
+            if design_doc is None:
+                raise ResourceNotFound(('not_found', 'missing'))
+            # there is no background updater; the indexes are brought up to date as CouchDB's would have been
+            self._update_indexes(design_doc)
+            return {'name': ddoc, 'view_index': {'update_seq': self.update_seq, 'updater_running': False}}
+
+    def cleanup(self):
+        """
+        Drops the indexes no design document uses any more.
+        """
+        with self._lock:
+            in_use = set(self._index_key(view) for id, doc in self.documents.items() if id.startswith('_design/')
+                         for view in doc.get('views', {}).values())
+            for key in set(self._indexes) - in_use:
+                del self._indexes[key]
+            return True
+
+    def view(self, name, wrapper=None, **options):
+        with self._lock:
+            if name == '_all_docs':
+                return self._all_docs(options)
+            design, view_name = name.split('/', 1)
+            design_doc = self.documents.get('_design/%s' % design)
+            view = (design_doc or {}).get('views', {}).get(view_name)
+            if view is None:
+                raise ResourceNotFound(('not_found', 'missing_named_view'))
+            self._update_indexes(design_doc)
+            index = self._index(view_name, view)
+            selected = index.select(options)
+            reduce_source = view.get('reduce')
+            if reduce_source is not None and options.get('reduce', True):
+                rows = self._reduce(view_name, reduce_source, selected, options)
+            else:
+                rows = [self._row(entry, options.get('include_docs')) for entry in selected]
+            return ViewResults(self._page(rows, options), len(index.entries), options.get('skip', 0))
+
+    def _update_indexes(self, design_doc):
+        # like CouchDB, the indexes of all the views in a design document are updated together
+        for view_name, view in design_doc.get('views', {}).items():
+            self._index(view_name, view).update(self)
+
+    def _index_key(self, view):
+        return hashlib.sha1(json.dumps(view, sort_keys=True)).hexdigest()
+
+    def _index(self, view_name, view):
+        key = self._index_key(view)
+        if key not in self._indexes:
+            if view_name not in MAP_FUNCTIONS:
+                raise NotImplementedError("the in-memory database has no Python port of the view %s" % view_name)
+            self._indexes[key] = ViewIndex(MAP_FUNCTIONS[view_name])
+        return self._indexes[key]
+
+    def _reduce(self, view_name, reduce_source, selected, options):
+        reducer = BUILT_IN_REDUCERS.get(reduce_source.strip(), REDUCE_FUNCTIONS.get(view_name))
+        if reducer is None:
+            raise NotImplementedError("the in-memory database has no Python port of the reduce of %s" % view_name)
+        if options.get('group'):
+            group_key = lambda key: key
+        elif options.get('group_level'):
+            level = options['group_level']
+            group_key = lambda key: key[:level] if isinstance(key, list) else key
+        else:
+            group_key = lambda key: None
+        rows = []
+        for entry in selected:
+            key = group_key(entry[3])
+            if rows and rows[-1][0] == key:
+                rows[-1][1].append(entry[4])
+            else:
+                rows.append((key, [entry[4]]))
+        return [Row(key=key, value=reducer(values)) for key, values in rows]
+
+    def _row(self, entry, include_docs):
+        row = Row(id=entry[1], key=_loaded(entry[3]), value=_loaded(entry[4]))
+        if include_docs:
+            # a value with an _id links to another document
+            value = entry[4]
+            id = value['_id'] if isinstance(value, dict) and '_id' in value else entry[1]
+            doc = self.documents.get(id)
+            row['doc'] = _loaded(doc) if doc is not None else None
+        return row
+
+    def _page(self, rows, options):
+        skip = options.get('skip', 0)
+        limit = options.get('limit')
+        return rows[skip:skip + limit] if limit is not None else rows[skip:]
+
+    def _all_docs(self, options):
+        include_docs = options.get('include_docs')
+        if 'keys' in options:
+            rows = []
+            for id in options['keys']:
+                if id in self.documents:
+                    rows.append(self._document_row(id, include_docs))
+                elif id in self._deleted:
+                    rows.append(Row(id=id, key=id, value={'rev': self._deleted[id], 'deleted': True}, doc=None))
+                else:
+                    rows.append(Row(key=id, error='not_found'))
+            return ViewResults(self._page(rows, options), len(self.documents), options.get('skip', 0))
+        ids = sorted(self.documents)
+        startkey = options.get('startkey', options.get('start_key'))
+        endkey = options.get('endkey', options.get('end_key'))
+        descending = options.get('descending')
+        if descending:
+            ids.reverse()
+        selected = []
+        for id in ids:
+            if startkey is not None and (id > startkey if descending else id < startkey):
+                continue
+            if endkey is not None and (id < endkey if descending else id > endkey):
+                continue
+            selected.append(id)
+        rows = [self._document_row(id, include_docs) for id in selected]
+        return ViewResults(self._page(rows, options), len(self.documents), options.get('skip', 0))
+
+    def _document_row(self, id, include_docs):
+        doc = self.documents[id]
+        row = Row(id=id, key=id, value={'rev': doc['_rev']})
+        if include_docs:
+            row['doc'] = _loaded(doc)
+        return row
+
+
+class InMemoryServer(object):
+    def __init__(self, url=MEMORY_SERVER_URL):
+        self.url = url
+        self._databases = {}
+        self._lock = Lock()
+
+    def __contains__(self, name):
+        return name in self._databases
+
+    def __iter__(self):
+        return iter(self._databases)
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            raise ResourceNotFound(('not_found', 'no_db_file'))
+        return self._databases[name]
+
+    def __delitem__(self, name):
+        with self._lock:
+            if name not in self._databases:
+                raise ResourceNotFound(('not_found', 'missing'))
+            del self._databases[name]
+
+    def create(self, name):
+        with self._lock:
+            if name in self._databases:
+                raise PreconditionFailed(('file_exists', 'The database could not be created.'))
+            self._databases[name] = InMemoryDatabase(name)
+            return self._databases[name]
@@ -0,0 +1,305 @@
+"""
+Python ports of the map functions in bootstrap/views, used by the in-memory database. Each takes a document and
+yields the (key, value) rows the JavaScript function emits. Dates follow Date.parse and new Date in UTC.
+REDUCE_FUNCTIONS ports the JavaScript reduces; they are called with all the values of a group at once.
+"""
+from mangrove.utils.dates import js_datestring_to_py_datetime, convert_date_time_to_epoch
+
+
+def _parse_date(value):
+    # Date.parse; NaN is emitted as null
+    try:
+        return convert_date_time_to_epoch(js_datestring_to_py_datetime(value))
+    except (ValueError, TypeError):
+        return None
+
+
+def _date(value):
+    return js_datestring_to_py_datetime(value)
+
+
+def _is_number(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+
+def _type_path(doc):
+    return doc['aggregation_paths']['_type']
+
+
+def _data_record_fields(doc):
+    for field, data in (doc.get('data') or {}).items():
+        yield field, data.get('value')
+
+
+def all_media_details(doc):
+    if doc.get('document_type') == 'MediaDetails':
+        yield doc.get('questionnaire_id'), doc.get('size')
+
+
+def all_questionnaire(doc):
+    if doc.get('document_type') == 'FormModel' and not doc.get('void') and doc.get('form_code') not in ('reg', 'delete'):
+        yield [doc.get('created'), doc['name'].lower()], doc
+
+
+def all_questionnaire_by_user_permission(doc):
+    if doc.get('document_type') == 'UserPermission' and not doc.get('void'):
+        for project_id in doc['project_ids']:
+            yield doc.get('user_id'), {'_id': project_id}
+
+
+def all_report_configs(doc):
+    if doc.get('document_type') == 'ReportConfig':
+        yield doc['_id'], doc
+
+
+def all_subjects(doc):
+    if doc.get('document_type') == 'Entity' and not doc.get('void') and _type_path(doc)[0] != 'reporter':
+        yield _type_path(doc), doc
+
+
+def by_aggregation_path(doc):
+    if not doc.get('void') and doc.get('document_type') == 'DataRecord':
+        date = _date(doc['event_time'])
+        dates = [date.year, date.month, date.day, date.hour, date.minute, date.second]
+        for field, value in _data_record_fields(doc):
+            if _is_number(value):
+                for path, names in doc['entity']['aggregation_paths'].items():
+                    yield [_type_path(doc['entity']), path, field] + list(names) + dates, value
+
+
+def by_form_code_time(doc):
+    if not doc.get('void') and doc.get('document_type') == 'DataRecord':
+        date = _parse_date(doc.get('event_time'))
+        for field, value in _data_record_fields(doc):
+            yield [doc['submission'].get('form_code'), date, doc['entity']['_id'], field], value
+
+
+def by_label_value(doc):
+    if doc.get('document_type') == 'DataRecord' and not doc.get('void'):
+        for field, value in _data_record_fields(doc):
+            yield [field, value], doc['entity']['_id']
+
+
+def by_location(doc):
+    if not doc.get('void') and doc.get('document_type') == 'Entity':
+        yield [_type_path(doc), doc['aggregation_paths'].get('_geo')], doc['_id']
+
+
+def by_short_codes(doc):
+    if doc.get('document_type') in ('Entity', 'Contact') and not doc.get('void'):
+        yield [_type_path(doc), doc.get('short_code')], None
+
+
+def by_type(doc):
+    if doc.get('document_type') == 'Entity' and not doc.get('void'):
+        for entity_type in _type_path(doc):
+            yield entity_type, 1
+
+
+def _by_values(doc, with_form_code, numbers_only):
+    if not doc.get('void') and doc.get('document_type') == 'DataRecord':
+        date = _parse_date(doc.get('event_time'))
+        entity = doc['entity']
+        for field, value in _data_record_fields(doc):
+            if numbers_only and not _is_number(value):
+                continue
+            key = [_type_path(entity), entity['_id'], field]
+            key += [doc['submission'].get('form_code'), date] if with_form_code else [date]
+            yield key, value
+
+
+def by_values(doc):
+    return _by_values(doc, True, True)
+
+
+def by_values_latest(doc):
+    return _by_values(doc, True, False)
+
+
+def by_values_latest_by_time(doc):
+    return _by_values(doc, False, False)
+
+
+def count_entities_by_type(doc):
+    if doc.get('document_type') in ('Entity', 'Contact'):
+        yield _type_path(doc), 1
+
+
+def count_non_voided_entities_by_type(doc):
+    if doc.get('document_type') == 'Entity' and not doc.get('void'):
+        yield _type_path(doc), 1
+
+
+def data_record_by_form_code(doc):
+    if doc.get('document_type') == 'DataRecord':
+        yield [doc['submission'].get('form_code'), doc['entity'].get('short_code')], doc
+
+
+def _is_reporter(doc):
+    return doc.get('document_type') == 'Contact' and _type_path(doc)[0] == 'reporter' and not doc.get('void')
+
+
+def datasender_by_mobile(doc):
+    if _is_reporter(doc):
+        yield [doc['data']['mobile_number']['value'], doc.get('short_code')], None
+
+
+def datasender_by_mobile_number(doc):
+    if _is_reporter(doc):
+        yield doc['data']['mobile_number']['value'], None
+
+
+def entity_by_label_value(doc):
+    if doc.get('document_type') == 'DataRecord' and not doc.get('void'):
+        for field, value in _data_record_fields(doc):
+            yield [_type_path(doc['entity']), field, value], doc['entity']['_id']
+
+
+def entity_by_short_code(doc):
+    if doc.get('document_type') in ('Entity', 'Contact'):
+        yield [_type_path(doc), doc.get('short_code')], None
+
+
+def entity_data(doc):
+    if doc.get('document_type') == 'DataRecord' and doc.get('entity') is not None:
+        yield doc['entity']['_id'], 1
+
+
+def entity_datatypes(doc):
+    if doc.get('document_type') == 'DataRecord':
+        for data in (doc.get('data') or {}).values():
+            yield doc['entity']['_id'], data['type']['_id']
+
+
+def entity_datatypes_by_tag(doc):
+    if doc.get('document_type') == 'DataRecord':
+        for data in (doc.get('data') or {}).values():
+            for tag in data['type'].get('tags') or []:
+                yield [doc['entity']['_id'], tag], data['type']['_id']
+
+
+def entity_preference(doc):
+    if doc.get('document_type') == 'EntityPreference' and not doc.get('void'):
+        yield [doc.get('org_id'), doc.get('entity_type')], doc
+
+
+def entity_preference_by_share_token(doc):
+    if doc.get('document_type') == 'EntityPreference' and not doc.get('void'):
+        yield doc.get('share_token'), doc
+
+
+def get_entity_attributes(doc):
+    if doc.get('document_type') == 'Entity':
+        # the JavaScript emits an undefined key, i.e. null, for an entity without data
+        key = [_type_path(doc), doc.get('short_code')] if doc.get('data') else None
+        yield key, dict((field, data.get('value')) for field, data in (doc.get('data') or {}).items())
+
+
+def group_by_name(doc):
+    if doc.get('document_type') == 'group':
+        yield doc['name'].lower(), doc
+
+
+def media_attachment(doc):
+    if doc.get('document_type') == 'MediaDetails' and not doc.get('is_preview') and doc.get('size') > 0:
+        yield doc.get('questionnaire_id'), 1
+
+
+def media_questionnaire(doc):
+    if doc.get('document_type') == 'FormModel' and doc.get('xform') and doc.get('is_media_type_fields_present'):
+        yield doc['_id'], doc
+
+
+def questionnaire(doc):
+    if doc.get('document_type') == 'FormModel' and not doc.get('void'):
+        yield doc.get('form_code'), None
+
+
+def registration_form_model_by_entity_type(doc):
+    if doc.get('document_type') == 'FormModel' and not doc.get('void') and doc.get('is_registration_model'):
+        yield doc.get('entity_type'), None
+
+
+def survey_response_by_survey_response_id(doc):
+    if doc.get('document_type') == 'SurveyResponse':
+        yield doc['_id'], doc
+
+
+def survey_response_for_activity_period(doc):
+    if doc.get('document_type') == 'SurveyResponse' and not doc.get('void'):
+        yield [doc.get('form_model_id'), _parse_date(doc.get('event_time'))], doc
+
+
+def surveyresponse(doc):
+    if doc.get('document_type') == 'SurveyResponse':
+        yield [doc.get('form_model_id'), _parse_date(doc.get('created'))], 1 if doc.get('status') else 0
+
+
+def surveyresponse_by_questionnaire_id(doc):
+    if doc.get('document_type') == 'SurveyResponse':
+        yield doc.get('form_model_id'), None
+
+
+def undeleted_survey_response(doc):
+    if doc.get('document_type') == 'SurveyResponse' and not doc.get('void'):
+        yield [doc.get('form_model_id'), _parse_date(doc.get('created'))], 1 if doc.get('status') else 0
+
+
+def user_permission(doc):
+    if doc.get('document_type') == 'UserPermission' and not doc.get('void'):
+        yield doc.get('user_id'), doc
+
+
+def user_questionnaire_preference(doc):
+    if doc.get('document_type') == 'UserQuestionnairePreference' and not doc.get('void'):
+        yield [doc.get('user_id'), doc.get('project_id')], doc
+
+
+def _json_date(date):
+    # a Date emitted in a value is serialised by JSON.stringify
+    return '%s.%03dZ' % (date.strftime('%Y-%m-%dT%H:%M:%S'), date.microsecond / 1000)
+
+
+def _latest_value(values):
+    # reduce_*_aggregate_latest.js: the value with the latest timestamp
+    current = max(values, key=lambda value: value['timestamp'])
+    return {'latest': current['value'], 'timestamp': current['timestamp']}
+
+
+def _week(date):
+    # getWeek in map_weekly_aggregate_*.js: the ISO week number
+    return date.isocalendar()[1]
+
+
+_PERIODS = {
+    'daily': lambda date: [date.year, date.month, date.day],
+    'weekly': lambda date: [date.year, _week(date)],
+    'monthly': lambda date: [date.year, date.month],
+    'yearly': lambda date: [date.year],
+}
+
+
+def _aggregate(period, latest):
+    def map_function(doc):
+        if not doc.get('void') and doc.get('document_type') == 'DataRecord':
+            date = _date(doc['event_time'])
+            entity = doc['entity']
+            prefix = _PERIODS[period](date) + [doc['submission'].get('form_code'), _type_path(entity),
+                                               entity.get('short_code')]
+            for field, value in _data_record_fields(doc):
+                if latest:
+                    yield prefix + [field], {'timestamp': _json_date(date), 'value': value}
+                elif _is_number(value):
+                    yield prefix + [field], value
+    map_function.__name__ = '%s_aggregate_%s' % (period, 'latest' if latest else 'stats')
+    return map_function
+
+
+MAP_FUNCTIONS = dict((name, function) for name, function in globals().items()
+                     if callable(function) and not name.startswith('_') and function.__module__ == __name__)
+for _period in _PERIODS:
+    for _latest in (True, False):
+        _function = _aggregate(_period, _latest)
+        MAP_FUNCTIONS[_function.__name__] = _function
+
+REDUCE_FUNCTIONS = dict(('%s_aggregate_latest' % _period, _latest_value) for _period in _PERIODS)
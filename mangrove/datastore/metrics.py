@@ -0,0 +1,127 @@
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+logger = logging.getLogger('mangrove.metrics')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Measurement(object):
+    """
+    One timed database call. The caller fills in the rows it knows about.
+    """
+
+    def __init__(self, operation, name):
+        self.operation = operation
+        self.name = name
+        self.seconds = 0.0
+        self.rows = 0
+        self.error = False
+
+
+class OperationStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, measurement):
+        self.calls += 1
+        self.errors += 1 if measurement.error else 0
+        self.rows += measurement.rows
+        self.seconds += measurement.seconds
+        self.max_seconds = max(self.max_seconds, measurement.seconds)
+        self.buckets[bisect_left(LATENCY_BUCKETS, measurement.seconds)] += 1
+
+    def to_dict(self):
+        return {'calls': self.calls, 'errors': self.errors, 'rows': self.rows,
+                'seconds': self.seconds, 'max_seconds': self.max_seconds,
+                'histogram': zip(LATENCY_BUCKETS + (float('inf'),), self.buckets)}
+
+
+class InMemoryMetrics(object):
+    """
+    Default metrics sink: keeps call counts, errors, rows and a latency histogram per (operation, name),
+    e.g. ('view', 'by_short_codes') or ('save', 'documents'). Exporters added with add_exporter are called
+    with every Measurement, which is where StatsD or Prometheus clients hook in. A failing exporter is logged
+    and skipped, so it neither fails the measured call nor replaces its exception.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._exporters = []
+        self._lock = Lock()
+
+    def add_exporter(self, exporter):
+        with self._lock:
+            self._exporters = self._exporters + [exporter]
+
+    def remove_exporter(self, exporter):
+        with self._lock:
+            exporters = list(self._exporters)
+            exporters.remove(exporter)
+            self._exporters = exporters
+
+    def record(self, measurement):
+        with self._lock:
+            key = (measurement.operation, measurement.name)
+            if key not in self._stats:
+                self._stats[key] = OperationStats()
+            self._stats[key].add(measurement)
+            exporters = self._exporters
+        # exporters run outside the lock; the list is replaced rather than changed, so this one stays as it is
+        for exporter in exporters:
+            try:
+                exporter(measurement)
+            except Exception:
+                logger.exception("metrics exporter %r failed on %s %s", exporter, measurement.operation,
+                                 measurement.name)
+
+    def snapshot(self):
+        with self._lock:
+            return dict((key, stats.to_dict()) for key, stats in self._stats.items())
+
+    def slowest(self, count=10):
+        """
+        Returns the (operation, name) keys and their stats taking the most time in total, slowest first.
+        """
+        return sorted(self.snapshot().items(), key=lambda item: item[1]['seconds'], reverse=True)[:count]
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+_metrics = InMemoryMetrics()
+
+
+def get_metrics():
+    return _metrics
+
+
+def set_metrics(metrics):
+    """
+    Replaces the sink used by database managers created afterwards. metrics needs a record(measurement) method.
+    """
+    global _metrics
+    _metrics = metrics
+
+
+@contextmanager
+def measure(metrics, operation, name):
+    measurement = Measurement(operation, name)
+    start = time.time()
+    try:
+        yield measurement
+    except Exception:
+        measurement.error = True
+        raise
+    finally:
+        measurement.seconds = time.time() - start
+        metrics.record(measurement)
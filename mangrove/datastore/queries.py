@@ -16,8 +16,7 @@ def get_non_voided_entity_count_for_type(dbm, entity_type):
     return rows[0][u"value"] if len(rows) else 0
 
 def get_all_by_type(dbm, entity_type):
-    rows = dbm.view.by_type(key=entity_type,include_docs=True)
-    return [row['doc'] for row in rows]
+    return [row['doc'] for row in dbm.iter_view('by_type', key=entity_type, include_docs=True)]
 
 def get_all_reporters(dbm):
     """
@@ -25,10 +24,11 @@ def get_all_reporters(dbm):
     """
     # TODO: change this?  for now it assumes _type is
     # non-heirarchical. Might also benefit from using get_many.
-    assert isinstance(dbm, DatabaseManager)
-
-    rows = dbm.view.by_type(key="reporter", include_docs=True)
-    return [_get_contact_from_json(dbm, row['doc']) for row in rows]
+    return list(iter_all_reporters(dbm))
 
-def _get_contact_from_json(dbm ,doc):
-    return Contact.new_from_doc(dbm, Contact.__document_class__.wrap(doc))
+def iter_all_reporters(dbm):
+    """
+    Yields all reporters one page of the by_type view at a time.
+    """
+    assert isinstance(dbm, DatabaseManager)
+    return dbm.iter_objects('by_type', Contact, key="reporter")
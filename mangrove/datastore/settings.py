@@ -4,4 +4,13 @@ COUCHDB_USERNAME = 'admin'
 COUCHDB_PASSWORD = 'admin'
 COUCHDB_CREDENTIALS = (COUCHDB_USERNAME,COUCHDB_PASSWORD)
 CACHE_SERVERS = ["127.0.0.1"]
-
+CACHE_POOL_SIZE = 10
+# seconds to wait for a pooled memcached client before treating the operation as a cache miss
+CACHE_POOL_TIMEOUT = 0.5
+SHORT_CODE_BLOCK_SIZE = 20
+COMPACT_DATA_RECORDS = True
+# view name -> 'ok' or 'update_after' for views which may be read from a stale index
+VIEW_READ_POLICIES = {}
+# time the stages of every submission into the metrics sink, and attach them to this share of the responses
+STAGE_TIMING = False
+STAGE_TIMING_SAMPLE_RATE = 0.01
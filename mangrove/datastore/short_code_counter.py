@@ -0,0 +1,85 @@
+from threading import Lock
+
+from couchdb.http import ResourceConflict
+
+from mangrove.datastore.documents import ShortCodeCounterDocument, short_code_counter_id
+from mangrove.datastore.entity import get_short_codes_in_use
+from mangrove.datastore.queries import get_entity_count_for_type
+from mangrove.datastore.settings import SHORT_CODE_BLOCK_SIZE
+from mangrove.errors.MangroveException import FailedToSaveDataObject
+
+_allocators = {}
+_allocators_lock = Lock()
+
+
+def reserve_short_code_range(dbm, entity_type, size):
+    """
+    Reserves `size` consecutive counter values for entity_type and returns the first one.
+
+    The counter lives in one document per entity type and starts after the current entity count. A concurrent
+    reservation makes the save fail on the document revision, in which case it is retried on the fresh document.
+    """
+    assert size > 0
+    while True:
+        counter = dbm._load_document(short_code_counter_id(entity_type), ShortCodeCounterDocument)
+        if counter is None:
+            counter = ShortCodeCounterDocument(entity_type, get_entity_count_for_type(dbm, entity_type) + 1)
+        start = counter.next_value
+        counter.next_value = start + size
+        success, document_id, result = dbm._save_documents([counter])[0]
+        if success:
+            return start
+        if not isinstance(result, ResourceConflict):
+            raise FailedToSaveDataObject(str(result))
+
+
+class ShortCodeAllocator(object):
+    """
+    Hands out generated short codes for one entity type from an in-memory block of reserved counter values.
+
+    A block costs one counter update. Codes taken by hand since the block was reserved are skipped when they are
+    handed out, with one query per allocate() call, so a bulk registration makes a constant number of queries
+    instead of one per entity.
+    """
+
+    def __init__(self, dbm, entity_type, block_size=SHORT_CODE_BLOCK_SIZE):
+        assert block_size > 0
+        self.dbm = dbm
+        self.entity_type = entity_type.lower()
+        self.block_size = block_size
+        self._prefix = self.entity_type.replace(" ", "")[:3] + "%s"
+        self._short_codes = []
+        self._lock = Lock()
+
+    def allocate(self, count=1):
+        with self._lock:
+            short_codes = []
+            while len(short_codes) < count:
+                needed = count - len(short_codes)
+                if len(self._short_codes) < needed:
+                    self._reserve_block(max(self.block_size, needed - len(self._short_codes)))
+                candidates, self._short_codes = self._short_codes[:needed], self._short_codes[needed:]
+                in_use = get_short_codes_in_use(self.dbm, [self.entity_type], candidates)
+                short_codes.extend([short_code for short_code in candidates if short_code not in in_use])
+            return short_codes
+
+    def _reserve_block(self, size):
+        start = reserve_short_code_range(self.dbm, self.entity_type, size)
+        self._short_codes.extend([self._prefix % value for value in range(start, start + size)])
+
+
+def get_short_code_allocator(dbm, entity_type):
+    key = (dbm.url, dbm.database_name, entity_type.lower())
+    if key not in _allocators:
+        with _allocators_lock:
+            if key not in _allocators:
+                _allocators[key] = ShortCodeAllocator(dbm, entity_type)
+    return _allocators[key]
+
+
+def reset_short_code_allocators():
+    """
+    Drops every allocator with its unused codes, e.g. after the databases they allocate for are recreated.
+    """
+    with _allocators_lock:
+        _allocators.clear()
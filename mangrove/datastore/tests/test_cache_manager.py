@@ -0,0 +1,73 @@
+import unittest
+from mock import patch, Mock
+import pylibmc
+from mangrove.datastore import cache_manager
+from mangrove.datastore.cache_manager import PooledCacheClient, get_cache_manager
+
+
+class TestPooledCacheClient(unittest.TestCase):
+    def setUp(self):
+        self.client_patch = patch('mangrove.datastore.cache_manager.pylibmc.Client', autospec=True)
+        client_class = self.client_patch.start()
+        self.client = Mock()
+        self.client.clone.return_value = self.client
+        client_class.return_value = self.client
+
+    def tearDown(self):
+        self.client_patch.stop()
+        cache_manager._cache_manager = None
+
+    def test_should_get_value_from_pooled_client(self):
+        self.client.get.return_value = {'form_code': 'cli001'}
+        cache = PooledCacheClient(['127.0.0.1'], pool_size=2)
+
+        self.assertEqual({'form_code': 'cli001'}, cache.get('key'))
+        self.client.get.assert_called_once_with('key')
+
+    def test_should_pass_expiry_time_on_set(self):
+        cache = PooledCacheClient(['127.0.0.1'], pool_size=2)
+
+        cache.set('key', 'value', time=10)
+
+        self.client.set.assert_called_once_with('key', 'value', time=10)
+
+    def test_should_treat_memcached_failure_as_cache_miss_and_reconnect(self):
+        self.client.get.side_effect = pylibmc.ConnectionError('connection refused')
+        cache = PooledCacheClient(['127.0.0.1'], pool_size=1)
+
+        self.assertIsNone(cache.get('key'))
+        self.client.disconnect_all.assert_called_once_with()
+
+    def test_should_retry_a_failed_delete_once_and_then_raise(self):
+        self.client.delete.side_effect = [pylibmc.ServerError('server gone'), True]
+        cache = PooledCacheClient(['127.0.0.1'], pool_size=1)
+
+        self.assertTrue(cache.delete('key'))
+
+        self.client.delete.side_effect = pylibmc.ServerError('server gone')
+        self.assertRaises(pylibmc.ServerError, cache.delete, 'key')
+        self.assertEqual(2, self.client.disconnect_all.call_count)
+
+    def test_should_pass_other_operations_to_a_pooled_client(self):
+        self.client.get_multi.return_value = {'a': 1}
+        cache = PooledCacheClient(['127.0.0.1'], pool_size=1)
+
+        self.assertEqual({'a': 1}, cache.get_multi(['a', 'b']))
+        self.client.get_multi.assert_called_once_with(['a', 'b'])
+        self.assertRaises(AttributeError, getattr, cache, 'no_such_operation')
+
+    def test_should_treat_exhausted_pool_as_cache_miss(self):
+        cache = PooledCacheClient(['127.0.0.1'], pool_size=2, pool_timeout=0.01)
+        borrowed = [cache._pool.get(False) for index in range(cache.pool_size)]
+
+        self.assertIsNone(cache.get('key'))
+        self.assertFalse(cache.set('key', 'value'))
+        self.assertFalse(self.client.get.called)
+
+        for client in borrowed:
+            cache._pool.put(client)
+        cache.get('key')
+        self.client.get.assert_called_once_with('key')
+
+    def test_should_reuse_the_same_cache_manager_for_the_process(self):
+        self.assertIs(get_cache_manager(), get_cache_manager())
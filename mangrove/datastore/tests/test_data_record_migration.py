@@ -0,0 +1,42 @@
+from unittest import TestCase
+from mock import Mock
+from mangrove.datastore.data_record_migration import compact_data_records
+from mangrove.datastore.database import DatabaseManager
+from mangrove.datastore.documents import DataRecordDocument, EntityDocument
+
+
+class TestDataRecordMigration(TestCase):
+    def setUp(self):
+        self.entity = {'_id': 'e1', 'short_code': 'cli1', 'geometry': {'type': 'Point'},
+                       'aggregation_paths': {'_type': ['clinic'], '_geo': ['India', 'Pune']},
+                       'data': {'name': {'value': 'Ruby'}}}
+
+    def test_should_embed_only_the_compact_entity_in_new_data_records(self):
+        entity_doc = EntityDocument.wrap(dict(self.entity))
+
+        compact = DataRecordDocument(entity_doc=entity_doc, data=[('name', 'Ruby')], compact=True)
+        full = DataRecordDocument(entity_doc=entity_doc, data=[('name', 'Ruby')], compact=False)
+
+        self.assertEqual({'_id': 'e1', 'short_code': 'cli1', 'aggregation_paths': {'_type': ['clinic']}},
+                         compact.entity)
+        self.assertEqual(self.entity['data'], full.entity['data'])
+
+    def test_should_rewrite_full_data_records_page_by_page(self):
+        dbm = Mock(spec=DatabaseManager)
+        dbm.database = Mock()
+        dbm.database.update.side_effect = lambda documents: [(True, d['_id'], 'rev') for d in documents]
+        compact = {'_id': 'e2', 'short_code': 'cli2', 'aggregation_paths': {'_type': ['clinic']}}
+        rows = [{'key': ['cli', 'cli1'], 'id': 'dr1', 'value': {'_id': 'dr1', 'entity': dict(self.entity)}},
+                {'key': ['cli', 'cli2'], 'id': 'dr2', 'value': {'_id': 'dr2', 'entity': compact}},
+                {'key': ['cli', 'cli1'], 'id': 'dr3', 'value': {'_id': 'dr3', 'entity': dict(self.entity)}}]
+        dbm.load_all_rows_in_view.side_effect = [rows[:3], rows[2:]]
+        dbm.iter_view.side_effect = lambda *args, **kwargs: DatabaseManager.iter_view(dbm, *args, **kwargs)
+
+        self.assertEqual((3, 2), compact_data_records(dbm, batch_size=2))
+
+        self.assertEqual({'startkey': ['cli', 'cli1'], 'startkey_docid': 'dr3', 'limit': 3},
+                         dbm.load_all_rows_in_view.call_args[1])
+        written = [document for call in dbm.database.update.call_args_list for document in call[0][0]]
+        self.assertEqual(['dr1', 'dr3'], [document['_id'] for document in written])
+        self.assertEqual({'_id': 'e1', 'short_code': 'cli1', 'aggregation_paths': {'_type': ['clinic']}},
+                         written[0]['entity'])
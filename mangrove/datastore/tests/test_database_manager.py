@@ -1,8 +1,10 @@
 
 
+from mock import Mock
 from mangrove.datastore.documents import DocumentBase
-from mangrove.datastore.entity import EntityDocument
-from mangrove.datastore.database import get_db_manager, _delete_db_and_remove_db_manager
+from mangrove.datastore.entity import EntityDocument, Entity
+from mangrove.datastore.database import get_db_manager, _delete_db_and_remove_db_manager, DatabaseManager, \
+    decode_page_token, READ_STALE_OK, READ_UPDATE_AFTER
 import unittest
 from mangrove.utils.test_utils.database_utils import uniq
 
@@ -40,3 +42,87 @@ class TestDatabaseManager(unittest.TestCase):
 
     def test_should_return_none_if_no_document_for_id(self):
         self.assertIsNone(self.database_manager._load_document('123abc', EntityDocument))
+
+
+class TestViewIteration(unittest.TestCase):
+    def setUp(self):
+        self.dbm = Mock(spec=DatabaseManager)
+        self.rows = [{'key': ['clinic', index // 2], 'id': 'e%d' % index,
+                      'doc': {'_id': 'e%d' % index, 'document_type': 'Entity'}} for index in range(5)]
+
+        def load_all_rows_in_view(view_name, limit, startkey_docid=None, skip=0, **values):
+            start = 0 if startkey_docid is None else [row['id'] for row in self.rows].index(startkey_docid)
+            return self.rows[start + skip:start + skip + limit]
+
+        self.dbm.load_all_rows_in_view.side_effect = load_all_rows_in_view
+
+    def test_should_page_through_a_view_with_a_key_and_document_id_cursor(self):
+        rows = list(DatabaseManager.iter_view(self.dbm, 'by_short_codes', 2, reduce=False))
+
+        self.assertEqual(self.rows, rows)
+        self.assertEqual(3, self.dbm.load_all_rows_in_view.call_count)
+        self.assertEqual({'reduce': False, 'limit': 3, 'startkey': ['clinic', 2], 'startkey_docid': 'e4'},
+                         self.dbm.load_all_rows_in_view.call_args[1])
+
+    def test_should_apply_limit_and_skip_across_pages(self):
+        rows = list(DatabaseManager.iter_view(self.dbm, 'by_short_codes', 2, limit=3, skip=1))
+
+        self.assertEqual(['e1', 'e2', 'e3'], [row['id'] for row in rows])
+        self.assertNotIn('skip', self.dbm.load_all_rows_in_view.call_args[1])
+
+    def test_should_wrap_documents_lazily(self):
+        self.dbm.iter_view.side_effect = lambda *args, **kwargs: DatabaseManager.iter_view(self.dbm, *args, **kwargs)
+
+        entities = DatabaseManager.iter_objects(self.dbm, 'by_short_codes', Entity, 2)
+
+        self.assertFalse(self.dbm.load_all_rows_in_view.called)
+        self.assertEqual(['e0', 'e1', 'e2', 'e3', 'e4'], [entity.id for entity in entities])
+
+    def test_should_chain_view_pages_with_an_opaque_token(self):
+        rows, page_token = DatabaseManager.load_view_page(self.dbm, 'by_short_codes', 2, reduce=False)
+        self.assertEqual(['e0', 'e1'], [row['id'] for row in rows])
+
+        rows, page_token = DatabaseManager.load_view_page(self.dbm, 'by_short_codes', 2, page_token, reduce=False)
+        self.assertEqual(['e2', 'e3'], [row['id'] for row in rows])
+        self.assertEqual((['clinic', 2], 'e4'), decode_page_token(page_token))
+
+        rows, page_token = DatabaseManager.load_view_page(self.dbm, 'by_short_codes', 2, page_token, reduce=False)
+        self.assertEqual(['e4'], [row['id'] for row in rows])
+        self.assertIsNone(page_token)
+        self.assertEqual({'reduce': False, 'limit': 3, 'startkey': ['clinic', 2], 'startkey_docid': 'e4'},
+                         self.dbm.load_all_rows_in_view.call_args[1])
+
+    def test_should_reject_a_malformed_page_token(self):
+        self.assertRaises(ValueError, DatabaseManager.load_view_page, self.dbm, 'by_short_codes', 2, 'not a token')
+
+
+class TestReadPolicy(unittest.TestCase):
+    def setUp(self):
+        self.dbm = Mock(spec=DatabaseManager)
+        self.dbm.database = Mock()
+        self.dbm.database.view.return_value.rows = []
+        self.dbm.metrics = Mock()
+        self.dbm.read_policies = {'datasender_by_mobile': READ_UPDATE_AFTER}
+
+    def test_should_read_with_the_stale_option_of_the_view_policy(self):
+        DatabaseManager.load_all_rows_in_view(self.dbm, 'datasender_by_mobile', key='123')
+        DatabaseManager.load_all_rows_in_view(self.dbm, 'surveyresponse', key='abc')
+
+        self.assertEqual({'key': '123', 'stale': 'update_after'}, self.dbm.database.view.call_args_list[0][1])
+        self.assertEqual({'key': 'abc'}, self.dbm.database.view.call_args_list[1][1])
+
+    def test_should_let_a_query_override_the_view_policy(self):
+        DatabaseManager.load_all_rows_in_view(self.dbm, 'datasender_by_mobile', key='123', stale=None)
+        DatabaseManager.load_all_rows_in_view(self.dbm, 'surveyresponse', key='abc', stale=READ_STALE_OK)
+
+        self.assertEqual({'key': '123'}, self.dbm.database.view.call_args_list[0][1])
+        self.assertEqual({'key': 'abc', 'stale': 'ok'}, self.dbm.database.view.call_args_list[1][1])
+
+    def test_should_notify_the_index_warmer_after_writes(self):
+        self.dbm.index_warmer = Mock()
+        self.dbm._written.side_effect = lambda: DatabaseManager._written(self.dbm)
+        self.dbm.database.update.return_value = [(True, 'id', '1-a')]
+
+        DatabaseManager._save_documents(self.dbm, [DocumentBase(document_type='Entity')])
+
+        self.dbm.index_warmer.notify.assert_called_once_with()
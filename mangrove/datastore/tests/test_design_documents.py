@@ -0,0 +1,31 @@
+import unittest
+from mock import Mock
+from mangrove.bootstrap.views import view_js
+from mangrove.datastore.database import DatabaseManager
+from mangrove.datastore.design_documents import VIEW_DESIGN_DOCUMENTS, design_document_of, view_path
+
+
+class TestDesignDocuments(unittest.TestCase):
+    def test_should_put_every_bootstrap_view_in_a_shared_design_document(self):
+        self.assertEqual(sorted(view_js.keys()), sorted(VIEW_DESIGN_DOCUMENTS.keys()))
+
+    def test_should_give_unlisted_views_their_own_design_document(self):
+        self.assertEqual('survey_responses/surveyresponse', view_path('surveyresponse'))
+        self.assertEqual('monthly_report', design_document_of('monthly_report'))
+
+    def test_should_create_views_of_several_design_documents_in_one_bulk_update(self):
+        dbm = Mock(spec=DatabaseManager)
+        dbm.database = Mock()
+        dbm.database.get.side_effect = lambda doc_id, default: default
+        dbm.database.update.return_value = []
+
+        DatabaseManager.create_views(dbm, [('by_short_codes', 'function(doc) {}', '_count'),
+                                           ('by_type', 'function(doc) {}', None),
+                                           ('questionnaire', 'function(doc) {}', None)])
+
+        design_docs = dbm.database.update.call_args[0][0]
+        self.assertEqual(1, dbm.database.update.call_count)
+        self.assertEqual(['_design/entities', '_design/questionnaires'], sorted(doc['_id'] for doc in design_docs))
+        entities = [doc for doc in design_docs if doc['_id'] == '_design/entities'][0]
+        self.assertEqual({'map': 'function(doc) {}', 'reduce': '_count'}, entities['views']['by_short_codes'])
+        self.assertEqual({'map': 'function(doc) {}'}, entities['views']['by_type'])
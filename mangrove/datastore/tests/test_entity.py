@@ -3,11 +3,13 @@ from datetime import datetime
 import unittest
 from mock import Mock, patch
 from pytz import UTC
-from mangrove.datastore.entity import Entity, get_by_short_code, create_entity, get_all_entities, DataRecord, void_entity, get_by_short_code_include_voided
+from mangrove.datastore.entity import Entity, get_by_short_code, create_entity, get_all_entities, DataRecord, void_entity, get_by_short_code_include_voided, \
+    EntityResolver, LatestDataUpdates
 from mangrove.datastore.tests.test_data import TestData
 from mangrove.errors.MangroveException import DataObjectAlreadyExists, EntityTypeDoesNotExistsException, DataObjectNotFound, FailedToSaveDataObject
 from mangrove.utils.test_utils.database_utils import create_dbmanager_for_ut, safe_define_type, ut_reporter_id
-from mangrove.datastore.database import _delete_db_and_remove_db_manager
+from couchdb.http import ResourceConflict
+from mangrove.datastore.database import _delete_db_and_remove_db_manager, DatabaseManager
 from mangrove.datastore.cache_manager import get_cache_manager
 
 
@@ -396,5 +398,100 @@ def get(dbm, id):
     return dbm.get(id, Entity)
 
 
+class TestEntityResolver(unittest.TestCase):
+    def setUp(self):
+        self.dbm = Mock(spec=DatabaseManager)
+        self.dbm.view = Mock()
+        self.dbm.view.by_short_codes.return_value = [
+            {'key': [['clinic'], 'cli1'], 'doc': {'_id': 'id1', 'aggregation_paths': {'_type': ['clinic']},
+                                                 'short_code': 'cli1'}},
+            {'key': [['reporter'], 'rep1'], 'doc': {'_id': 'id2', 'aggregation_paths': {'_type': ['reporter']},
+                                                   'short_code': 'rep1'}}]
+
+    def test_should_resolve_prefetched_subjects_with_one_query(self):
+        resolver = EntityResolver(self.dbm)
+        resolver.prefetch([(['clinic'], 'CLI1'), (['reporter'], 'rep1'), (['clinic'], 'cli2')])
+
+        self.assertEqual('id1', resolver.get_by_short_code('cli1', ['clinic']).id)
+        self.assertEqual('id2', resolver.get_by_short_code('rep1', ['reporter']).id)
+        with self.assertRaises(DataObjectNotFound):
+            resolver.get_by_short_code('cli2', ['clinic'])
+        self.assertEqual(1, self.dbm.view.by_short_codes.call_count)
+
+    def test_should_look_up_and_memoize_subjects_not_prefetched(self):
+        resolver = EntityResolver(self.dbm)
+        with patch('mangrove.datastore.entity.by_short_code') as by_short_code:
+            by_short_code.side_effect = DataObjectNotFound('Entity', 'Unique Identification Number (ID)', 'cli9')
+            for attempt in range(2):
+                with self.assertRaises(DataObjectNotFound):
+                    resolver.get_by_short_code('cli9', ['clinic'])
+
+            by_short_code.assert_called_once_with(self.dbm, 'cli9', ['clinic'])
+
+
+class TestEntityAddData(unittest.TestCase):
+    def setUp(self):
+        self.dbm = Mock(spec=DatabaseManager)
+        self.dbm._save_documents.side_effect = lambda documents, **kwargs: [(True, d.id, 'rev') for d in documents]
+        self.entity = Entity(self.dbm, entity_type=['clinic'], location=['India'], short_code='cli1')
+
+    def test_should_save_latest_data_and_data_record_in_one_bulk_update(self):
+        data_record_id = self.entity.add_data(data=[('beds', 10)])
+
+        documents = self.dbm._save_documents.call_args[0][0]
+        self.assertEqual(1, self.dbm._save_documents.call_count)
+        self.assertEqual([self.entity.id, data_record_id], [document.id for document in documents])
+        self.assertEqual({'value': 10}, self.entity.data['beds'])
+        self.assertFalse(self.dbm._save_document.called)
+
+    def test_should_apply_latest_data_to_the_stored_entity_on_conflict(self):
+        stored = Entity(self.dbm, entity_type=['clinic'], location=['India'], short_code='cli1', id=self.entity.id)
+        self.dbm._load_document.return_value = stored._doc
+        self.dbm._save_documents.side_effect = lambda documents, **kwargs: \
+            [(False, documents[0].id, ResourceConflict())] + [(True, d.id, 'rev') for d in documents[1:]]
+
+        self.entity.add_data(data=[('beds', 10)])
+
+        self.dbm._save_document.assert_called_once_with(stored._doc, process_post_update=True)
+        self.assertEqual({'value': 10}, stored._doc.data['beds'])
+
+    def test_should_coalesce_deferred_latest_data_into_one_write_per_entity(self):
+        latest_data_updates = LatestDataUpdates(self.dbm)
+        self.entity.add_data(data=[('beds', 10), ('doctors', 2)], latest_data_updates=latest_data_updates)
+        self.entity.add_data(data=[('beds', 12)], latest_data_updates=latest_data_updates)
+
+        self.assertEqual([1, 1], [len(call[0][0]) for call in self.dbm._save_documents.call_args_list])
+        self.assertEqual(1, latest_data_updates.pending)
+
+        stored = Entity(self.dbm, entity_type=['clinic'], location=['India'], short_code='cli1', id=self.entity.id)
+        self.dbm.get_many.return_value = [stored]
+        self.assertEqual(1, latest_data_updates.flush())
+
+        self.dbm.get_many.assert_called_once_with([self.entity.id], Entity)
+        self.assertEqual([stored._doc], self.dbm._save_documents.call_args[0][0])
+        self.assertEqual({'beds': {'value': 12}, 'doctors': {'value': 2}}, stored._doc.data)
+        self.assertEqual(0, latest_data_updates.pending)
+
+
+    def test_should_keep_every_entity_whose_latest_data_was_not_saved(self):
+        latest_data_updates = LatestDataUpdates(self.dbm)
+        other = Entity(self.dbm, entity_type=['clinic'], location=['India'], short_code='cli2')
+        self.entity.add_data(data=[('beds', 10)], latest_data_updates=latest_data_updates)
+        other.add_data(data=[('beds', 20)], latest_data_updates=latest_data_updates)
+        self.dbm.get_many.return_value = [self.entity, other]
+        self.dbm._save_documents.side_effect = lambda documents, **kwargs: \
+            [(False, document.id, Exception('forbidden %s' % document.id)) for document in documents]
+
+        with self.assertRaises(FailedToSaveDataObject) as raised:
+            latest_data_updates.flush()
+
+        self.assertIn(self.entity.id, raised.exception.message)
+        self.assertIn(other.id, raised.exception.message)
+        self.assertEqual(2, latest_data_updates.pending)
+
+        self.dbm._save_documents.side_effect = lambda documents, **kwargs: [(True, d.id, 'rev') for d in documents]
+        self.assertEqual(2, latest_data_updates.flush())
+        self.assertEqual(0, latest_data_updates.pending)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
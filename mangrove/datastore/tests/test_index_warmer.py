@@ -0,0 +1,31 @@
+import unittest
+from threading import Event
+from mock import Mock
+from mangrove.datastore.database import DatabaseManager
+from mangrove.datastore.index_warmer import IndexWarmer
+
+
+class TestIndexWarmer(unittest.TestCase):
+    def test_should_query_one_hot_view_per_design_document(self):
+        dbm = Mock(spec=DatabaseManager)
+
+        IndexWarmer(dbm, ['by_short_codes', 'datasender_by_mobile', 'questionnaire']).warm()
+
+        self.assertEqual(2, dbm.load_all_rows_in_view.call_count)
+        self.assertEqual(['by_short_codes', 'questionnaire'],
+                         [call[0][0] for call in dbm.load_all_rows_in_view.call_args_list])
+        self.assertEqual({'stale': None, 'limit': 0}, dbm.load_all_rows_in_view.call_args[1])
+
+    def test_should_warm_the_indexes_once_after_a_burst_of_writes(self):
+        dbm = Mock(spec=DatabaseManager)
+        warmed = Event()
+        dbm.load_all_rows_in_view.side_effect = lambda *args, **kwargs: warmed.set()
+        warmer = IndexWarmer(dbm, ['by_short_codes'], delay=0.05)
+        warmer.start()
+
+        for write in range(5):
+            warmer.notify()
+        self.assertTrue(warmed.wait(5))
+        warmer.stop()
+
+        self.assertEqual(1, dbm.load_all_rows_in_view.call_count)
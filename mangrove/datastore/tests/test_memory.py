@@ -0,0 +1,142 @@
+import unittest
+from couchdb.http import ResourceConflict
+from mangrove.bootstrap.initializer import sync_views
+from mangrove.bootstrap.views import view_js
+from mangrove.datastore.database import get_db_manager, _delete_db_and_remove_db_manager
+from mangrove.datastore.documents import DocumentBase
+from mangrove.datastore.memory import InMemoryDatabase, InMemoryServer, collation_key, BUILT_IN_REDUCERS
+from mangrove.datastore.memory_views import MAP_FUNCTIONS, REDUCE_FUNCTIONS
+
+
+class TestInMemoryDatabase(unittest.TestCase):
+    def setUp(self):
+        self.database = InMemoryDatabase('test')
+
+    def test_should_save_and_get_document(self):
+        id, rev = self.database.save({'_id': 'doc1', 'name': 'a'})
+
+        doc = self.database.get('doc1')
+        self.assertEqual(('doc1', 'a', rev), (doc.id, doc['name'], doc.rev))
+        self.assertTrue(rev.startswith('1-'))
+        self.assertIsNone(self.database.get('missing'))
+
+    def test_should_reject_update_with_stale_revision(self):
+        doc = {'_id': 'doc1'}
+        self.database.save(doc)
+        stale = dict(doc)
+        self.database.save(doc)
+
+        self.assertRaises(ResourceConflict, self.database.save, stale)
+        results = self.database.update([stale])
+        self.assertFalse(results[0][0])
+        self.assertIsInstance(results[0][2], ResourceConflict)
+
+    def test_should_not_return_deleted_document(self):
+        doc = {'_id': 'doc1'}
+        self.database.save(doc)
+
+        self.database.delete(doc)
+
+        self.assertIsNone(self.database.get('doc1'))
+        rows = self.database.view('_all_docs', keys=['doc1', 'doc2']).rows
+        self.assertTrue(rows[0]['value']['deleted'])
+        self.assertEqual('not_found', rows[1]['error'])
+
+    def test_should_keep_attachments_across_revisions(self):
+        doc = {'_id': 'doc1'}
+        self.database.save(doc)
+        self.database.put_attachment(doc, 'content', 'file.txt')
+
+        doc = self.database.get('doc1')
+        doc['name'] = 'a'
+        self.database.save(doc)
+
+        self.assertEqual('content', self.database.get_attachment('doc1', 'file.txt').read())
+        self.assertEqual('Not Found', self.database.get_attachment('doc1', 'other.txt', 'Not Found'))
+
+    def test_should_collate_keys_like_couchdb(self):
+        keys = [{'a': 1}, ['a'], 'B', 'b', 'a', 2, 1.5, True, False, None]
+
+        self.assertEqual([None, False, True, 1.5, 2, 'a', 'b', 'B', ['a'], {'a': 1}],
+                         sorted(keys, key=collation_key))
+
+    def test_should_create_and_delete_database_on_server(self):
+        server = InMemoryServer('memory://test')
+        server.create('db')
+
+        self.assertTrue('db' in server)
+        del server['db']
+        self.assertFalse('db' in server)
+
+
+class TestInMemoryViews(unittest.TestCase):
+    def setUp(self):
+        self.manager = get_db_manager('memory://', 'mangrove-test-memory')
+        sync_views(self.manager)
+        self.manager._save_documents([_survey_response(index) for index in range(5)])
+
+    def tearDown(self):
+        _delete_db_and_remove_db_manager(self.manager)
+
+    def test_should_have_a_python_port_of_every_bootstrap_view(self):
+        self.assertEqual(sorted(view_js), sorted(MAP_FUNCTIONS))
+
+    def test_should_have_a_python_port_of_every_javascript_reduce(self):
+        reduced = [name for name, functions in view_js.items()
+                   if 'reduce' in functions and functions['reduce'].strip() not in BUILT_IN_REDUCERS]
+
+        self.assertEqual(sorted(reduced), sorted(REDUCE_FUNCTIONS))
+
+    def test_should_reduce_to_the_value_with_the_latest_timestamp(self):
+        values = [{'timestamp': '2010-02-03T10:00:00.000Z', 'value': 'Dr. B'},
+                  {'timestamp': '2010-02-11T08:30:00.000Z', 'value': 'Dr. C'},
+                  {'timestamp': '2010-02-01T00:00:00.000Z', 'value': 'Dr. A'}]
+
+        self.assertEqual({'latest': 'Dr. C', 'timestamp': '2010-02-11T08:30:00.000Z'},
+                         REDUCE_FUNCTIONS['monthly_aggregate_latest'](values))
+
+    def test_should_query_view_by_key_range(self):
+        rows = self.manager.load_all_rows_in_view('surveyresponse', reduce=False, startkey=['form1', 0],
+                                                  endkey=['form1', {}], descending=False)
+
+        self.assertEqual(['sr0', 'sr2', 'sr4'], [row.id for row in rows])
+
+    def test_should_reduce_with_built_in_reducer(self):
+        rows = self.manager.load_all_rows_in_view('surveyresponse', group_level=1)
+
+        self.assertEqual([['form1'], ['form2']], [row.key for row in rows])
+        self.assertEqual([3, 2], [row.value['count'] for row in rows])
+        self.assertEqual(2, rows[0].value['sum'])
+
+    def test_should_include_documents(self):
+        rows = self.manager.load_all_rows_in_view('surveyresponse', reduce=False, key=['form2', 1000],
+                                                  include_docs=True)
+
+        self.assertEqual(['sr1'], [row['doc']['_id'] for row in rows])
+
+    def test_should_index_documents_written_after_first_query(self):
+        self.manager.load_all_rows_in_view('surveyresponse', reduce=False)
+        doc = self.manager._load_document('sr0')
+        doc['form_model_id'] = 'form2'
+        self.manager._save_document(doc)
+        self.manager._save_document(_survey_response(5))
+
+        rows = self.manager.load_all_rows_in_view('surveyresponse', reduce=False, startkey=['form2'],
+                                                  endkey=['form2', {}])
+
+        self.assertEqual(['sr0', 'sr1', 'sr3', 'sr5'], [row.id for row in rows])
+
+    def test_should_page_through_view(self):
+        rows, page_token = self.manager.load_view_page('surveyresponse', 2, reduce=False)
+        next_rows, next_page_token = self.manager.load_view_page('surveyresponse', 2, page_token, reduce=False)
+
+        self.assertEqual(['sr0', 'sr2', 'sr4', 'sr1'], [row.id for row in rows + next_rows])
+        self.assertIsNotNone(next_page_token)
+
+
+def _survey_response(index):
+    document = DocumentBase(id='sr%d' % index, document_type='SurveyResponse')
+    document['form_model_id'] = 'form1' if index % 2 == 0 else 'form2'
+    document['created'] = '1970-01-01T00:00:%02d.000+00:00' % index
+    document['status'] = index % 4 == 0
+    return document
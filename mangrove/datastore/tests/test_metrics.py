@@ -0,0 +1,85 @@
+import unittest
+from mock import Mock
+from mangrove.datastore.database import View
+from mangrove.datastore.metrics import InMemoryMetrics, Measurement, measure
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = InMemoryMetrics()
+
+    def _measurement(self, name, seconds, rows=0, error=False):
+        measurement = Measurement('view', name)
+        measurement.seconds, measurement.rows, measurement.error = seconds, rows, error
+        return measurement
+
+    def test_should_aggregate_measurements_per_operation_and_name(self):
+        self.metrics.record(self._measurement('by_values', 0.002, rows=3))
+        self.metrics.record(self._measurement('by_values', 0.3, rows=5, error=True))
+        self.metrics.record(self._measurement('entity_data', 0.01))
+
+        stats = self.metrics.snapshot()[('view', 'by_values')]
+
+        self.assertEqual((2, 1, 8), (stats['calls'], stats['errors'], stats['rows']))
+        self.assertEqual(0.3, stats['max_seconds'])
+        self.assertEqual([(0.005, 1), (0.5, 1)], [bucket for bucket in stats['histogram'] if bucket[1]])
+        self.assertEqual(('view', 'by_values'), self.metrics.slowest(1)[0][0])
+
+    def test_should_record_failed_calls_and_pass_measurements_to_exporters(self):
+        exporter = Mock()
+        self.metrics.add_exporter(exporter)
+
+        with self.assertRaises(ValueError):
+            with measure(self.metrics, 'save', 'documents'):
+                raise ValueError()
+
+        self.assertTrue(exporter.call_args[0][0].error)
+        self.assertEqual(1, self.metrics.snapshot()[('save', 'documents')]['errors'])
+
+    def test_should_keep_the_measured_exception_when_an_exporter_fails(self):
+        self.metrics.add_exporter(Mock(side_effect=IOError('statsd is down')))
+        exporter = Mock()
+        self.metrics.add_exporter(exporter)
+
+        with self.assertRaises(ValueError):
+            with measure(self.metrics, 'save', 'documents'):
+                raise ValueError()
+        with measure(self.metrics, 'view', 'by_values'):
+            pass
+
+        self.assertEqual(2, exporter.call_count)
+        self.assertEqual(1, self.metrics.snapshot()[('view', 'by_values')]['calls'])
+
+    def test_should_stop_calling_a_removed_exporter(self):
+        exporter = Mock()
+        self.metrics.add_exporter(exporter)
+
+        self.metrics.remove_exporter(exporter)
+        with measure(self.metrics, 'view', 'by_values'):
+            pass
+
+        self.assertFalse(exporter.called)
+
+    def test_should_call_every_exporter_registered_when_the_call_was_recorded(self):
+        exporter = Mock()
+        removing_exporter = Mock(side_effect=lambda measurement: self.metrics.remove_exporter(removing_exporter))
+        self.metrics.add_exporter(removing_exporter)
+        self.metrics.add_exporter(exporter)
+
+        with measure(self.metrics, 'view', 'by_values'):
+            pass
+        with measure(self.metrics, 'view', 'by_values'):
+            pass
+
+        self.assertEqual(1, removing_exporter.call_count)
+        self.assertEqual(2, exporter.call_count)
+
+    def test_should_time_view_queries(self):
+        database = Mock()
+        database.view.return_value.rows = [{'key': 1}, {'key': 2}]
+
+        rows = View(database, self.metrics).by_short_codes(key=['clinic', 'cli1'])
+
+        self.assertEqual(2, len(rows))
+        database.view.assert_called_once_with('entities/by_short_codes', key=['clinic', 'cli1'])
+        self.assertEqual(2, self.metrics.snapshot()[('view', 'by_short_codes')]['rows'])
@@ -0,0 +1,89 @@
+import unittest
+from couchdb.http import ResourceConflict
+from mock import Mock, patch
+from mangrove.datastore.database import DatabaseManager
+from mangrove.datastore.documents import ShortCodeCounterDocument
+from mangrove.datastore.short_code_counter import reserve_short_code_range, ShortCodeAllocator, \
+    get_short_code_allocator, reset_short_code_allocators
+from mangrove.errors.MangroveException import FailedToSaveDataObject
+
+
+class TestShortCodeCounter(unittest.TestCase):
+    def setUp(self):
+        self.dbm = Mock(spec=DatabaseManager)
+        self.dbm.url = 'http://localhost:5984/'
+        self.dbm.database_name = 'test_short_code_counter'
+        self.entity_count_patch = patch('mangrove.datastore.short_code_counter.get_entity_count_for_type',
+                                        return_value=4)
+        self.in_use_patch = patch('mangrove.datastore.short_code_counter.get_short_codes_in_use',
+                                  return_value=set())
+        self.entity_count_patch.start()
+        self.in_use = self.in_use_patch.start()
+
+    def tearDown(self):
+        self.entity_count_patch.stop()
+        self.in_use_patch.stop()
+        reset_short_code_allocators()
+
+    def test_should_start_counter_after_existing_entities(self):
+        self.dbm._load_document.return_value = None
+        self.dbm._save_documents.return_value = [(True, 'short_code_counter_clinic', 'rev')]
+
+        self.assertEqual(5, reserve_short_code_range(self.dbm, 'clinic', 10))
+
+        counter = self.dbm._save_documents.call_args[0][0][0]
+        self.assertEqual('short_code_counter_clinic', counter.id)
+        self.assertEqual(15, counter.next_value)
+
+    def test_should_retry_reservation_on_revision_conflict(self):
+        self.dbm._load_document.side_effect = [ShortCodeCounterDocument('clinic', 20),
+                                               ShortCodeCounterDocument('clinic', 30)]
+        self.dbm._save_documents.side_effect = [[(False, 'short_code_counter_clinic', ResourceConflict())],
+                                                [(True, 'short_code_counter_clinic', 'rev')]]
+
+        self.assertEqual(30, reserve_short_code_range(self.dbm, 'clinic', 10))
+        self.assertEqual(2, self.dbm._save_documents.call_count)
+
+    def test_should_raise_when_counter_cannot_be_saved(self):
+        self.dbm._load_document.return_value = ShortCodeCounterDocument('clinic', 20)
+        self.dbm._save_documents.return_value = [(False, 'short_code_counter_clinic', Exception('forbidden'))]
+
+        with self.assertRaises(FailedToSaveDataObject):
+            reserve_short_code_range(self.dbm, 'clinic', 10)
+
+    def test_should_hand_out_codes_from_the_reserved_block(self):
+        self.dbm._load_document.return_value = ShortCodeCounterDocument('clinic', 7)
+        self.dbm._save_documents.return_value = [(True, 'short_code_counter_clinic', 'rev')]
+        allocator = ShortCodeAllocator(self.dbm, 'Clinic', block_size=3)
+
+        self.assertEqual(['cli7', 'cli8'], allocator.allocate(2))
+        self.assertEqual(['cli9'], allocator.allocate())
+        self.assertEqual(1, self.dbm._save_documents.call_count)
+        self.in_use.assert_called_with(self.dbm, ['clinic'], ['cli9'])
+
+    def test_should_skip_codes_taken_by_hand_after_the_block_was_reserved(self):
+        self.dbm._load_document.return_value = ShortCodeCounterDocument('clinic', 7)
+        self.dbm._save_documents.return_value = [(True, 'short_code_counter_clinic', 'rev')]
+        allocator = ShortCodeAllocator(self.dbm, 'Clinic', block_size=3)
+        self.assertEqual(['cli7'], allocator.allocate())
+
+        self.in_use.return_value = set(['cli8'])
+
+        self.assertEqual(['cli9'], allocator.allocate())
+
+    def test_should_share_one_allocator_per_database_and_entity_type(self):
+        self.assertIs(get_short_code_allocator(self.dbm, 'clinic'), get_short_code_allocator(self.dbm, 'Clinic'))
+
+    def test_should_not_share_allocators_between_servers(self):
+        other_dbm = Mock(spec=DatabaseManager)
+        other_dbm.url = 'http://otherhost:5984/'
+        other_dbm.database_name = self.dbm.database_name
+
+        self.assertIsNot(get_short_code_allocator(self.dbm, 'clinic'), get_short_code_allocator(other_dbm, 'clinic'))
+
+    def test_should_drop_allocators_on_reset(self):
+        allocator = get_short_code_allocator(self.dbm, 'clinic')
+
+        reset_short_code_allocators()
+
+        self.assertIsNot(allocator, get_short_code_allocator(self.dbm, 'clinic'))
@@ -0,0 +1,29 @@
+import unittest
+from couchdb.client import Row
+from mock import Mock
+from mangrove.datastore.database import DatabaseManager
+from mangrove.datastore.time_period_aggregation import Month, Latest, _get_latest_aggregation
+
+
+class TestLatestAggregation(unittest.TestCase):
+    def setUp(self):
+        self.dbm = Mock(spec=DatabaseManager)
+        self.form_model = Mock()
+        self.form_model.form_code = 'CL1'
+        self.form_model.entity_type = ['clinic']
+
+    def _row(self, short_code, field_name, latest):
+        return Row(key=[2010, 2, 'CL1', ['clinic'], short_code, field_name],
+                   value={'latest': latest, 'timestamp': '2010-02-01T00:00:00Z'})
+
+    def test_should_read_the_latest_values_with_one_grouped_query(self):
+        self.dbm.load_all_rows_in_view.return_value = [self._row('cli1', 'director', 'Dr. B'),
+                                                       self._row('cli1', 'patients', 10),
+                                                       self._row('cli2', 'director', 'Dr. C')]
+
+        latest = _get_latest_aggregation([Latest('director')], self.dbm, self.form_model, Month(2, 2010))
+
+        self.assertEqual({'cli1': {'director': 'Dr. B'}, 'cli2': {'director': 'Dr. C'}}, dict(latest))
+        self.dbm.load_all_rows_in_view.assert_called_once_with(
+            'monthly_aggregate_latest', group=True, startkey=[2010, 2, 'CL1', ['clinic']],
+            endkey=[2010, 2, 'CL1', ['clinic'], {}])
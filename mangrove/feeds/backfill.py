@@ -0,0 +1,65 @@
+import argparse
+import logging
+import time
+from itertools import islice
+
+from mangrove.datastore.database import get_db_manager
+from mangrove.feeds.enriched_survey_response import EnrichedSurveyResponseBatchBuilder
+from mangrove.transport.contract.survey_response import SurveyResponse
+
+FEED_BACKFILL_BATCH_SIZE = 1000
+
+logger = logging.getLogger('mangrove.feeds')
+
+
+def survey_response_batches(dbm, batch_size=FEED_BACKFILL_BATCH_SIZE):
+    """
+    Yields all survey responses in lists of batch_size, paging through the surveyresponse view.
+    """
+    rows = dbm.iter_view('surveyresponse', batch_size, reduce=False, include_docs=True)
+    while True:
+        batch = [SurveyResponse.new_from_doc(dbm, SurveyResponse.__document_class__.wrap(row['doc']))
+                 for row in islice(rows, batch_size)]
+        if not batch:
+            return
+        yield batch
+
+
+def rebuild_feeds(dbm, feeds_dbm, batch_size=FEED_BACKFILL_BATCH_SIZE):
+    """
+    Rebuilds the feed document of every survey response of dbm into feeds_dbm, one bulk update per batch.
+    Additional details already stored on feed documents are kept. Returns the number of survey responses
+    read and a dict of survey response id to error message.
+    """
+    start = time.time()
+    builder = EnrichedSurveyResponseBatchBuilder(dbm, feeds_dbm, logger)
+    count = 0
+    errors = {}
+    for survey_responses in survey_response_batches(dbm, batch_size):
+        errors.update(builder.save(survey_responses))
+        count += len(survey_responses)
+        elapsed_seconds = time.time() - start
+        logger.info("rebuilt %s feed documents (%s errors) in %.2f seconds, %.1f docs/sec" %
+                    (count, len(errors), elapsed_seconds, count / elapsed_seconds if elapsed_seconds else count))
+    return count, errors
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Rebuilds the feeds database from the survey responses.")
+    parser.add_argument('database')
+    parser.add_argument('feeds_database')
+    parser.add_argument('--server', default=None)
+    parser.add_argument('--batch-size', type=int, default=FEED_BACKFILL_BATCH_SIZE)
+    options = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO)
+
+    dbm = get_db_manager(options.server, options.database)
+    feeds_dbm = get_db_manager(options.server, options.feeds_database)
+    count, errors = rebuild_feeds(dbm, feeds_dbm, options.batch_size)
+    for error in errors.values():
+        logger.error(error)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
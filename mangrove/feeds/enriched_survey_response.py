@@ -2,14 +2,18 @@ from string import lower
 import traceback
 
 from mangrove.datastore.documents import EnrichedSurveyResponseDocument
-from mangrove.datastore.entity import by_short_code, Contact
+from mangrove.datastore.entity import by_short_code, Contact, EntityResolver
 from mangrove.errors.MangroveException import DataObjectNotFound
 from mangrove.form_model.field import DateField, SelectField, UniqueIdField
+from mangrove.form_model.form_model import FormModel
 
 
 class EnrichedSurveyResponseBuilder(object):
-    def __init__(self, dbm, survey_response, form_model, additional_details, logger=None, ds_mobile_number=None):
+    def __init__(self, dbm, survey_response, form_model, additional_details, logger=None, ds_mobile_number=None,
+                 entity_resolver=None, data_senders=None):
         self.ds_mobile_number = ds_mobile_number
+        self.entity_resolver = entity_resolver
+        self.data_senders = data_senders
         self.dbm = dbm
         self.additional_details = additional_details
         self.survey_response = survey_response
@@ -63,7 +67,10 @@ class EnrichedSurveyResponseBuilder(object):
 
     def _data_sender(self):
         try:
-            data_sender = Contact.get(self.dbm, self.survey_response.owner_uid)
+            if self.data_senders is not None:
+                data_sender = self.data_senders[self.survey_response.owner_uid]
+            else:
+                data_sender = Contact.get(self.dbm, self.survey_response.owner_uid)
             #todo Do we need to store datasender question code information in enriched survey response?
             return self._get_data_sender_info_dict(data_sender, '')
         except:
@@ -87,7 +94,7 @@ class EnrichedSurveyResponseBuilder(object):
         answer_dictionary.update({'is_entity_question': 'true'})
         if self.form_model.entity_type != ["reporter"]:
             try:
-                subject = by_short_code(self.dbm, value, [unique_id_type])
+                subject = self._subject(value, unique_id_type)
                 answer_dictionary.update(
                     {'answer': {'id': value, 'name': subject.data['name']['value'], 'deleted': False}})
             except DataObjectNotFound:
@@ -95,6 +102,11 @@ class EnrichedSurveyResponseBuilder(object):
                     {'answer': {'id': value, 'name': '', 'deleted': True}})
 
 
+    def _subject(self, short_code, unique_id_type):
+        if self.entity_resolver is not None:
+            return self.entity_resolver.get_by_short_code(short_code, [unique_id_type])
+        return by_short_code(self.dbm, short_code, [unique_id_type])
+
     def _create_answer_dictionary(self, field):
         answer_dictionary = {}
         value = self.values_lower_case_dict.get(field.code)
@@ -134,6 +146,105 @@ class EnrichedSurveyResponseBuilder(object):
         return None
 
 
+class EnrichedSurveyResponseBatchBuilder(object):
+    """
+    Builds and saves the feed documents of many survey responses at once. Questionnaires and data senders are
+    loaded with one _all_docs query each, subjects with one by_short_codes query and the existing feed documents
+    with one _all_docs query on the feeds database. All feed documents are then written with one bulk update.
+    """
+
+    def __init__(self, dbm, feeds_dbm, logger=None):
+        self.dbm = dbm
+        self.feeds_dbm = feeds_dbm
+        self.logger = logger
+        self._form_models = {}
+
+    def feed_documents(self, survey_responses, additional_details=None):
+        """
+        Returns the feed documents that could be built and a dict of survey response id to error message
+        for the others. additional_details=None keeps the additional details of existing feed documents.
+        """
+        return self.feed_documents_for_entries([(survey_response, additional_details, None)
+                                                for survey_response in survey_responses])
+
+    def feed_documents_for_entries(self, entries):
+        """
+        Same as feed_documents for (survey_response, additional_details, ds_mobile_number) entries, so every
+        survey response carries its own additional details and, for unregistered senders, mobile number.
+        """
+        survey_responses = [entry[0] for entry in entries]
+        form_models = self._load_form_models(survey_responses)
+        data_senders = self._load_data_senders(survey_responses)
+        entity_resolver = EntityResolver(self.dbm)
+        entity_resolver.prefetch([answer for survey_response in survey_responses
+                                  if survey_response.form_model_id in form_models
+                                  for answer in
+                                  form_models[survey_response.form_model_id].unique_id_answers(survey_response.values)])
+        existing = dict((document.id, document) for document in
+                        self.feeds_dbm._load_documents([survey_response.uuid for survey_response in survey_responses],
+                                                       EnrichedSurveyResponseDocument))
+        documents = []
+        errors = {}
+        for survey_response, additional_details, ds_mobile_number in entries:
+            try:
+                form_model = form_models.get(survey_response.form_model_id)
+                if form_model is None:
+                    raise DataObjectNotFound("FormModel", "id", survey_response.form_model_id)
+                builder = EnrichedSurveyResponseBuilder(self.dbm, survey_response, form_model, additional_details,
+                                                        self.logger, ds_mobile_number, entity_resolver,
+                                                        data_senders=data_senders)
+                documents.append(self._merge(existing.get(survey_response.uuid), builder.feed_document(),
+                                             additional_details is None))
+            except Exception as e:
+                errors[survey_response.uuid] = _feed_error_message(survey_response.uuid, e)
+        return documents, errors
+
+    def save(self, survey_responses, additional_details=None):
+        """
+        Writes the feed documents of survey_responses and returns a dict of survey response id to error message.
+        """
+        return self.save_entries([(survey_response, additional_details, None) for survey_response in survey_responses])
+
+    def save_entries(self, entries):
+        documents, errors = self.feed_documents_for_entries(entries)
+        if documents:
+            for success, document_id, result in self.feeds_dbm._save_documents(documents):
+                if not success:
+                    errors[document_id] = 'error while creating feed doc for %s \n%s\n' % (document_id, result)
+        return errors
+
+    def _merge(self, existing_document, document, keep_additional_detail):
+        if existing_document is None:
+            return document
+        additional_detail = existing_document.additional_detail
+        existing_document.update(document)
+        if keep_additional_detail:
+            existing_document.additional_detail = additional_detail
+        return existing_document
+
+    def _load_form_models(self, survey_responses):
+        missing = list(set([survey_response.form_model_id for survey_response in survey_responses
+                            if survey_response.form_model_id not in self._form_models]))
+        if missing:
+            for form_model in self.dbm.get_many(missing, FormModel):
+                self._form_models[form_model.id] = form_model
+        return self._form_models
+
+    def _load_data_senders(self, survey_responses):
+        owner_uids = list(set([survey_response.owner_uid for survey_response in survey_responses
+                               if survey_response.owner_uid]))
+        if not owner_uids:
+            return {}
+        return dict((data_sender.id, data_sender) for data_sender in self.dbm.get_many(owner_uids, Contact))
+
+
+def _feed_error_message(survey_response_id, exception):
+    error = 'error while creating feed doc for %s \n' % survey_response_id
+    error += exception.message + '\n'
+    error += traceback.format_exc()
+    return error
+
+
 class LowerCaseKeyDict():
     def __init__(self, input_dict):
         self.dictionary = {}
@@ -0,0 +1,277 @@
+from collections import OrderedDict
+import json
+import logging
+import os
+from Queue import Queue, Empty
+from threading import Thread, Lock, Timer
+
+from mangrove.feeds.enriched_survey_response import EnrichedSurveyResponseBatchBuilder
+from mangrove.transport.contract.survey_response import SurveyResponse
+
+FEED_WRITER_BATCH_SIZE = 100
+FEED_WRITER_QUEUE_SIZE = 10000
+FEED_WRITER_WORKERS = 1
+# seconds before the first retry of a failed feed document, doubled on every further failure up to the maximum
+FEED_WRITER_RETRY_DELAY = 1.0
+FEED_WRITER_MAX_RETRY_DELAY = 5 * 60
+
+logger = logging.getLogger('mangrove.feeds')
+
+_STOP = object()
+
+
+class FeedJournal(object):
+    """
+    Append-only local file of the feed documents still to be written. Every submitted survey response id is
+    recorded with its additional details and sender mobile number before it is queued, and marked done once its feed document is saved,
+    so the entries pending when the process died are found again on the next start.
+
+    Appends are flushed to the operating system at once; sync forces them to disk and is called by the writer once
+    per batch rather than once per submission. The file is compacted to the pending entries whenever the done
+    records in it outnumber them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._pending = OrderedDict()
+        self._file = None
+        self._unsynced = False
+        self._done_records = 0
+
+    def open(self):
+        """
+        Reads the journal, rewrites it with the pending entries only and returns them as
+        (survey_response_id, additional_details, ds_mobile_number) entries in submission order.
+        """
+        with self._lock:
+            self._pending = OrderedDict()
+            order = []
+            if os.path.exists(self.path):
+                with open(self.path) as journal:
+                    for line in journal:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # a line cut short by a crash while it was written
+                            continue
+                        if 'done' in record:
+                            self._mark_done(record['done'])
+                        else:
+                            if record['id'] not in self._pending:
+                                order.append(record['id'])
+                            self._add(record['id'], (record.get('additional_details'), record.get('ds_mobile_number')))
+            # each pending survey response is written once, from its latest stored version
+            self._pending = OrderedDict((survey_response_id, [1, self._pending[survey_response_id][1]])
+                                        for survey_response_id in order if survey_response_id in self._pending)
+            self._rewrite()
+            return [(survey_response_id,) + tuple(details) for survey_response_id, (count, details)
+                    in self._pending.items()]
+
+    def append(self, survey_response_id, additional_details, ds_mobile_number=None):
+        with self._lock:
+            self._add(survey_response_id, (additional_details, ds_mobile_number))
+            self._write([self._record(survey_response_id, additional_details, ds_mobile_number)])
+
+    def done(self, survey_response_ids):
+        if not survey_response_ids:
+            return
+        with self._lock:
+            self._mark_done(survey_response_ids)
+            self._done_records += len(survey_response_ids)
+            if self._done_records > len(self._pending):
+                self._rewrite()
+            else:
+                self._write([{'done': list(survey_response_ids)}])
+
+    def sync(self):
+        """
+        Forces the records appended since the last sync to disk.
+        """
+        with self._lock:
+            if self._unsynced:
+                os.fsync(self._file.fileno())
+                self._unsynced = False
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def _record(self, survey_response_id, additional_details, ds_mobile_number):
+        return {'id': survey_response_id, 'additional_details': additional_details,
+                'ds_mobile_number': ds_mobile_number}
+
+    def _add(self, survey_response_id, details):
+        count = self._pending.get(survey_response_id, [0])[0]
+        self._pending[survey_response_id] = [count + 1, details]
+
+    def _mark_done(self, survey_response_ids):
+        # an id submitted again while its first write was in flight stays pending for the second one
+        for survey_response_id in survey_response_ids:
+            if survey_response_id in self._pending:
+                self._pending[survey_response_id][0] -= 1
+                if not self._pending[survey_response_id][0]:
+                    del self._pending[survey_response_id]
+
+    def _write(self, records):
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._dump(self._file, records)
+        self._unsynced = True
+
+    def _rewrite(self):
+        # the pending entries go to a new file which replaces the journal, so a crash leaves one or the other whole
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        path = self.path + '.compact'
+        with open(path, 'w') as journal:
+            self._dump(journal, [self._record(survey_response_id, *details)
+                                 for survey_response_id, (count, details) in self._pending.items()])
+            os.fsync(journal.fileno())
+        os.rename(path, self.path)
+        self._done_records = 0
+        self._unsynced = False
+
+    def _dump(self, journal, records):
+        for record in records:
+            journal.write(json.dumps(record) + '\n')
+        journal.flush()
+
+
+class FeedWriter(object):
+    """
+    Writes feed documents in the background. submit journals the survey response and puts it on a bounded
+    queue; worker threads take up to batch_size entries at a time, sync the journal and save their feed
+    documents with EnrichedSurveyResponseBatchBuilder. Entries whose feed document could not be saved are queued
+    again after retry_delay seconds, twice as long after every further failure. They stay in the journal until
+    saved, so those still failing when the writer stops are written again when it is next started.
+    """
+
+    def __init__(self, dbm, feeds_dbm, journal_path, batch_size=FEED_WRITER_BATCH_SIZE,
+                 queue_size=FEED_WRITER_QUEUE_SIZE, workers=FEED_WRITER_WORKERS, retry_delay=FEED_WRITER_RETRY_DELAY):
+        assert batch_size > 0 and workers > 0
+        self.dbm = dbm
+        self.feeds_dbm = feeds_dbm
+        self.journal = FeedJournal(journal_path)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.retry_delay = retry_delay
+        self._queue = Queue(queue_size)
+        self._threads = []
+        self._retry_lock = Lock()
+        self._retries = {}
+        self._retry_count = 0
+        self._failures = {}
+
+    def start(self):
+        entries = self.journal.open()
+        if entries:
+            logger.info("replaying %s journaled feed documents" % len(entries))
+        for survey_response_id, additional_details, ds_mobile_number in entries:
+            self._queue.put((survey_response_id, None, additional_details, ds_mobile_number))
+        for index in range(self.workers):
+            thread = Thread(target=self._run, name='feed-writer-%s' % index)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, survey_response, additional_details=None, ds_mobile_number=None):
+        """
+        Queues the feed document of survey_response. Blocks only while the queue is full.
+        """
+        self.journal.append(survey_response.uuid, additional_details, ds_mobile_number)
+        self._queue.put((survey_response.uuid, survey_response, additional_details, ds_mobile_number))
+
+    def stop(self):
+        """
+        Writes everything queued so far and stops the workers.
+        """
+        for thread in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        with self._retry_lock:
+            # the journal keeps the entries waiting for a retry
+            for timer in self._retries.values():
+                timer.cancel()
+            self._retries = {}
+            self._failures = {}
+        self.journal.sync()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not _STOP and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            stop = batch[-1] is _STOP
+            entries = [entry for entry in batch if entry is not _STOP]
+            if entries:
+                self.journal.sync()
+                self.write(entries)
+            if stop:
+                return
+
+    def write(self, entries):
+        """
+        Saves the feed documents of (survey_response_id, survey_response or None, additional_details,
+        ds_mobile_number) entries.
+        Survey responses not given are loaded with one query; ids whose survey response no longer exists are
+        dropped from the journal.
+        """
+        try:
+            missing = [entry[0] for entry in entries if entry[1] is None]
+            loaded = dict((survey_response.uuid, survey_response) for survey_response in
+                          self.dbm.get_many(missing, SurveyResponse)) if missing else {}
+            latest = OrderedDict()
+            for survey_response_id, survey_response, additional_details, ds_mobile_number in entries:
+                survey_response = survey_response or loaded.get(survey_response_id)
+                if survey_response is not None:
+                    # a survey response submitted twice in one batch is written once, from its last version
+                    latest.pop(survey_response_id, None)
+                    latest[survey_response_id] = (survey_response, additional_details, ds_mobile_number)
+            to_save = latest.values()
+            errors = EnrichedSurveyResponseBatchBuilder(self.dbm, self.feeds_dbm, logger).save_entries(to_save)
+        except Exception:
+            logger.exception("error while writing %s feed documents" % len(entries))
+            self._retry(entries)
+            return
+        for error in errors.values():
+            logger.error(error)
+        self._retry([entry for entry in entries if entry[0] in errors])
+        saved = [entry[0] for entry in entries if entry[0] not in errors]
+        with self._retry_lock:
+            for survey_response_id in saved:
+                self._failures.pop(survey_response_id, None)
+        self.journal.done(saved)
+
+    def _retry(self, entries):
+        if not entries or not self._threads:
+            return
+        with self._retry_lock:
+            failures = max(self._failures.get(entry[0], 0) for entry in entries) + 1
+            for entry in entries:
+                self._failures[entry[0]] = failures
+            delay = min(self.retry_delay * 2 ** (failures - 1), FEED_WRITER_MAX_RETRY_DELAY)
+            self._retry_count += 1
+            timer = Timer(delay, self._requeue, [self._retry_count, entries])
+            timer.daemon = True
+            self._retries[self._retry_count] = timer
+            timer.start()
+
+    def _requeue(self, retry, entries):
+        with self._retry_lock:
+            if self._retries.pop(retry, None) is None:
+                return
+        for entry in entries:
+            self._queue.put(entry)
@@ -0,0 +1,37 @@
+from unittest import TestCase
+from mock import Mock, patch
+from mangrove.datastore.database import DatabaseManager
+from mangrove.feeds.backfill import survey_response_batches, rebuild_feeds
+
+
+class TestBackfill(TestCase):
+    def setUp(self):
+        self.dbm = Mock(spec=DatabaseManager)
+        self.rows = [{'key': ['form_model_id', index], 'id': 'sr%d' % index,
+                      'doc': {'_id': 'sr%d' % index, 'document_type': 'SurveyResponse'}} for index in range(5)]
+
+        def load_all_rows_in_view(view_name, limit, startkey=None, startkey_docid=None, **values):
+            start = 0 if startkey_docid is None else [row['id'] for row in self.rows].index(startkey_docid)
+            return self.rows[start:start + limit]
+
+        self.dbm.load_all_rows_in_view.side_effect = load_all_rows_in_view
+        self.dbm.iter_view.side_effect = lambda *args, **kwargs: DatabaseManager.iter_view(self.dbm, *args, **kwargs)
+
+    def test_should_page_through_survey_responses_on_key_and_document_id(self):
+        batches = list(survey_response_batches(self.dbm, batch_size=2))
+
+        self.assertEqual([['sr0', 'sr1'], ['sr2', 'sr3'], ['sr4']],
+                         [[survey_response.uuid for survey_response in batch] for batch in batches])
+        self.assertEqual({'reduce': False, 'include_docs': True, 'limit': 3, 'startkey': ['form_model_id', 4],
+                          'startkey_docid': 'sr4'}, self.dbm.load_all_rows_in_view.call_args[1])
+
+    def test_should_save_feed_documents_per_batch(self):
+        feeds_dbm = Mock(spec=DatabaseManager)
+        with patch('mangrove.feeds.backfill.EnrichedSurveyResponseBatchBuilder') as builder_class:
+            builder_class.return_value.save.side_effect = [{}, {'sr3': 'error'}, {}]
+
+            count, errors = rebuild_feeds(self.dbm, feeds_dbm, batch_size=2)
+
+            self.assertEqual(5, count)
+            self.assertEqual({'sr3': 'error'}, errors)
+            self.assertEqual(3, builder_class.return_value.save.call_count)
@@ -1,13 +1,13 @@
 from datetime import datetime
 from unittest import TestCase
 from mock import Mock, PropertyMock, patch
-from mangrove.datastore.documents import SurveyResponseDocument
-from mangrove.datastore.entity import Entity
+from mangrove.datastore.documents import SurveyResponseDocument, EnrichedSurveyResponseDocument
+from mangrove.datastore.entity import Entity, Contact
 from mangrove.datastore.database import DatabaseManager
 from mangrove.errors.MangroveException import DataObjectNotFound
 from mangrove.form_model.field import SelectField, DateField, TextField, IntegerField, UniqueIdField
 from mangrove.form_model.form_model import FormModel
-from mangrove.feeds.enriched_survey_response import EnrichedSurveyResponseBuilder
+from mangrove.feeds.enriched_survey_response import EnrichedSurveyResponseBuilder, EnrichedSurveyResponseBatchBuilder
 from mangrove.transport.contract.survey_response import SurveyResponse
 
 
@@ -262,3 +262,49 @@ class TestSurveyResponseEventBuilder(TestCase):
             self.assertIsNone(data_sender['mobile_number'])
             self.assertIsNone(data_sender['deleted'])
             self.assertIsNone(data_sender['question_code'])
+
+
+class TestEnrichedSurveyResponseBatchBuilder(TestCase):
+    def setUp(self):
+        self.dbm = Mock(spec=DatabaseManager)
+        self.feeds_dbm = Mock(spec=DatabaseManager)
+        self.form_model = Mock(spec=FormModel)
+        self.form_model.id = 'form_model_id'
+        self.form_model.form_code = 'cli001'
+        self.form_model.fields = []
+        self.form_model.unique_id_answers.return_value = []
+        self.data_sender = Mock(spec=Contact)
+        self.data_sender.id = 'data_sender_uid'
+        self.data_sender.short_code = 'rep1'
+        self.data_sender.data = {"name": {"value": "sender"}, "mobile_number": {"value": "123"}}
+        self.data_sender.is_void.return_value = False
+        self.dbm.get_many.side_effect = lambda ids, object_class: \
+            [self.form_model] if object_class is FormModel else [self.data_sender]
+        self.feeds_dbm._save_documents.side_effect = lambda documents: [(True, d.id, 'rev') for d in documents]
+
+    def _survey_response(self, uuid, form_model_id='form_model_id'):
+        survey_response = Mock(spec=SurveyResponse)
+        survey_response.uuid = uuid
+        survey_response.form_model_id = form_model_id
+        survey_response.owner_uid = 'data_sender_uid'
+        survey_response.values = {}
+        survey_response.status = True
+        survey_response.modified = datetime(2014, 1, 1)
+        survey_response.is_void.return_value = False
+        return survey_response
+
+    def test_should_build_feed_documents_with_one_query_per_kind_and_one_bulk_save(self):
+        existing = EnrichedSurveyResponseDocument('sr1', additional_detail={'project': 'clinic test'})
+        self.feeds_dbm._load_documents.return_value = [existing]
+
+        errors = EnrichedSurveyResponseBatchBuilder(self.dbm, self.feeds_dbm).save(
+            [self._survey_response('sr1'), self._survey_response('sr2'), self._survey_response('sr3', 'deleted')])
+
+        self.assertEqual(['sr3'], errors.keys())
+        self.assertEqual(2, self.dbm.get_many.call_count)
+        self.feeds_dbm._load_documents.assert_called_once_with(['sr1', 'sr2', 'sr3'], EnrichedSurveyResponseDocument)
+        documents = self.feeds_dbm._save_documents.call_args[0][0]
+        self.assertEqual(['sr1', 'sr2'], [document.id for document in documents])
+        self.assertIs(existing, documents[0])
+        self.assertEqual({'project': 'clinic test'}, documents[0].additional_detail)
+        self.assertEqual('rep1', documents[1].data_sender['id'])
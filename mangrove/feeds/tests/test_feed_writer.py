@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from mock import Mock, patch
+from mangrove.datastore.database import DatabaseManager
+from mangrove.feeds.feed_writer import FeedJournal, FeedWriter
+from mangrove.transport.contract.survey_response import SurveyResponse
+
+
+class TestFeedJournal(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'feeds.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_should_replay_entries_not_marked_done(self):
+        journal = FeedJournal(self.path)
+        journal.open()
+        journal.append('sr1', {'project': 'p1'}, '123')
+        journal.append('sr2', None)
+        journal.append('sr3', None)
+        journal.done(['sr2'])
+        with open(self.path, 'a') as journal_file:
+            journal_file.write('{"id": "sr4"')
+
+        entries = FeedJournal(self.path).open()
+
+        self.assertEqual([('sr1', {'project': 'p1'}, '123'), ('sr3', None, None)], entries)
+        self.assertEqual(entries, FeedJournal(self.path).open())
+
+    def test_should_keep_an_entry_submitted_again_until_its_last_write(self):
+        journal = FeedJournal(self.path)
+        journal.open()
+        journal.append('sr1', None)
+        journal.append('sr1', {'project': 'p1'})
+        journal.done(['sr1'])
+
+        self.assertEqual(1, journal.pending)
+        self.assertEqual([('sr1', {'project': 'p1'}, None)], FeedJournal(self.path).open())
+
+    def test_should_truncate_the_journal_once_nothing_is_pending(self):
+        journal = FeedJournal(self.path)
+        journal.open()
+        journal.append('sr1', None)
+        journal.done(['sr1'])
+
+        self.assertEqual(0, os.path.getsize(self.path))
+
+    def test_should_compact_the_journal_once_done_records_outnumber_pending_ones(self):
+        journal = FeedJournal(self.path)
+        journal.open()
+        for survey_response_id in ['sr1', 'sr2', 'sr3', 'sr4']:
+            journal.append(survey_response_id, None)
+        journal.done(['sr1'])
+        journal.done(['sr3'])
+        journal.done(['sr2'])
+
+        with open(self.path) as journal_file:
+            lines = journal_file.readlines()
+        self.assertEqual(1, len(lines))
+        self.assertIn('"sr4"', lines[0])
+        self.assertEqual([('sr4', None, None)], FeedJournal(self.path).open())
+
+    def test_should_sync_appended_records_only_when_asked(self):
+        journal = FeedJournal(self.path)
+        journal.open()
+        with patch('mangrove.feeds.feed_writer.os.fsync') as fsync:
+            journal.append('sr1', None)
+            journal.append('sr2', None)
+            self.assertFalse(fsync.called)
+
+            journal.sync()
+            journal.sync()
+            self.assertEqual(1, fsync.call_count)
+
+
+class TestFeedWriter(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dbm = Mock(spec=DatabaseManager)
+        self.feeds_dbm = Mock(spec=DatabaseManager)
+        self.builder_patch = patch('mangrove.feeds.feed_writer.EnrichedSurveyResponseBatchBuilder')
+        self.builder = self.builder_patch.start().return_value
+        self.builder.save_entries.return_value = {}
+
+    def tearDown(self):
+        self.builder_patch.stop()
+        shutil.rmtree(self.directory)
+
+    def _survey_response(self, uuid):
+        survey_response = Mock(spec=SurveyResponse)
+        survey_response.uuid = uuid
+        return survey_response
+
+    def _writer(self, **kwargs):
+        return FeedWriter(self.dbm, self.feeds_dbm, os.path.join(self.directory, 'feeds.journal'), **kwargs)
+
+    def test_should_write_submitted_feed_documents_in_the_background(self):
+        writer = self._writer(batch_size=10)
+        writer.start()
+        first, second = self._survey_response('sr1'), self._survey_response('sr2')
+
+        writer.submit(first, {'project': 'p1'}, '123')
+        writer.submit(second)
+        writer.stop()
+
+        entries = [entry for call in self.builder.save_entries.call_args_list for entry in call[0][0]]
+        self.assertEqual([(first, {'project': 'p1'}, '123'), (second, None, None)], entries)
+        self.assertEqual(0, writer.journal.pending)
+
+    def test_should_keep_failed_entries_and_replay_them_from_the_stored_survey_responses(self):
+        self.builder.save_entries.return_value = {'sr1': 'error'}
+        writer = self._writer()
+        writer.start()
+        writer.submit(self._survey_response('sr1'), {'project': 'p1'})
+        writer.stop()
+
+        self.builder.save_entries.return_value = {}
+        stored = self._survey_response('sr1')
+        self.dbm.get_many.return_value = [stored]
+        writer = self._writer()
+        writer.start()
+        writer.stop()
+
+        self.dbm.get_many.assert_called_once_with(['sr1'], SurveyResponse)
+        self.assertEqual([(stored, {'project': 'p1'}, None)], self.builder.save_entries.call_args[0][0])
+        self.assertEqual(0, writer.journal.pending)
+
+    def test_should_retry_failed_entries_while_running(self):
+        self.builder.save_entries.side_effect = [{'sr1': 'error'}, {}]
+        writer = self._writer(retry_delay=0.01)
+        writer.start()
+        survey_response = self._survey_response('sr1')
+        writer.submit(survey_response)
+        for attempt in range(200):
+            if not writer.journal.pending:
+                break
+            time.sleep(0.01)
+        writer.stop()
+
+        self.assertEqual(0, writer.journal.pending)
+        self.assertEqual([[(survey_response, None, None)]] * 2,
+                         [call[0][0] for call in self.builder.save_entries.call_args_list])
+
+    def test_should_write_a_survey_response_submitted_twice_in_a_batch_once(self):
+        writer = self._writer()
+        first, edited = self._survey_response('sr1'), self._survey_response('sr1')
+        writer.journal.open()
+        writer.journal.append('sr1', None)
+        writer.journal.append('sr1', None)
+
+        writer.write([('sr1', first, None, None), ('sr1', edited, None, None)])
+
+        self.assertEqual([(edited, None, None)], self.builder.save_entries.call_args[0][0])
+        self.assertEqual(0, writer.journal.pending)
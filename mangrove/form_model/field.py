@@ -1,4 +1,5 @@
 from collections import OrderedDict
+import copy
 import re
 from HTMLParser import HTMLParser
 import abc
@@ -8,7 +9,7 @@ from babel.dates import format_date
 from coverage.html import escape
 
 from mangrove.data_cleaner import TelephoneNumber
-from mangrove.datastore.entity import get_all_entities
+from mangrove.datastore.entity import iter_all_entities
 from mangrove.errors.MangroveException import AnswerTooBigException, AnswerTooSmallException, AnswerWrongType, \
     IncorrectDate, AnswerTooLongException, AnswerTooShortException, GeoCodeFormatException, \
     RequiredFieldNotPresentException
@@ -426,6 +427,16 @@ class Field(object):
     def set_value(self, value):
         self.value = value
 
+    def clone(self):
+        """
+        Returns a copy of this field without any bound answer or errors. Constraints are shared.
+        """
+        field = copy.copy(self)
+        field._dict = copy.deepcopy(self._dict)
+        field.errors = []
+        field.value = None
+        return field
+
     def get_constraint_text(self):
         return ""
 
@@ -719,7 +730,7 @@ class UniqueIdUIField(UniqueIdField):
     def options(self):
         h = HTMLParser()
         list = []
-        for entity in get_all_entities(self.dbm, [self.unique_id_type]):
+        for entity in iter_all_entities(self.dbm, [self.unique_id_type]):
             unescapedLabel = h.unescape(entity.data['name']['value'])
             list.append((entity.short_code, unescapedLabel))
         return list
@@ -1095,6 +1106,14 @@ class FieldSet(Field):
                 list.append(dict)
         super(FieldSet, self).set_value(list)
 
+    def clone(self):
+        field = copy.copy(self)
+        field._dict = dict((key, copy.deepcopy(value)) for key, value in self._dict.items() if key != 'fields')
+        field.fields = field._dict['fields'] = [f.clone() for f in self.fields]
+        field.errors = []
+        field.value = None
+        return field
+
     @property
     def fieldset_type(self):
         return self._dict.get(self.FIELDSET_TYPE)
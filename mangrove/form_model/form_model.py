@@ -16,6 +16,7 @@ from mangrove.form_model.field import UniqueIdField, ShortCodeField, FieldSet, M
 from mangrove.form_model.validator_factory import validator_factory
 from mangrove.form_model.xform import Xform, get_node, add_node, remove_attrib
 from mangrove.form_model.validators import MandatoryValidator
+from mangrove.utils.lru_cache import LRUCache
 from mangrove.utils.types import is_sequence, is_string, is_empty, is_not_empty
 
 ARPT_SHORT_CODE = "dummy"
@@ -47,44 +48,82 @@ IS_DATASENDER_FIELD_CODE = "is_data_sender"
 REPORTER = "reporter"
 GLOBAL_REGISTRATION_FORM_ENTITY_TYPE = "registration"
 FORM_MODEL_EXPIRY_TIME_IN_SEC = 2 * 60 * 60
+UNKNOWN_FORM_CODE_EXPIRY_TIME_IN_SEC = 60
+FORM_MODEL_LOCAL_CACHE_SIZE = 200
 ENTITY_DELETION_FORM_CODE = "delete"
 
+# Built form models keyed by (memcached key, _rev). Only copies are handed out.
+_form_model_cache = LRUCache(FORM_MODEL_LOCAL_CACHE_SIZE)
+
+# Cached in place of the document for codes which are no questionnaire, so that spam and poll replies do not query
+# the questionnaire view every time. It is only cached after a strict read, as the questionnaire view may be read
+# stale, and only when the key is free. Saving a questionnaire with the code deletes it like any cached document.
+UNKNOWN_FORM_CODE = 'unknown_form_code'
+
 
 def get_form_model_document(code, dbm):
     cache_manger = get_cache_manager()
     key_as_str = get_form_model_cache_key(code, dbm)
     row_value = cache_manger.get(key_as_str)
+    if row_value == UNKNOWN_FORM_CODE:
+        raise FormModelDoesNotExistsException(code)
     if row_value is None:
-        row_value = _load_questionnaire(code, dbm)
+        try:
+            row_value = _load_questionnaire(code, dbm)
+        except FormModelDoesNotExistsException:
+            try:
+                row_value = _load_questionnaire(code, dbm, stale=None)
+            except FormModelDoesNotExistsException:
+                cache_manger.add(key_as_str, UNKNOWN_FORM_CODE, time=UNKNOWN_FORM_CODE_EXPIRY_TIME_IN_SEC)
+                raise
         cache_manger.set(key_as_str, row_value, time=FORM_MODEL_EXPIRY_TIME_IN_SEC)
     return row_value
 
 
 def get_form_model_by_code(dbm, code):
     row_value = get_form_model_document(code, dbm)
+    revision = row_value.get('_rev')
+    if revision is None:
+        return _form_model_from_row(dbm, row_value)
 
+    local_cache_key = (get_form_model_cache_key(code, dbm), revision)
+    form_model = _form_model_cache.get(local_cache_key)
+    if form_model is None:
+        form_model = _form_model_from_row(dbm, copy.deepcopy(row_value))
+        _form_model_cache.set(local_cache_key, form_model)
+    return form_model.copy_with_document(dbm, row_value)
+
+
+def _form_model_from_row(dbm, row_value):
     if row_value.get('is_registration_model') or row_value.get('form_code') == ENTITY_DELETION_FORM_CODE:
         return EntityFormModel.new_from_doc(dbm, EntityFormModelDocument.wrap(row_value))
     return FormModel.new_from_doc(dbm, FormModelDocument.wrap(row_value))
 
 
-def _load_questionnaire(form_code, dbm):
+def clear_local_form_model_cache(cache_key=None):
+    if cache_key is None:
+        _form_model_cache.clear()
+    else:
+        _form_model_cache.delete_matching(lambda key: key[0] == cache_key)
+
+
+def _load_questionnaire(form_code, dbm, **options):
     assert isinstance(dbm, DatabaseManager)
     assert is_string(form_code)
-    rows = dbm.load_all_rows_in_view('questionnaire', key=form_code)
+    rows = dbm.load_all_rows_in_view('questionnaire', key=form_code, include_docs=True, **options)
     if not len(rows):
         raise FormModelDoesNotExistsException(form_code)
-    return rows[0]['value']
+    return rows[0]['doc']
 
 
 def list_form_models_by_code(dbm, codes):
     assert isinstance(dbm, DatabaseManager)
     assert is_sequence(codes)
 
-    rows = dbm.load_all_rows_in_view('questionnaire', keys=codes)
+    rows = dbm.load_all_rows_in_view('questionnaire', keys=codes, include_docs=True)
 
     def _row_to_form_model(row):
-        doc = FormModelDocument.wrap(row['value'])
+        doc = FormModelDocument.wrap(row['doc'])
         return FormModel.new_from_doc(dbm, doc)
 
     return map(_row_to_form_model, rows)
@@ -98,6 +137,11 @@ def get_form_model_cache_key(form_code, dbm):
     return str("%s_%s" % (dbm.database.name, form_code))
 
 
+def get_active_project_cache_key(dbm):
+    assert isinstance(dbm, DatabaseManager)
+    return str("%s:active_project" % dbm.database.name)
+
+
 def header_fields(form_model, key_attribute="name", ref_header_dict=None):
     header_dict = ref_header_dict or OrderedDict()
     _header_fields(form_model.fields, key_attribute, header_dict)
@@ -160,17 +204,27 @@ class FormModel(DataObject):
     @classmethod
     def new_from_doc(cls, dbm, doc):
         form_model = super(FormModel, cls).new_from_doc(dbm, doc)
-        if form_model.xform:
-            form_model.xform_model = Xform(form_model.xform)
         form_model._old_doc = copy.deepcopy(form_model._doc)
         return form_model
 
-    @classmethod
-    def get(cls, dbm, id, get_or_create=False):
-        do = super(FormModel, cls).get(dbm, id, get_or_create)
-        if do.xform:
-            do.xform_model = Xform(do.xform)
-        return do
+    def copy_with_document(self, dbm, document_dict):
+        """
+        Returns a copy of this form model wrapping document_dict, which must hold the same revision.
+
+        Fields and validators are cloned so answers bound on the copy stay private to it. The parsed
+        xform is rebuilt lazily and the pre-save snapshot (_old_doc) is shared, as neither is modified.
+        """
+        form_model = copy.copy(self)
+        form_model._dbm = dbm
+        form_model._doc = self.__document_class__.wrap(document_dict)
+        form_model._xform_model = None
+        form_model._form_fields = [f.clone() for f in self._form_fields]
+        form_model._snapshots = dict((revision, [f.clone() for f in snapshot_fields])
+                                     for revision, snapshot_fields in self._snapshots.items())
+        form_model.validators = [copy.copy(validator) for validator in self.validators]
+        form_model.errors = []
+        form_model._validation_exception = []
+        return form_model
 
     def _set_doc(self, form_code, is_registration_model, label, language, name):
         doc = FormModelDocument()
@@ -377,6 +431,16 @@ class FormModel(DataObject):
                 break
         return flag
 
+    @property
+    def xform_model(self):
+        if self._xform_model is None and self._doc is not None and self.xform:
+            self._xform_model = Xform(self.xform)
+        return self._xform_model
+
+    @xform_model.setter
+    def xform_model(self, value):
+        self._xform_model = value
+
     @property
     def xform(self):
         return self._doc.xform
@@ -410,6 +474,11 @@ class FormModel(DataObject):
     def form_code(self, value):
         self._doc.form_code = value
 
+    @property
+    def is_poll(self):
+        # set on project documents only, read from the document so that no Project has to be loaded
+        return self._doc.get('is_poll') is True
+
     @property
     def fields(self):
         return self._form_fields
@@ -469,6 +538,8 @@ class FormModel(DataObject):
             form_code_to_clear = self.old_form_code
         cache_key = get_form_model_cache_key(form_code_to_clear, self._dbm)
         cache_manger.delete(cache_key)
+        cache_manger.delete(get_active_project_cache_key(self._dbm))
+        clear_local_form_model_cache(cache_key)
 
     def void(self, void=True):
         self._delete_form_model_from_cache()
@@ -495,7 +566,10 @@ class FormModel(DataObject):
         self._delete_form_model_from_cache()
         if self._doc is None:
             raise NoDocumentError('No document to save')
-        return self._dbm._save_document(self._doc, prev_doc=self._old_doc, process_post_update=process_post_update)
+        saved = self._dbm._save_document(self._doc, prev_doc=self._old_doc, process_post_update=process_post_update)
+        # a lookup which missed while the document was being saved may have cached the code as unknown
+        self._delete_form_model_from_cache()
+        return saved
 
     def update_attachments(self, attachments, attachment_name=None):
         return self.put_attachment(self._doc, attachments, filename=attachment_name)
@@ -691,13 +765,16 @@ class FormModel(DataObject):
         return key_value_items
 
     # TODO : does not handle value errors. eg. Text for Number. Done outside the service right now.
-    def validate_submission(self, values):
+    def validate_submission(self, values, entity_resolver=None):
         assert values is not None
         cleaned_values = OrderedDict()
         errors = OrderedDict()
         if not self.xform:
             for validator in self.validators:
-                validator_error = validator.validate(values, self.fields, self._dbm)
+                if entity_resolver is not None:
+                    validator_error = validator.validate(values, self.fields, self._dbm, entity_resolver=entity_resolver)
+                else:
+                    validator_error = validator.validate(values, self.fields, self._dbm)
                 if hasattr(validator, 'exception'):
                     self._validation_exception.extend(getattr(validator, 'exception'))
                 errors.update(validator_error)
@@ -716,6 +793,24 @@ class FormModel(DataObject):
                 errors[field.code] = result if not errors.get(field.code) else errors[field.code]
         return cleaned_values, errors
 
+    def unique_id_answers(self, values):
+        """
+        Returns the ([unique_id_type], short_code) pairs answered in values, including answers inside repeats.
+        """
+        return self._unique_id_answers(self.fields, values)
+
+    def _unique_id_answers(self, fields, values):
+        answers = []
+        for field in fields:
+            answer = self._case_insensitive_lookup(values, field.code)
+            if isinstance(field, UniqueIdField) and is_string(answer) and is_not_empty(answer):
+                answers.append(([field.unique_id_type], answer.lower()))
+            elif isinstance(field, FieldSet) and is_sequence(answer):
+                for repeat_answers in answer:
+                    if isinstance(repeat_answers, dict):
+                        answers.extend(self._unique_id_answers(field.fields, repeat_answers))
+        return answers
+
     def _case_insensitive_lookup(self, values, code):
         for fieldcode in values:
             if fieldcode.lower() == code.lower():
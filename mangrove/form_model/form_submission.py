@@ -61,6 +61,19 @@ class FormSubmission(object):
         except MangroveException as e:
             self.save(dbm)
 
+    def new_entity_documents(self, dbm):
+        """
+        Builds the new entity and its first data record without saving either, so that imports can write
+        them in bulk. The entity type and short code must already have been checked for the whole batch.
+        """
+        new_entity = self.create_entity(dbm, validate=False)
+        values = self._values
+        new_entity.set_latest_data(values)
+        data_record_doc = DataRecordDocument(entity_doc=new_entity._doc, data=values,
+                                             submission=dict(form_code=self.form_code))
+        self.data_record_id = data_record_doc.id
+        return new_entity, data_record_doc
+
     def _contains_geo_code(self, item):
         item_ = item[0]
         return item_ == GEO_CODE_FIELD_NAME
@@ -86,13 +99,14 @@ class FormSubmission(object):
     def _values(self):
         return self._to_three_tuple()
 
-    def create_entity(self, dbm):
+    def create_entity(self, dbm, validate=True):
         location_hierarchy, processed_geometry = Location(self.location_tree, self.form_model).process_entity_creation(
             self.cleaned_data)
         return entity.create_entity(dbm=dbm, entity_type=self.entity_type,
                                     location=location_hierarchy,
                                     short_code=self.short_code,
-                                    geometry=processed_geometry)
+                                    geometry=processed_geometry,
+                                    validate=validate)
 
     def get_entity(self, dbm):
         return entity.get_by_short_code(dbm=dbm, short_code=self.short_code, entity_type=self.entity_type)
@@ -113,10 +127,13 @@ class FormSubmission(object):
 
 
 class DataFormSubmission(FormSubmission):
-    def __init__(self, form_model, answers, errors):
+    def __init__(self, form_model, answers, errors, entity_resolver=None):
         super(DataFormSubmission, self).__init__(form_model, answers, errors)
+        self.entity_resolver = entity_resolver
 
     def create_entity(self, dbm):
+        if self.entity_resolver is not None:
+            return self.entity_resolver.get_by_short_code(self.short_code, self.entity_type)
         return entity.get_by_short_code(dbm, self.short_code, self.entity_type)
 
     def save(self, dbm):
@@ -124,14 +141,17 @@ class DataFormSubmission(FormSubmission):
         if self.short_code:
             entity = self.create_entity(dbm)
             doc = entity._doc
+        data_record_doc = self.data_record_document(doc)
+        self.data_record_id = dbm._save_document(data_record_doc)
+        return self.data_record_id
+
+    def data_record_document(self, entity_doc):
         submission_information = dict(form_code=self.form_code)
-        data_record_doc = DataRecordDocument(
-            entity_doc=doc,
+        return DataRecordDocument(
+            entity_doc=entity_doc,
             data=self._values,
             submission=submission_information
         )
-        self.data_record_id = dbm._save_document(data_record_doc)
-        return self.data_record_id
 
 
 class GlobalRegistrationFormSubmission(FormSubmission):
@@ -162,7 +182,7 @@ class GlobalRegistrationFormSubmission(FormSubmission):
     def get_entity(self, dbm):
         return entity.contact_by_short_code(dbm=dbm, short_code=self.short_code)
 
-    def create_entity(self, dbm):
+    def create_entity(self, dbm, validate=True):
         location_hierarchy, processed_geometry = Location(self.location_tree, self.form_model).process_entity_creation(
             self.cleaned_data)
         is_datasender = self._cleaned_data.pop('is_data_sender', True)
@@ -170,7 +190,8 @@ class GlobalRegistrationFormSubmission(FormSubmission):
                                      location=location_hierarchy,
                                      short_code=self.short_code,
                                      geometry=processed_geometry,
-                                     is_datasender=is_datasender)
+                                     is_datasender=is_datasender,
+                                     validate=validate)
 
 
 class EntityRegistrationFormSubmission(FormSubmission):
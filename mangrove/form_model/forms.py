@@ -2,7 +2,7 @@ from mangrove.errors.MangroveException import MangroveException
 
 class EditSurveyResponseForm(object):
 
-    def __init__(self, dbm, survey_response, form_model, form_answers):
+    def __init__(self, dbm, survey_response, form_model, form_answers, entity_resolver=None):
         assert dbm is not None
         assert survey_response is not None
         assert form_model is not None
@@ -11,7 +11,8 @@ class EditSurveyResponseForm(object):
 
         self.dbm = dbm
         self.form_model = form_model
-        self._cleaned_data, self.errors = form_model.validate_submission(values=form_answers)
+        self._cleaned_data, self.errors = form_model.validate_submission(values=form_answers,
+                                                                         entity_resolver=entity_resolver)
         self.form_model.bind(form_answers)
 
         self.is_valid = (self.errors is None or len(self.errors) == 0)
@@ -1,13 +1,15 @@
 from collections import OrderedDict
 from datetime import timedelta
 
+from mangrove.datastore.cache_manager import get_cache_manager
 from mangrove.datastore.database import DatabaseManager, DataObject
 from mangrove.datastore.documents import ProjectDocument
 from mangrove.datastore.entity import from_row_to_entity, Contact
 from mangrove.errors.MangroveException import DataObjectAlreadyExists, FormModelDoesNotExistsException, \
     ProjectPollCodeDoesNotExistsException
 from mangrove.form_model.deadline import Deadline, Month, Week
-from mangrove.form_model.form_model import REPORTER, get_form_model_by_code, FormModel, get_form_model_document
+from mangrove.form_model.form_model import REPORTER, get_form_model_by_code, FormModel, get_form_model_document, \
+    get_active_project_cache_key, FORM_MODEL_EXPIRY_TIME_IN_SEC, ENTITY_DELETION_FORM_CODE
 from mangrove.transport.repository.reporters import get_reporters_who_submitted_data_for_frequency_period
 from mangrove.datastore.user_questionnaire_preference import UserQuestionnairePreference, \
     UserQuestionnairePreferenceDocument
@@ -335,27 +337,91 @@ def get_field_default_value(key, entity):
 
 
 def get_active_form_model(dbm, form_code):
+    project = _get_active_project(dbm)
+    if project is None:
+        raise FormModelDoesNotExistsException(form_code)
+    return project
+
+
+def _get_active_project(dbm):
+    """
+    Returns the active project or None. Which one it is, or that there is none, is kept in memcached per database
+    until a questionnaire is saved, voided or deleted, so only the first lookup scans all the projects.
+    """
+    cache_manager = get_cache_manager()
+    cache_key = get_active_project_cache_key(dbm)
+    pointer = cache_manager.get(cache_key)
+    if pointer is not None:
+        if pointer['form_code'] is None:
+            return None
+        try:
+            project = get_project_by_code(dbm, pointer['form_code'])
+            if project.active:
+                return project
+        except FormModelDoesNotExistsException:
+            pass
+    project = _find_active_project(dbm)
+    cache_manager.set(cache_key, {'form_code': project.form_code if project is not None else None},
+                      time=FORM_MODEL_EXPIRY_TIME_IN_SEC)
+    return project
+
+
+def _find_active_project(dbm):
     projects = dbm.load_all_rows_in_view("all_projects")
     for project_row in projects:
         project_doc = ProjectDocument.wrap(project_row.get('value'))
         project = Project.new_from_doc(dbm, project_doc)
         if project.active:
             return project
-    raise FormModelDoesNotExistsException(form_code)
+    return None
 
 
 def check_if_form_code_is_poll(self, form_model):
-    if form_model:
-        project = get_project_by_code(self.dbm, form_model.form_code)
-        if project and project.is_poll is True:
-            raise ProjectPollCodeDoesNotExistsException(project.form_code)
+    if form_model and form_model.is_poll:
+        raise ProjectPollCodeDoesNotExistsException(form_model.form_code)
+
+
+class ResolvedQuestionnaire(object):
+    """
+    The questionnaire a submitted form code stands for. by_code is False when no questionnaire has the code and the
+    submission went to the active project instead, as a poll reply does.
+    """
+
+    def __init__(self, form_code, form_model, by_code):
+        self.form_code = form_code
+        self.form_model = form_model
+        self.by_code = by_code
+
+    @property
+    def is_poll(self):
+        return self.form_model.is_poll
+
+    @property
+    def is_registration(self):
+        return self.form_model.is_entity_registration_form()
+
+    @property
+    def is_deletion(self):
+        return self.form_model.form_code == ENTITY_DELETION_FORM_CODE
+
+
+def resolve_questionnaire(dbm, code):
+    """
+    Looks up the questionnaire for a submitted form code, falling back to the active project for codes which are
+    no questionnaire. Raises ProjectPollCodeDoesNotExistsException for the code of a poll, which is answered
+    without one, and FormModelDoesNotExistsException when no project is active either. Both lookups are cached.
+    """
+    try:
+        form_model = get_form_model_by_code(dbm, code)
+    except FormModelDoesNotExistsException:
+        return ResolvedQuestionnaire(code, get_active_form_model(dbm, code), by_code=False)
+    if form_model.is_poll:
+        raise ProjectPollCodeDoesNotExistsException(form_model.form_code)
+    return ResolvedQuestionnaire(code, form_model, by_code=True)
 
 
 def get_active_form_model_name_and_id(dbm):
-    projects = dbm.load_all_rows_in_view("all_projects")
-    for project_row in projects:
-        project_doc = ProjectDocument.wrap(project_row.get('value'))
-        project = Project.new_from_doc(dbm, project_doc)
-        if project.active:
-            return True, project.id, project.name
-    return False, "", ""
+    project = _get_active_project(dbm)
+    if project is None:
+        return False, "", ""
+    return True, project.id, project.name
@@ -1,11 +1,15 @@
 from collections import OrderedDict
+import copy
 import unittest
 from mock import Mock, patch
 from mangrove.datastore.documents import FormModelDocument
 from mangrove.datastore.database import DatabaseManager, DataObject
 from mangrove.form_model.field import TextField, IntegerField, SelectField, DateField, GeoCodeField, UniqueIdField, \
     FieldSet
-from mangrove.form_model.form_model import FormModel, get_form_model_by_code, EntityFormModel, get_form_model_by_entity_type
+from mangrove.form_model import form_model as form_model_module
+from mangrove.form_model.field import create_question_from
+from mangrove.form_model.form_model import FormModel, get_form_model_by_code, EntityFormModel, get_form_model_by_entity_type, \
+    clear_local_form_model_cache
 from mangrove.form_model.validation import NumericRangeConstraint, TextLengthConstraint
 from mangrove.form_model.validators import MandatoryValidator, UniqueIdExistsValidator
 import mangrove.errors.MangroveException as ex
@@ -14,6 +18,8 @@ import mangrove.errors.MangroveException as ex
 class TestFormModel(unittest.TestCase):
     def setUp(self):
         self.dbm = Mock(spec=DatabaseManager)
+        self.dbm.database = Mock(name='database')
+        self.dbm.database.name = 'db'
 
         q1 = UniqueIdField('clinic', name="entity_question", code="ID", label="What is associated entity")
         q2 = TextField(name="question1_Name", code="Q1", label="What is your name",
@@ -241,9 +247,134 @@ class TestFormModel(unittest.TestCase):
         form_model._form_fields = [fieldset_field]
         self.assertEqual(field1, form_model.get_field_by_code_in_fieldset('text','field_set_code'))
 
+    def _questionnaire_row(self, revision):
+        self.form_model._doc.json_fields = [f._to_json() for f in self.form_model.fields]
+        row = dict(self.form_model._doc.unwrap())
+        row['_rev'] = revision
+        return row
+
+    def test_should_build_form_model_once_per_revision_and_hand_out_independent_copies(self):
+        row = self._questionnaire_row('1-abc')
+        with patch('mangrove.form_model.form_model.get_cache_manager') as get_cache_manager:
+            with patch('mangrove.form_model.form_model.get_form_model_cache_key') as get_form_model_cache_key:
+                get_cache_manager.return_value.get.side_effect = lambda key: copy.deepcopy(row)
+                get_form_model_cache_key.return_value = 'db_1'
+                clear_local_form_model_cache()
+                with patch('mangrove.form_model.form_model.field.create_question_from',
+                           wraps=create_question_from) as create_question:
+                    first = get_form_model_by_code(self.dbm, '1')
+                    built_fields_count = create_question.call_count
+                    second = get_form_model_by_code(self.dbm, '1')
+                    self.assertEqual(built_fields_count, create_question.call_count)
+
+                first.bind({'Q1': 'first answer'})
+                self.assertEqual('first answer', first.get_field_by_code('Q1').value)
+                self.assertIsNone(second.get_field_by_code('Q1').value)
+                self.assertIsNot(first._doc, second._doc)
+                self.assertEqual(['ID', 'Q1', 'Q2', 'Q3', 'Q4', 'Q6', 'loc'], [f.code for f in second.fields])
+
+    def test_should_rebuild_form_model_when_revision_changes(self):
+        rows = [self._questionnaire_row('1-abc'), self._questionnaire_row('2-def')]
+        with patch('mangrove.form_model.form_model.get_cache_manager') as get_cache_manager:
+            with patch('mangrove.form_model.form_model.get_form_model_cache_key') as get_form_model_cache_key:
+                get_cache_manager.return_value.get.side_effect = lambda key: copy.deepcopy(rows.pop(0))
+                get_form_model_cache_key.return_value = 'db_1'
+                clear_local_form_model_cache()
+
+                self.assertEqual('1-abc', get_form_model_by_code(self.dbm, '1').revision)
+                self.assertEqual('2-def', get_form_model_by_code(self.dbm, '1').revision)
+
+    def _questionnaire_view(self, stale_rows, strict_rows):
+        self.dbm.load_all_rows_in_view.side_effect = lambda view_name, **options: list(
+            strict_rows if 'stale' in options and options['stale'] is None else stale_rows)
+
+    def test_should_remember_unknown_form_code_until_a_questionnaire_is_saved_with_it(self):
+        cache = DictCache()
+        self._questionnaire_view([], [])
+        with patch('mangrove.form_model.form_model.get_cache_manager', return_value=cache):
+            self.assertRaises(ex.FormModelDoesNotExistsException, get_form_model_by_code, self.dbm, '1')
+            self.assertRaises(ex.FormModelDoesNotExistsException, get_form_model_by_code, self.dbm, '1')
+            self.assertEqual(2, self.dbm.load_all_rows_in_view.call_count)
+
+            self.form_model._delete_form_model_from_cache()
+            self.assertRaises(ex.FormModelDoesNotExistsException, get_form_model_by_code, self.dbm, '1')
+            self.assertEqual(4, self.dbm.load_all_rows_in_view.call_count)
+
+    def test_should_not_remember_form_code_missing_from_a_stale_index(self):
+        cache = DictCache()
+        self._questionnaire_view([], [{'doc': self._questionnaire_row('1-abc')}])
+        clear_local_form_model_cache()
+        with patch('mangrove.form_model.form_model.get_cache_manager', return_value=cache):
+            self.assertEqual('1-abc', get_form_model_by_code(self.dbm, '1').revision)
+            self.assertEqual('1-abc', get_form_model_by_code(self.dbm, '1').revision)
+
+    def test_should_find_questionnaire_created_after_its_code_missed(self):
+        cache = DictCache()
+        self._questionnaire_view([], [])
+        clear_local_form_model_cache()
+        with patch('mangrove.form_model.form_model.get_cache_manager', return_value=cache):
+            self.assertRaises(ex.FormModelDoesNotExistsException, get_form_model_by_code, self.dbm, '1')
+            row = self._questionnaire_row('1-abc')
+            self._questionnaire_view([{'doc': row}], [{'doc': row}])
+            with patch.object(FormModel, 'is_form_code_unique', return_value=True):
+                self.form_model.save()
+
+            self.assertEqual('1-abc', get_form_model_by_code(self.dbm, '1').revision)
+
+    def test_should_not_replace_a_cached_questionnaire_with_the_unknown_marker(self):
+        cache = DictCache()
+        cache.set('db_1', 'document')
+
+        cache.add('db_1', form_model_module.UNKNOWN_FORM_CODE)
+
+        self.assertEqual('document', cache.get('db_1'))
+
+    def test_should_collect_unique_id_answers_including_repeats(self):
+        repeat = FieldSet('visits', 'visits', 'Visits', field_set=[
+            UniqueIdField('clinic', name='visited clinic', code='VC', label='Visited clinic')])
+        form_model = FormModel(self.dbm, name='visits', label='Visits', form_code='2',
+                               fields=[UniqueIdField('clinic', name='clinic', code='ID', label='Clinic'), repeat])
+
+        answers = form_model.unique_id_answers({'id': 'CLI1', 'visits': [{'vc': 'cli2'}, {'vc': ''}]})
+
+        self.assertEqual([(['clinic'], 'cli1'), (['clinic'], 'cli2')], answers)
+
+    def test_should_clear_local_form_model_cache_when_form_model_is_voided(self):
+        row = self._questionnaire_row('1-abc')
+        with patch('mangrove.form_model.form_model.get_cache_manager') as get_cache_manager:
+            with patch('mangrove.form_model.form_model.get_form_model_cache_key') as get_form_model_cache_key:
+                get_cache_manager.return_value.get.side_effect = lambda key: copy.deepcopy(row)
+                get_form_model_cache_key.return_value = 'db_1'
+                clear_local_form_model_cache()
+                form_model = get_form_model_by_code(self.dbm, '1')
+
+                form_model.void()
+
+                self.assertNotIn(('db_1', '1-abc'), form_model_module._form_model_cache)
+
 class DatabaseManagerStub(DatabaseManager):
     def __init__(self):
         self.view = Mock()
 
     def _load_document(self, id, document_class=None):
         return Mock(FormModelDocument)
+
+
+class DictCache(object):
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, time=0):
+        self.values[key] = value
+
+    def add(self, key, value, time=0):
+        if key in self.values:
+            return False
+        self.values[key] = value
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
@@ -0,0 +1,87 @@
+import unittest
+from mock import Mock, patch
+from mangrove.datastore.database import DatabaseManager
+from mangrove.errors.MangroveException import FormModelDoesNotExistsException, ProjectPollCodeDoesNotExistsException
+from mangrove.form_model.form_model import clear_local_form_model_cache
+from mangrove.form_model.project import Project, get_active_form_model, get_active_form_model_name_and_id, \
+    resolve_questionnaire
+from mangrove.form_model.tests.test_form_model_unit_tests import DictCache
+
+
+class TestActiveProject(unittest.TestCase):
+    def setUp(self):
+        self.dbm = Mock(spec=DatabaseManager)
+        self.dbm.database = Mock(name='database')
+        self.dbm.database.name = 'db'
+        self.cache = DictCache()
+        self.patches = [patch('mangrove.form_model.form_model.get_cache_manager', return_value=self.cache),
+                        patch('mangrove.form_model.project.get_cache_manager', return_value=self.cache)]
+        for cache_patch in self.patches:
+            cache_patch.start()
+        clear_local_form_model_cache()
+
+    def tearDown(self):
+        for cache_patch in self.patches:
+            cache_patch.stop()
+
+    def _project_rows(self, *projects):
+        rows = []
+        for form_code, active, is_poll in projects:
+            project = Project(self.dbm, form_code=form_code, name=form_code, active=active, is_poll=is_poll)
+            rows.append({'value': dict(project._doc.unwrap(), _rev='1-%s' % form_code)})
+        self.dbm.load_all_rows_in_view.side_effect = lambda view_name, **options: {
+            'all_projects': rows,
+            'questionnaire': [{'doc': row['value']} for row in rows if row['value']['form_code'] == options.get('key')]
+        }[view_name]
+        return rows
+
+    def _all_projects_queries(self):
+        return [call for call in self.dbm.load_all_rows_in_view.call_args_list if call[0][0] == 'all_projects']
+
+    def test_should_scan_projects_once_for_the_active_project(self):
+        self._project_rows(('poll1', 'inactive', True), ('poll2', 'active', True))
+
+        self.assertEqual('poll2', get_active_form_model(self.dbm, 'spam').form_code)
+        self.assertEqual('poll2', get_active_form_model(self.dbm, 'spam').form_code)
+        self.assertEqual(1, len(self._all_projects_queries()))
+
+    def test_should_remember_that_no_project_is_active(self):
+        self._project_rows(('poll1', 'inactive', True))
+
+        self.assertRaises(FormModelDoesNotExistsException, get_active_form_model, self.dbm, 'spam')
+        self.assertEqual((False, "", ""), get_active_form_model_name_and_id(self.dbm))
+        self.assertEqual(1, len(self._all_projects_queries()))
+
+    def test_should_find_active_project_again_after_a_project_is_saved(self):
+        self._project_rows(('poll1', 'inactive', True))
+        self.assertRaises(FormModelDoesNotExistsException, get_active_form_model, self.dbm, 'spam')
+
+        self._project_rows(('poll1', 'active', True))
+        Project(self.dbm, form_code='poll1', name='poll1', active='active')._delete_form_model_from_cache()
+
+        self.assertEqual('poll1', get_active_form_model(self.dbm, 'spam').form_code)
+
+    def test_should_resolve_questionnaire_by_its_code(self):
+        self._project_rows(('survey1', 'active', False))
+
+        questionnaire = resolve_questionnaire(self.dbm, 'survey1')
+
+        self.assertTrue(questionnaire.by_code)
+        self.assertFalse(questionnaire.is_poll)
+        self.assertFalse(questionnaire.is_registration)
+        self.assertEqual('survey1', questionnaire.form_model.form_code)
+        self.assertEqual(['questionnaire'], [call[0][0] for call in self.dbm.load_all_rows_in_view.call_args_list])
+
+    def test_should_resolve_unknown_code_to_the_active_project(self):
+        self._project_rows(('poll1', 'active', True))
+
+        questionnaire = resolve_questionnaire(self.dbm, 'hello')
+
+        self.assertFalse(questionnaire.by_code)
+        self.assertTrue(questionnaire.is_poll)
+        self.assertEqual('poll1', questionnaire.form_model.form_code)
+
+    def test_should_not_accept_the_code_of_a_poll(self):
+        self._project_rows(('poll1', 'active', True))
+
+        self.assertRaises(ProjectPollCodeDoesNotExistsException, resolve_questionnaire, self.dbm, 'poll1')
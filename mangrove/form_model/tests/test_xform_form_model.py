@@ -78,7 +78,7 @@ class TestXformFormModel(TestCase):
         entity2 = Entity(self.dbm, short_code="shortCode2", entity_type="clinic")
         entity2._doc.data['name'] = {'value': 'nameOfEntity2'}
         entities = [entity1, entity2]
-        with patch('mangrove.form_model.field.get_all_entities') as get_entities:
+        with patch('mangrove.form_model.field.iter_all_entities') as get_entities:
             get_entities.return_value = entities
             self.questionnaire.xform_model = Xform(self.questionnaire.xform)
             actual_xform = self.questionnaire.xform_with_unique_ids_substituted()
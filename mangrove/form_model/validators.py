@@ -17,7 +17,7 @@ class MandatoryValidator(object):
         return [field for field in fields if field.is_required()]
 
 
-    def validate(self, values, fields, dbm=None):
+    def validate(self, values, fields, dbm=None, entity_resolver=None):
         errors = OrderedDict()
         mandatory_fields = self.get_mandatory_fields(fields)
         for field in mandatory_fields:
@@ -40,14 +40,17 @@ class UniqueIdExistsValidator(object):
         return [field for field in fields if field.type == field_attributes.UNIQUE_ID_FIELD]
 
 
-    def validate(self, values, fields, dbm=None):
+    def validate(self, values, fields, dbm=None, entity_resolver=None):
         errors = OrderedDict()
         unique_id_fields = self.get_unique_id_field(fields)
         self.exception = []
         for field in unique_id_fields:
             unique_id = case_insensitive_lookup(values, field.code)
             try:
-                get_by_short_code(dbm, unique_id, [field.unique_id_type])
+                if entity_resolver is not None:
+                    entity_resolver.get_by_short_code(unique_id, [field.unique_id_type])
+                else:
+                    get_by_short_code(dbm, unique_id, [field.unique_id_type])
             except DataObjectNotFound as e:
                 self.exception.append(e)
                 errors[field.code] = e.message
@@ -2,7 +2,7 @@ class Response(object):
     def __init__(self, reporters=[],  survey_response_id=None, success=False, errors=None,
                  data_record_id=None, short_code=None,
                  cleaned_data=None, is_registration=False, entity_type=None, form_code=None, feed_error_message=None,
-                 subject=None, created=None, exception=None, version=None):
+                 subject=None, created=None, exception=None, version=None, stage_timings=None):
         self.reporters = reporters if reporters is not None else []
         self.success = success
         self.survey_response_id = survey_response_id
@@ -18,6 +18,8 @@ class Response(object):
         self.created = created
         self.exception = exception
         self.version = version
+        # (stage, seconds) pairs for requests sampled by the stage timer
+        self.stage_timings = stage_timings
 
 
 def create_response_from_form_submission(reporters, form_submission=None):
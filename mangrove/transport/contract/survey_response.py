@@ -21,7 +21,11 @@ def convert_dict_keys_to_lowercase(dictionary):
 def get_survey_responses_by_form_model_id(dbm, form_model_id, batch_size=1000, skip=0):
         start_key = [form_model_id] if form_model_id else []
         end_key = [form_model_id, {}] if form_model_id else [{}, {}]
-        return dbm.database.iterview("surveyresponse/surveyresponse", batch_size, reduce=False, include_docs=False, startkey=start_key, endkey=end_key, skip=skip)
+        rows = dbm.iter_view("surveyresponse", batch_size, reduce=False, include_docs=True, startkey=start_key, endkey=end_key, skip=skip)
+        for row in rows:
+            # the view no longer emits the document; keep handing it out as the row value
+            row['value'] = row['doc']
+            yield row
 
 
 def get_survey_response_by_report_view_name(dbm, report_view_name, keys):
@@ -67,6 +71,10 @@ class SurveyResponse(DataObject):
     def data_record_id(self):
         return self._doc.data_record_id
 
+    @data_record_id.setter
+    def data_record_id(self, data_record_id):
+        self._doc.data_record_id = data_record_id
+
     @property
     def destination(self):
         return self._doc.destination
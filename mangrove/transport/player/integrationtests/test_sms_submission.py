@@ -8,7 +8,6 @@ from string import upper
 from time import mktime
 import unittest
 import datetime
-from couchdb.design import ViewDefinition
 from mangrove.bootstrap import initializer
 from mangrove.bootstrap.views import view_js
 from mangrove.datastore.database import get_db_manager, _delete_db_and_remove_db_manager
@@ -46,9 +45,9 @@ def create_db(name):
         funcs = view_js[v]
         map = (funcs['map'] if 'map' in funcs else None)
         reduce = (funcs['reduce'] if 'reduce' in funcs else None)
-        views.append(ViewDefinition(v, v, map, reduce))
+        views.append((v, map, reduce))
 
-    ViewDefinition.sync_many(dbm.database, views)
+    dbm.create_views(views)
     return dbm
 
 
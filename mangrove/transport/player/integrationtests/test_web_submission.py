@@ -100,7 +100,7 @@ class TestWEBSubmission(MangroveTestCase):
         response = self.send_request_to_web_player(text)
         self.assertTrue(response.success)
         self.assertIsNotNone(response.datarecord_id)
-        expected_short_code = "rep3"
+        expected_short_code = "rep2"
         self.assertEqual(response.short_code, expected_short_code)
         b = contact_by_short_code(self.manager, expected_short_code)
         self.assertEqual(b.short_code, expected_short_code)
@@ -4,52 +4,100 @@ from tempfile import NamedTemporaryFile
 
 from PIL import Image
 
-from mangrove.datastore.entity import contact_by_short_code
+from mangrove.datastore.entity import contact_by_short_code, by_short_code
 from mangrove.form_model.form_model import NAME_FIELD, EntityFormModel, get_form_model_by_code
+from mangrove.form_model.project import get_active_form_model
 from mangrove.transport import TransportInfo
 from mangrove.transport.player.parser import WebParser, SMSParserFactory, XFormParser
 from mangrove.transport.repository.survey_responses import get_survey_response_document
 from mangrove.transport.services.MediaSubmissionService import MediaSubmissionService
 from mangrove.transport.services.identification_number_service import IdentificationNumberService
-from mangrove.transport.services.survey_response_service import SurveyResponseService
+from mangrove.transport.services.stage_timer import stage_timer
+from mangrove.transport.services.survey_response_service import SurveyResponseService, SurveySubmission
 from mangrove.transport.repository import reporters
-from mangrove.errors.MangroveException import NumberNotRegisteredException, MangroveException
+from mangrove.transport.repository.reporters import REPORTER_ENTITY_TYPE
+from mangrove.transport.contract.response import Response
+from mangrove.errors.MangroveException import NumberNotRegisteredException, MangroveException, \
+    MultipleReportersForANumberException, FormModelDoesNotExistsException
 
 
 class WebPlayerV2(object):
-    def __init__(self, dbm, feeds_dbm=None, admin_id=None):
+    def __init__(self, dbm, feeds_dbm=None, admin_id=None, feed_writer=None):
         self.dbm = dbm
         self.feeds_dbm = feeds_dbm
         self.admin_id = admin_id
+        self.feed_writer = feed_writer
 
     def add_survey_response(self, request, reporter_id, additional_feed_dictionary=None, logger=None):
         assert request is not None
-        form_code, values = self._parse(request.message)
-        service = SurveyResponseService(self.dbm, logger, self.feeds_dbm, self.admin_id)
+        timer = stage_timer(self.dbm)
+        with timer.stage('parse'):
+            form_code, values = self._parse(request.message)
+        service = SurveyResponseService(self.dbm, logger, self.feeds_dbm, self.admin_id,
+                                        feed_writer=self.feed_writer, stage_timer=timer)
         return service.save_survey(form_code, values, [], request.transport,
                                    reporter_id, additional_feed_dictionary)
 
+    def accept_many(self, requests, reporter_id, additional_feed_dictionary=None, logger=None):
+        """
+        Saves web submissions from one data sender with bulk writes. Returns one Response per request, in order.
+        """
+        timer = stage_timer(self.dbm)
+        with timer.stage('reporter'):
+            reporter = by_short_code(self.dbm, reporter_id.lower(), REPORTER_ENTITY_TYPE) if reporter_id else None
+        responses = [None] * len(requests)
+        submissions = []
+        indices = []
+        with timer.stage('parse'):
+            for index, request in enumerate(requests):
+                try:
+                    form_code, values = self._parse(request.message)
+                    form_model = self._get_form_model(form_code)
+                except MangroveException as e:
+                    responses[index] = Response(errors=e.message, exception=e)
+                    continue
+                submissions.append(SurveySubmission(form_model, values, request.transport, reporter=reporter,
+                                                    reporter_id=reporter_id, reporter_names=[]))
+                indices.append(index)
+        service = SurveyResponseService(self.dbm, logger, self.feeds_dbm, self.admin_id,
+                                        feed_writer=self.feed_writer, stage_timer=timer)
+        saved = service.save_surveys(submissions, additional_feed_dictionary) if submissions else []
+        for index, response in zip(indices, saved):
+            responses[index] = response
+        return responses
+
+    def _get_form_model(self, form_code):
+        # like save_survey, an unknown form code is answered by the active project
+        try:
+            return get_form_model_by_code(self.dbm, form_code)
+        except FormModelDoesNotExistsException:
+            return get_active_form_model(self.dbm, form_code)
+
     def _parse(self, message):
         return WebParser().parse(message)
 
     def edit_survey_response(self, request, survey_response, owner_id, additional_feed_dictionary=None, logger=None):
         assert request is not None
-        form_code, values = self._parse(request.message)
-        service = SurveyResponseService(self.dbm, logger, feeds_dbm=self.feeds_dbm, admin_id=self.admin_id)
+        timer = stage_timer(self.dbm)
+        with timer.stage('parse'):
+            form_code, values = self._parse(request.message)
+        service = SurveyResponseService(self.dbm, logger, feeds_dbm=self.feeds_dbm, admin_id=self.admin_id,
+                                        feed_writer=self.feed_writer, stage_timer=timer)
         return service.edit_survey(form_code, values, [], survey_response,
                                    additional_feed_dictionary, owner_id)
 
     def delete_survey_response(self, survey_response, additional_details, logger=None):
         assert survey_response is not None
-        service = SurveyResponseService(self.dbm, logger, self.feeds_dbm)
+        service = SurveyResponseService(self.dbm, logger, self.feeds_dbm, feed_writer=self.feed_writer)
         return service.delete_survey(survey_response, additional_details)
 
 
 class SMSPlayerV2(object):
-    def __init__(self, dbm, post_sms_parser_processors, feeds_dbm=None):
+    def __init__(self, dbm, post_sms_parser_processors, feeds_dbm=None, feed_writer=None):
         self.post_sms_parser_processor = post_sms_parser_processors if post_sms_parser_processors else []
         self.dbm = dbm
         self.feeds_dbm = feeds_dbm
+        self.feed_writer = feed_writer
 
     def _post_parse_processor(self, form_code, values, extra_elements=None):
         extra_elements = [] if extra_elements is None else extra_elements
@@ -69,8 +117,12 @@ class SMSPlayerV2(object):
         return reporter_entity_names
 
     def add_survey_response(self, request, logger=None, additional_feed_dictionary=None,
-                            translation_processor=None):
-        form_code, values, extra_elements = self._parse(request.message)
+                            translation_processor=None, parsed_message=None):
+        timer = stage_timer(self.dbm)
+        if parsed_message is None:
+            with timer.stage('parse'):
+                parsed_message = self._parse(request.message)
+        form_code, values, extra_elements = parsed_message
         post_sms_processor_response = self._post_parse_processor(form_code, values, extra_elements)
 
         if post_sms_processor_response is not None and not post_sms_processor_response.success:
@@ -81,51 +133,112 @@ class SMSPlayerV2(object):
             return post_sms_processor_response
 
         try:
-            reporter_entity = reporters.find_reporter_entity(self.dbm, request.transport.source)
+            with timer.stage('data_sender'):
+                reporter_entity = reporters.find_reporter_entity(self.dbm, request.transport.source)
             reporter_entity_names = self._get_reporter_name(reporter_entity)
             reporter_short_code = reporter_entity.short_code
         except NumberNotRegisteredException:
             reporter_short_code = None
             reporter_entity_names = None
 
-        service = SurveyResponseService(self.dbm, logger, self.feeds_dbm, response=post_sms_processor_response)
+        service = SurveyResponseService(self.dbm, logger, self.feeds_dbm, response=post_sms_processor_response,
+                                        feed_writer=self.feed_writer, stage_timer=timer)
         return service.save_survey(form_code, values, reporter_entity_names, request.transport,
                                    reporter_short_code, additional_feed_dictionary=additional_feed_dictionary,
-                                   translation_processor=translation_processor)
+                                   translation_processor=translation_processor, form_model=parsed_message.form_model)
+
+    def accept_many(self, requests, logger=None, additional_feed_dictionary=None, translation_processor=None):
+        """
+        Saves a batch of SMS submissions. Data senders are looked up with one view query and the survey responses,
+        data records and feeds are written with bulk updates. Returns one Response per request, in order.
+        """
+        timer = stage_timer(self.dbm)
+        responses = [None] * len(requests)
+        accepted = []
+        with timer.stage('parse'):
+            for index, request in enumerate(requests):
+                try:
+                    parsed_message = self._parse(request.message)
+                except MangroveException as e:
+                    responses[index] = Response(errors=e.message, exception=e)
+                    continue
+                form_code, values, extra_elements = parsed_message
+                post_sms_processor_response = self._post_parse_processor(form_code, values, extra_elements)
+                if post_sms_processor_response is not None and not post_sms_processor_response.success:
+                    responses[index] = post_sms_processor_response
+                    continue
+                accepted.append((index, request, parsed_message, post_sms_processor_response))
+
+        with timer.stage('data_sender'):
+            reporters_by_number = reporters.find_reporter_entities_by_numbers(
+                self.dbm, [request.transport.source for index, request, parsed_message, response in accepted])
+        submissions = []
+        indices = []
+        for index, request, parsed_message, post_sms_processor_response in accepted:
+            reporter_entities = reporters_by_number.get(request.transport.source.strip("+"), [])
+            if len(reporter_entities) > 1:
+                exception = MultipleReportersForANumberException(request.transport.source)
+                responses[index] = Response(errors=exception.message, exception=exception)
+                continue
+            reporter_entity = reporter_entities[0] if reporter_entities else None
+            reporter_entity_names = self._get_reporter_name(reporter_entity) if reporter_entity else None
+            submissions.append(SurveySubmission(parsed_message.form_model, parsed_message.values, request.transport,
+                                                reporter=reporter_entity, reporter_names=reporter_entity_names,
+                                                response=post_sms_processor_response))
+            indices.append(index)
+
+        service = SurveyResponseService(self.dbm, logger, self.feeds_dbm, feed_writer=self.feed_writer,
+                                        stage_timer=timer)
+        saved = service.save_surveys(submissions, additional_feed_dictionary=additional_feed_dictionary,
+                                     translation_processor=translation_processor) if submissions else []
+        for index, response in zip(indices, saved):
+            responses[index] = response
+        return responses
 
     def _parse(self, message):
-        return SMSParserFactory().getSMSParser(message, self.dbm).parse(message)
+        return SMSParserFactory().getSMSParser(message, self.dbm).parse_message(message)
 
 
 class XFormPlayerV2(object):
-    def __init__(self, dbm, feeds_dbm=None):
+    def __init__(self, dbm, feeds_dbm=None, feed_writer=None):
         self.dbm = dbm
         self.feeds_dbm = feeds_dbm
+        self.feed_writer = feed_writer
 
     def _parse(self, message):
         return XFormParser(self.dbm).parse(message)
 
     def add_survey_response(self, request, reporter_id, logger=None):
         assert request is not None
-        form_code, values = self._parse(request.message)
+        timer = stage_timer(self.dbm)
+        with timer.stage('parse'):
+            form_code, values = self._parse(request.message)
         media_submission_service = MediaSubmissionService(self.dbm, request.media, form_code)
-        media_files = media_submission_service.create_media_documents(values)
-        service = SurveyResponseService(self.dbm, logger, self.feeds_dbm)
+        with timer.stage('media'):
+            media_files = media_submission_service.create_media_documents(values)
+        service = SurveyResponseService(self.dbm, logger, self.feeds_dbm, feed_writer=self.feed_writer,
+                                        stage_timer=timer)
         response = service.save_survey(form_code, values, [], request.transport, reporter_id)
-        thumbnails = self._add_new_attachments(media_files, response.survey_response_id)
-        media_submission_service.create_preview_documents(thumbnails)
+        with timer.stage('attachments'):
+            thumbnails = self._add_new_attachments(media_files, response.survey_response_id)
+            media_submission_service.create_preview_documents(thumbnails)
         return response
 
     def update_survey_response(self, request, logger=None, survey_response=None, additional_feed_dictionary=None):
         assert request is not None
-        form_code, values = self._parse(request.message)
+        timer = stage_timer(self.dbm)
+        with timer.stage('parse'):
+            form_code, values = self._parse(request.message)
         media_submission_service = MediaSubmissionService(self.dbm, request.media, form_code, is_update=True)
-        media_files = media_submission_service.create_media_documents(values)
-        service = SurveyResponseService(self.dbm, logger, self.feeds_dbm)
+        with timer.stage('media'):
+            media_files = media_submission_service.create_media_documents(values)
+        service = SurveyResponseService(self.dbm, logger, self.feeds_dbm, feed_writer=self.feed_writer,
+                                        stage_timer=timer)
         response = service.edit_survey(form_code, values, [], survey_response, additional_feed_dictionary)
-        self._delete_removed_attachments(request, survey_response.id, media_submission_service)
-        thumbnails = self._add_new_attachments(media_files, survey_response.id)
-        media_submission_service.create_preview_documents(thumbnails)
+        with timer.stage('attachments'):
+            self._delete_removed_attachments(request, survey_response.id, media_submission_service)
+            thumbnails = self._add_new_attachments(media_files, survey_response.id)
+            media_submission_service.create_preview_documents(thumbnails)
         return response
 
     def _add_new_attachments(self, media_files, survey_response_id):
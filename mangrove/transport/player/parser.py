@@ -9,12 +9,12 @@ import xlrd
 import xmltodict
 
 from mangrove.errors.MangroveException import MultipleSubmissionsForSameCodeException, SMSParserInvalidFormatException, \
-    CSVParserInvalidHeaderFormatException, XlsParserInvalidHeaderFormatException, FormModelDoesNotExistsException
+    CSVParserInvalidHeaderFormatException, XlsParserInvalidHeaderFormatException
 from mangrove.form_model.field import GeoCodeField, DateField, IntegerField, FieldSet, PhotoField, VideoField, AudioField, \
     TimeField, DateTimeField, MediaField
 from mangrove.form_model.form_model import get_form_model_by_code
 # from mangrove.transport.player.player import SMSPlayer
-from mangrove.form_model.project import get_active_form_model, check_if_form_code_is_poll
+from mangrove.form_model.project import resolve_questionnaire
 from mangrove.utils.types import is_empty, is_string
 from mangrove.contrib.registration import REGISTRATION_FORM_CODE
 from openpyxl import load_workbook
@@ -23,6 +23,21 @@ from mangrove.errors.MangroveException import CodeSheetMissingException
 
 
 
+class ParsedMessage(object):
+    """
+    Result of parsing an SMS once: the form code, answers, extra elements and the form model it resolved to.
+    """
+
+    def __init__(self, form_code, values, extra_elements, form_model=None):
+        self.form_code = form_code
+        self.values = values
+        self.extra_elements = extra_elements
+        self.form_model = form_model
+
+    def __iter__(self):
+        return iter((self.form_code, self.values, self.extra_elements))
+
+
 class SMSParserFactory(object):
     MESSAGE_PREFIX = ur'^(\w+)\s+\.(\w+)\s+(\w+)'
 
@@ -36,6 +51,7 @@ class SMSParserFactory(object):
 class SMSParser(object):
     def __init__(self, dbm):
         self.dbm = dbm
+        self._resolved_questionnaire = None
 
     def _to_unicode(self, message):
         if type(message) is not unicode:
@@ -57,28 +73,29 @@ class SMSParser(object):
 
     def get_form_code_and_tokens(self, token):
         form_code = token[0].lower()
-        try:
-            form_model = get_form_model_by_code(self.dbm, form_code)
-            check_if_form_code_is_poll(self, form_model)
+        if self.resolve_questionnaire(form_code).by_code:
             token.remove(token[0])
-        except FormModelDoesNotExistsException:
-            form_model = get_active_form_model(self.dbm, form_code)
+        else:
             token = [" ".join(token)]
         return form_code, token
 
     def parse(self, message):
         pass
 
+    def parse_message(self, message):
+        form_code, values, extra_elements = self.parse(message)
+        return ParsedMessage(form_code, values, extra_elements, self.select_form_model(form_code))
+
     def form_code(self, message):
         pass
 
+    def resolve_questionnaire(self, form_code):
+        if self._resolved_questionnaire is None or self._resolved_questionnaire.form_code != form_code:
+            self._resolved_questionnaire = resolve_questionnaire(self.dbm, form_code)
+        return self._resolved_questionnaire
+
     def select_form_model(self, form_code):
-        try:
-            form_model = get_form_model_by_code(self.dbm, form_code)
-            check_if_form_code_is_poll(self, form_model)
-        except FormModelDoesNotExistsException:
-            form_model = get_active_form_model(self.dbm, form_code)
-        return form_model
+        return self.resolve_questionnaire(form_code).form_model
 
     def get_question_codes(self, form_code):
         form_model = self.select_form_model(form_code)
@@ -129,6 +146,7 @@ class KeyBasedSMSParser(SMSParser):
 
     def parse(self, message):
         assert is_string(message)
+        self._resolved_questionnaire = None
         try:
             form_code, tokens = self.form_code(message)
             submission, extra_data = self._parse_tokens(tokens, form_code)
@@ -150,7 +168,7 @@ class OrderSMSParser(SMSParser):
     MESSAGE_PREFIX_FOR_ORDERED_SMS = ur'[^ ]+\s+[^ ]+'
 
     def __init__(self, dbm):
-        self.dbm = dbm
+        super(OrderSMSParser, self).__init__(dbm)
 
     def _parse_ordered_tokens(self, tokens, question_codes, form_code):
         submission = OrderedDict()
@@ -167,6 +185,7 @@ class OrderSMSParser(SMSParser):
 
     def parse(self, message):
         assert is_string(message)
+        self._resolved_questionnaire = None
         try:
             form_code, tokens = self.form_code(message)
             question_codes, form_model = self.get_question_codes(form_code)
@@ -237,14 +256,18 @@ class CsvParser(object):
 
     def parse(self, csv_data):
         assert is_string(csv_data)
-        csv_data = self._clean(csv_data)
-        dict_reader = csv.DictReader(self._to_list(csv_data), restkey=self.EXTRA_VALUES)
+        return list(self.iter_parse(StringIO.StringIO(csv_data)))
+
+    def iter_parse(self, csv_file):
+        """
+        Yields (form_code, values) for every row of a file-like object, reading one line at a time.
+        """
+        assert csv_file is not None
+        dict_reader = csv.DictReader(self._lines(csv_file), restkey=self.EXTRA_VALUES)
         dict_reader.fieldnames = self._parse_header(dict_reader)
-        parsedData = []
         form_code_fieldname = dict_reader.fieldnames[0]
         for row in dict_reader:
-            parsedData.append(self._parse_row(form_code_fieldname, row))
-        return parsedData
+            yield self._parse_row(form_code_fieldname, row)
 
     def _has_empty_values(self, values_list):
         for value in values_list:
@@ -263,11 +286,25 @@ class CsvParser(object):
         if result_row.get(self.EXTRA_VALUES):
             result_row.pop(self.EXTRA_VALUES)
 
-    def _clean(self, csv_data):
-        return csv_data.strip()
-
-    def _to_list(self, csv_data):
-        return csv_data.splitlines()
+    def _lines(self, csv_file):
+        # Same lines as csv_data.strip().splitlines(), without holding the whole payload
+        blank_lines = []
+        previous_line = None
+        for chunk in csv_file:
+            for line in chunk.splitlines():
+                if is_empty(line.strip()):
+                    blank_lines.append(line)
+                    continue
+                if previous_line is None:
+                    line = line.lstrip()
+                else:
+                    yield previous_line
+                    for blank_line in blank_lines:
+                        yield blank_line
+                blank_lines = []
+                previous_line = line
+        if previous_line is not None:
+            yield previous_line.rstrip()
 
 
 
@@ -275,37 +312,48 @@ class CsvParser(object):
 class XlsParser(object):
     def parse(self, xls_contents):
         assert xls_contents is not None
-        workbook = xlrd.open_workbook(file_contents=xls_contents)
-        all_sheets = workbook.sheets()
-        worksheet = self._get_worksheet(all_sheets)
-        header_found = False
-        header = None
-        parsed_data = []
-        for row_num in range(worksheet.nrows):
-            row = worksheet.row_values(row_num)
+        return list(self.iter_parse(StringIO.StringIO(xls_contents)))
 
-            if not header_found:
-                header, header_found = self._is_header_row(row)
-                continue
-            if self._is_empty(row):
-                continue
-
-            row = self._clean(row)
-            row_dict = dict(zip(header, row))
-            form_code, values = (row_dict.pop(header[0]).lower(), row_dict)
-            parsed_data.append((form_code, values))
-        if not header_found:
-            raise XlsParserInvalidHeaderFormatException()
-        return parsed_data
+    def iter_parse(self, xls_file):
+        """
+        Yields (form_code, values) for every row of a file-like object. Only the data sheet is loaded.
+        """
+        workbook = self._open_workbook(xls_file)
+        try:
+            worksheet = self._get_worksheet(workbook)
+            header_found = False
+            header = None
+            for row_num in range(worksheet.nrows):
+                row = worksheet.row_values(row_num)
 
-    def _get_worksheet(self, all_sheets):
-        work_sheet = all_sheets[0]
-        return all_sheets[1] if work_sheet.name == 'codes' else work_sheet
+                if not header_found:
+                    header, header_found = self._is_header_row(row)
+                    continue
+                if self._is_empty(row):
+                    continue
 
-    def _get_code_sheet(self, all_sheets):
-        code_sheets = [work_sheet for work_sheet in all_sheets if work_sheet.name == 'codes' and len(work_sheet._cell_values)]
-        if len(code_sheets):
-            return code_sheets[0]
+                row = self._clean(row)
+                row_dict = dict(zip(header, row))
+                yield row_dict.pop(header[0]).lower(), row_dict
+            if not header_found:
+                raise XlsParserInvalidHeaderFormatException()
+        finally:
+            workbook.release_resources()
+
+    def _open_workbook(self, xls_file):
+        assert xls_file is not None
+        return xlrd.open_workbook(file_contents=xls_file.read(), on_demand=True)
+
+    def _get_worksheet(self, workbook):
+        sheet_names = workbook.sheet_names()
+        return workbook.sheet_by_index(1 if sheet_names[0] == 'codes' else 0)
+
+    def _get_code_sheet(self, workbook):
+        for index, sheet_name in enumerate(workbook.sheet_names()):
+            if sheet_name == 'codes':
+                work_sheet = workbook.sheet_by_index(index)
+                if len(work_sheet._cell_values):
+                    return work_sheet
         raise CodeSheetMissingException()
 
     def _remove_trailing_empty_header_field(self, field_header):
@@ -330,19 +378,20 @@ class XlsParser(object):
 
 class XlsxParser(XlsParser):
 
-    def parse(self, file_contents):
-        assert file_contents is not None
-        xlsx_file = StringIO.StringIO(file_contents)
-
-        workbook = load_workbook(xlsx_file, use_iterators = True)
+    def iter_parse(self, xlsx_file):
+        """
+        Yields the cleaned cell values of every row, iterating the sheet in openpyxl read-only mode.
+        """
+        workbook = self._open_workbook(xlsx_file)
         worksheet = self._get_worksheet(workbook.worksheets)
-        parsedData = []
         for row in worksheet.iter_rows():
             row_values = [self._get_value(x.value) for x in row]
-            row_values = self._clean(row_values)
-            parsedData.append(row_values)
-        return parsedData
-    
+            yield self._clean(row_values)
+
+    def _open_workbook(self, xlsx_file):
+        assert xlsx_file is not None
+        return load_workbook(xlsx_file, read_only=True)
+
     def _get_value(self, value):
         if value is not None:
             return unicode(value)
@@ -358,30 +407,26 @@ class XlsxParser(XlsParser):
         raise CodeSheetMissingException()
 
 class XlsOrderedParser(XlsParser):
-    def parse(self, xls_contents):
-        assert xls_contents is not None
-        workbook = xlrd.open_workbook(file_contents=xls_contents)
-        all_sheets = workbook.sheets()
-        if len(all_sheets) == 1:
-            raise CodeSheetMissingException()
-        elif len(all_sheets)>1:
-            codes_sheet = self._get_code_sheet(all_sheets)
-            worksheet = self._get_worksheet(all_sheets)
+    def iter_parse(self, xls_file):
+        workbook = self._open_workbook(xls_file)
+        try:
+            if workbook.nsheets == 1:
+                raise CodeSheetMissingException()
+            codes_sheet = self._get_code_sheet(workbook)
+            worksheet = self._get_worksheet(workbook)
             row = codes_sheet.row_values(0)
             header, header_found = self._is_header_row(row)
             form_code = header[0]
             header = header[1:]
-            parsed_data = []
             for row_num in range(1, worksheet.nrows):
                 row = worksheet.row_values(row_num)
                 row = self._clean(row)
-                values = OrderedDict(zip(header, row))
-                parsed_data.append((form_code, values))
+                yield form_code, OrderedDict(zip(header, row))
             if not header_found:
                 raise XlsParserInvalidHeaderFormatException()
-            return parsed_data
+        finally:
+            workbook.release_resources()
 
-            
 
 class XFormParser(object):
     def __init__(self, dbm):
@@ -473,56 +518,50 @@ class XFormParser(object):
         return datetime.strptime(date_time_without_milliseconds, '%Y-%m-%dT%H:%M:%S').strftime('%d.%m.%Y %H:%M:%S')
 
 class XlsDatasenderParser(XlsParser):
-    def parse(self, xls_contents):
-        assert xls_contents is not None
-        workbook = xlrd.open_workbook(file_contents=xls_contents)
-        worksheet = self._get_worksheet(workbook.sheets())
-        codes_sheet = self._get_code_sheet(workbook.sheets())
-        parsed_data = []
-        row = codes_sheet.row_values(0)
-        header, header_found = self._is_header_row(row)
+    def iter_parse(self, xls_file):
+        workbook = self._open_workbook(xls_file)
+        try:
+            worksheet = self._get_worksheet(workbook)
+            codes_sheet = self._get_code_sheet(workbook)
+            row = codes_sheet.row_values(0)
+            header, header_found = self._is_header_row(row)
 
-        if row[0] != 'reg':
-            raise Exception("Invalid datasender excel imported")
+            if row[0] != 'reg':
+                raise Exception("Invalid datasender excel imported")
 
-        form_code = REGISTRATION_FORM_CODE
-        header = header[1:]
-        for row_num in range(1, worksheet.nrows):
-            row = worksheet.row_values(row_num)
-            row = self._clean(row)
-            values = dict(zip(header, row))
-            values.update({"t": "reporter"})
-            parsed_data.append((form_code, values))
-        if not header_found:
-            raise XlsParserInvalidHeaderFormatException()
-        return parsed_data
+            form_code = REGISTRATION_FORM_CODE
+            header = header[1:]
+            for row_num in range(1, worksheet.nrows):
+                row = worksheet.row_values(row_num)
+                row = self._clean(row)
+                values = dict(zip(header, row))
+                values.update({"t": "reporter"})
+                yield form_code, values
+            if not header_found:
+                raise XlsParserInvalidHeaderFormatException()
+        finally:
+            workbook.release_resources()
 
 class XlsxDataSenderParser(XlsxParser):
 
-    def parse(self, file_contents):
-        assert file_contents is not None
-        xlsx_file = StringIO.StringIO(file_contents)
-
-        workbook = load_workbook(xlsx_file, use_iterators = True)
+    def iter_parse(self, xlsx_file):
+        workbook = self._open_workbook(xlsx_file)
         all_sheets = workbook.worksheets
         if len(all_sheets) == 1:
             raise CodeSheetMissingException()
-        elif len(all_sheets)>1:
-            codes_sheet = self._get_code_sheet(all_sheets)
-            worksheet = self._get_worksheet(workbook.worksheets)
-            rows = []
-            for cs in codes_sheet.iter_rows():
-                rows = [self._get_value(x.value) for x in cs]
-            header, header_found = self._is_header_row(rows)
-            parsed_data = []
-            form_code = REGISTRATION_FORM_CODE
-            header = header[1:]
-            for row in worksheet.iter_rows(row_offset=1):
-                row_values = [self._get_value(x.value) for x in row]
-                values = dict(zip(header, row_values))
-                values.update({"t": "reporter"})
-                parsed_data.append((form_code, values))
-            if not header_found:
-                raise XlsParserInvalidHeaderFormatException()
-            return parsed_data
+        codes_sheet = self._get_code_sheet(all_sheets)
+        worksheet = self._get_worksheet(all_sheets)
+        rows = []
+        for cs in codes_sheet.iter_rows():
+            rows = [self._get_value(x.value) for x in cs]
+        header, header_found = self._is_header_row(rows)
+        form_code = REGISTRATION_FORM_CODE
+        header = header[1:]
+        for row in worksheet.iter_rows(min_row=2):
+            row_values = [self._get_value(x.value) for x in row]
+            values = dict(zip(header, row_values))
+            values.update({"t": "reporter"})
+            yield form_code, values
+        if not header_found:
+            raise XlsParserInvalidHeaderFormatException()
 
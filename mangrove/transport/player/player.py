@@ -5,9 +5,9 @@ import inspect
 
 from mangrove.contrib.deletion import ENTITY_DELETION_FORM_CODE
 from mangrove.form_model.form_model import get_form_model_by_code
-from mangrove.errors.MangroveException import MangroveException, FormModelDoesNotExistsException
+from mangrove.errors.MangroveException import MangroveException
 from mangrove.form_model.form_model import NAME_FIELD
-from mangrove.form_model.project import get_active_form_model, check_if_form_code_is_poll
+from mangrove.form_model.project import resolve_questionnaire
 from mangrove.transport.repository import reporters
 from mangrove.transport.player.new_players import SMSPlayerV2
 from mangrove.transport.player.parser import WebParser, SMSParserFactory
@@ -42,8 +42,7 @@ class SMSPlayer(Player):
         self.post_sms_parser_processor = post_sms_parser_processors
         self.feeds_dbm = feeds_dbm
 
-    def _process(self, values, form_code, reporter_entity):
-        form_model = get_form_model_by_code(self.dbm, form_code)
+    def _process(self, values, form_model):
         if form_model.is_entity_registration_form():
             values = RegistrationWorkFlow(self.dbm, form_model, self.location_tree).process(values)
         return form_model, values
@@ -60,35 +59,33 @@ class SMSPlayer(Player):
     def _parse(self, message):
         if self.parser is None:
             self.parser = SMSParserFactory().getSMSParser(message, self.dbm)
-        return self.parser.parse(message)
+        return self.parser.parse_message(message)
 
     def select_form_model(self, form_code):
-        try:
-            form_model = get_form_model_by_code(self.dbm, form_code)
-            check_if_form_code_is_poll(self, form_model)
-        except FormModelDoesNotExistsException:
-            form_model = get_active_form_model(self.dbm, form_code)
-        return form_model
+        return resolve_questionnaire(self.dbm, form_code).form_model
 
     def get_form_model(self, request):
-        form_code, values, extra_elements = self._parse(request.message)
-        return self.select_form_model(form_code)
+        return self._parse(request.message).form_model
 
     def accept(self, request, logger=None, additional_feed_dictionary=None,
                translation_processor=None):
         ''' This is a single point of entry for all SMS based workflows, we do not have  a separation on the view layer for different sms
-        workflows, hence we will be branching to different methods here. Current implementation does the parse twice but that will go away
-        once the entity registration is separated '''
-        form_model = self.get_form_model(request)
+        workflows, hence we will be branching to different methods here. The message is parsed once and the parsed message,
+        which carries the resolved form model, is handed to the chosen workflow. '''
+        parsed_message = self._parse(request.message)
+        form_model = parsed_message.form_model
         if form_model.is_entity_registration_form() or form_model.form_code == ENTITY_DELETION_FORM_CODE:
-            return self.entity_api(request, logger)
+            return self.entity_api(request, logger, parsed_message)
         sms_player_v2 = SMSPlayerV2(self.dbm, post_sms_parser_processors=self.post_sms_parser_processor,
             feeds_dbm=self.feeds_dbm)
         return sms_player_v2.add_survey_response(request, logger, additional_feed_dictionary,
-                                                 translation_processor=translation_processor)
+                                                 translation_processor=translation_processor,
+                                                 parsed_message=parsed_message)
 
-    def entity_api(self, request, logger):
-        form_code, values, extra_elements = self._parse(request.message)
+    def entity_api(self, request, logger, parsed_message=None):
+        if parsed_message is None:
+            parsed_message = self._parse(request.message)
+        form_code, values, extra_elements = parsed_message
         post_sms_processor_response = self._process_post_parse_callback(form_code, values, extra_elements)
 
         log_entry = "message:message " + repr(request.message) + "|source: " + request.transport.source + "|"
@@ -101,7 +98,7 @@ class SMSPlayer(Player):
             return post_sms_processor_response
 
         reporter_entity = reporters.find_reporter_entity(self.dbm, request.transport.source)
-        form_model, values = self._process(values, form_code, reporter_entity)
+        form_model, values = self._process(values, parsed_message.form_model)
         reporter_entity_names = [{NAME_FIELD: reporter_entity.value(NAME_FIELD)}]
         response = self.submit(form_model, values, reporter_entity_names)
         if logger is not None:
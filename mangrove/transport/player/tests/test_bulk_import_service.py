@@ -0,0 +1,91 @@
+from unittest import TestCase
+from mock import Mock, patch
+from mangrove.datastore.short_code_counter import reset_short_code_allocators
+from mangrove.datastore.database import DatabaseManager
+from mangrove.errors.MangroveException import FormModelDoesNotExistsException, MangroveException
+from mangrove.form_model.field import ShortCodeField, TextField
+from mangrove.form_model.form_model import EntityFormModel
+from mangrove.transport.services.bulk_import_service import BulkImportService
+
+
+class TestBulkImportService(TestCase):
+    def setUp(self):
+        self.dbm = Mock(spec=DatabaseManager)
+        self.dbm.url = 'http://localhost:5984/'
+        self.dbm.database_name = 'test_bulk_import'
+        self.dbm._load_document.return_value = None
+        self.dbm._save_documents.side_effect = lambda documents, **kwargs: [(True, d.id, 'rev') for d in documents]
+        self.form_model = EntityFormModel(self.dbm, 'clinic', 'label', 'cli',
+                                          fields=[ShortCodeField('short_code', 'eid', 'Clinic ID'),
+                                                  TextField('name', 'n', 'Name')],
+                                          entity_type=['clinic'])
+
+        def get_form_model(dbm, form_code):
+            if form_code != 'cli':
+                raise FormModelDoesNotExistsException(form_code)
+            return self.form_model
+
+        self.patchers = [patch('mangrove.transport.services.bulk_import_service.get_form_model_by_code',
+                               side_effect=get_form_model),
+                         patch('mangrove.transport.services.bulk_import_service.entity_type_already_defined',
+                               return_value=True),
+                         patch('mangrove.transport.services.bulk_import_service.get_short_codes_in_use',
+                               return_value=set(['cli001'])),
+                         patch('mangrove.datastore.short_code_counter.get_entity_count_for_type', return_value=5),
+                         patch('mangrove.datastore.short_code_counter.get_short_codes_in_use', return_value=set())]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        reset_short_code_allocators()
+
+    def test_should_import_rows_in_one_bulk_save_with_a_response_per_row(self):
+        rows = [('cli', {'eid': 'cli001', 'n': 'existing'}),
+                ('cli', {'n': 'first'}),
+                ('xyz', {'n': 'unknown form'}),
+                ('cli', {'eid': 'cli100', 'n': 'second'})]
+
+        report = BulkImportService(self.dbm, parallelism=2).import_rows(iter(rows))
+
+        self.assertEqual(4, report.rows)
+        self.assertEqual(2, report.successful_rows)
+        responses = report.responses
+        self.assertFalse(responses[0].success)
+        self.assertIn('cli001', responses[0].errors)
+        self.assertTrue(responses[1].success)
+        self.assertEqual('cli6', responses[1].short_code)
+        self.assertFalse(responses[2].success)
+        self.assertTrue(responses[3].success)
+        self.assertEqual('cli100', responses[3].short_code)
+        self.assertEqual(2, self.dbm._save_documents.call_count)
+        self.assertEqual(4, len(self.dbm._save_documents.call_args[0][0]))
+
+    def test_should_import_rows_in_batches(self):
+        rows = [('cli', {'n': 'row %d' % index}) for index in range(5)]
+
+        report = BulkImportService(self.dbm, parallelism=1, batch_size=2).import_rows(rows)
+
+        self.assertEqual(5, report.successful_rows)
+        saves = [call[0][0] for call in self.dbm._save_documents.call_args_list]
+        self.assertEqual(1, len([documents for documents in saves if len(documents) == 1]))
+        self.assertEqual([4, 4, 2], [len(documents) for documents in saves if len(documents) > 1])
+        self.assertEqual(['cli6', 'cli7', 'cli8', 'cli9', 'cli10'],
+                         [response.short_code for response in report.responses])
+
+    def test_should_report_a_row_without_entity_type_on_that_row_only(self):
+        def short_code_entity_type(form_model, values):
+            if values['n'] == 'no type':
+                raise MangroveException('t should be present')
+            return 'clinic'
+        rows = [('cli', {'n': 'first'}), ('cli', {'n': 'no type'}), ('cli', {'eid': 'cli100', 'n': 'with code'}),
+                ('cli', {'n': 'second'})]
+
+        with patch('mangrove.transport.work_flow._short_code_entity_type', side_effect=short_code_entity_type):
+            report = BulkImportService(self.dbm, parallelism=1).import_rows(rows)
+
+        self.assertEqual([True, False, True, True], [response.success for response in report.responses])
+        self.assertEqual('t should be present', report.responses[1].errors)
+        self.assertEqual(['cli6', 'cli100', 'cli7'],
+                         [report.responses[index].short_code for index in (0, 2, 3)])
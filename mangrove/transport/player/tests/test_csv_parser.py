@@ -1,5 +1,6 @@
 
 from unittest import TestCase
+import StringIO
 from mangrove.errors.MangroveException import CSVParserInvalidHeaderFormatException
 from mangrove.transport.player.parser import CsvParser
 
@@ -27,6 +28,22 @@ class TestCsvParser(TestCase):
                      "meds": "%d" % (200 + offset,)
                 }, values)
 
+    def test_should_lazily_parse_csv_file(self):
+        csv_file = StringIO.StringIO("""
+
+        FORM_CODE,ID,BEDS
+        CLF1,CL001,11
+
+        CLF2,CL002,12
+
+        """)
+
+        rows = CsvParser().iter_parse(csv_file)
+
+        self.assertEqual(("clf1", {"id": "CL001", "beds": "11"}), next(rows))
+        self.assertEqual(("clf2", {"id": "CL002", "beds": "12"}), next(rows))
+        self.assertRaises(StopIteration, next, rows)
+
     def test_should_parse_csv_string_with_partial_values(self):
         csv_data = """FORM_CODE,ID,BEDS,DIRECTOR,MEDS
         CLF1, CL001, 11, Dr. A1,201
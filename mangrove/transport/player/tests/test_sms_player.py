@@ -9,13 +9,14 @@ from mangrove.datastore.entity import Entity, Contact
 from mangrove.errors.MangroveException import  NumberNotRegisteredException, SMSParserInvalidFormatException, MultipleSubmissionsForSameCodeException, \
     ProjectPollCodeDoesNotExistsException
 from mangrove.form_model.form_model import FormModel
-from mangrove.form_model.project import Project
+from mangrove.form_model.project import resolve_questionnaire
 from mangrove.transport.player.parser import  OrderSMSParser
 from mangrove.transport.contract.request import Request
 from mangrove.transport.contract.transport_info import TransportInfo
 from mangrove.transport.contract.response import Response
 from mangrove.transport.player.tests.test_web_player import mock_form_submission
 from mangrove.transport.player.new_players import SMSPlayerV2
+from mangrove.transport.player.player import SMSPlayer
 
 
 class TestSMSPlayer(TestCase):
@@ -55,7 +56,7 @@ class TestSMSPlayer(TestCase):
     def _mock_form_model(self):
         self.get_form_model_mock_player_patcher = patch(
             'mangrove.transport.services.survey_response_service.get_form_model_by_code')
-        self.get_form_model_mock_parser_patcher = patch('mangrove.transport.player.parser.get_form_model_by_code')
+        self.get_form_model_mock_parser_patcher = patch('mangrove.form_model.project.get_form_model_by_code')
         # self.get_form_model_mock_player_v2_patcher = patch('mangrove.transport.player.new_players.get_form_model_by_code')
         get_form_model_player_mock = self.get_form_model_mock_player_patcher.start()
         get_form_model_parser_mock = self.get_form_model_mock_parser_patcher.start()
@@ -67,6 +68,7 @@ class TestSMSPlayer(TestCase):
         field = UniqueIdField('clinic','q1', 'id', 'q1')
         self.form_model_mock.fields = [field]
         self.form_model_mock.is_open_survey = False
+        self.form_model_mock.is_poll = False
         self.form_model_mock.validate_submission.return_value = OrderedDict(), OrderedDict()
 
         self.form_submission_mock = mock_form_submission(self.form_model_mock)
@@ -112,6 +114,31 @@ class TestSMSPlayer(TestCase):
                     save_survey.assert_called_once('some_form_code', {'id': '1'}, [{'name': '1234'}], 'sms', message)
                     post_sms_processor_mock.process.assert_called_once_with('some_form_code', {'id': '1'}, [])
 
+    def test_should_accept_many_messages_with_one_reporter_lookup_and_one_save(self):
+        other_reporter = MagicMock(spec=Contact)
+        self.reporter_module.find_reporter_entities_by_numbers.return_value = {
+            '1234': [self.reporter_mock], '5555': [self.reporter_mock, other_reporter]}
+        requests = [Request(message='FORM_CODE 1', transportInfo=self.transport),
+                    Request(message='FORM_CODE 2', transportInfo=TransportInfo('sms', '+5555', '5678'))]
+        saved_response = Response(success=True)
+        with patch('mangrove.transport.player.new_players.SurveyResponseService.save_surveys') as save_surveys:
+            with patch('mangrove.form_model.project.get_project_by_code'):
+                with patch('mangrove.form_model.project.check_if_form_code_is_poll'):
+                    save_surveys.return_value = [saved_response]
+
+                    responses = self.sms_player.accept_many(requests)
+
+                    self.reporter_module.find_reporter_entities_by_numbers.assert_called_once_with(
+                        self.dbm, ['1234', '+5555'])
+                    self.assertEqual(1, save_surveys.call_count)
+                    submissions = save_surveys.call_args[0][0]
+                    self.assertEqual(1, len(submissions))
+                    self.assertEqual(self.reporter_mock, submissions[0].reporter)
+                    self.assertEqual(self.form_model_mock, submissions[0].form_model)
+                    self.assertEqual(saved_response, responses[0])
+                    self.assertFalse(responses[1].success)
+                    self.assertIn('+5555', responses[1].errors)
+
     def test_should_call_parser_post_processor_and_return_if_there_is_response_from_post_processor(self):
         parser_mock = Mock(spec=OrderSMSParser)
         parser_mock.parse.return_value = ('FORM_CODE', {'id': '1'}, [])
@@ -171,7 +198,7 @@ class TestSMSPlayer(TestCase):
                     self.sms_player.add_survey_response(request)
                     save_survey.assert_called_once_with('questionnaire_code', {'id': 'question1_answer'}, [{'name': '1234'}],
                                                         self.transport, "short_code", additional_feed_dictionary=None,
-                                                        translation_processor=None)
+                                                        translation_processor=None, form_model=self.form_model_mock)
 
     def test_should_save_survey_for_a_reporter_with_no_name(self):
         self.loc_tree.get_location_hierarchy.return_value = None
@@ -193,7 +220,7 @@ class TestSMSPlayer(TestCase):
 
                     instance_mock.save_survey.assert_called_with('questionnaire_code', {'id': 'question1_answer'}, None,
                         self.transport, "short_code", additional_feed_dictionary=None,
-                                       translation_processor=None)
+                                       translation_processor=None, form_model=self.form_model_mock)
 
 
     def test_should_raise_exception_for_poll_questionnaire(self):
@@ -203,16 +230,30 @@ class TestSMSPlayer(TestCase):
         contact = MagicMock(Contact)
         contact.value.return_value = None
         contact.short_code = "short_code"
-        project = MagicMock(spec=Project)
-        project.is_poll = True
+        self.form_model_mock.is_poll = True
         self.reporter_module.find_reporter_entity.return_value = contact
         with patch(
             'mangrove.transport.player.new_players.SurveyResponseService') as SurveyResponseServiceMock:
             with patch('mangrove.form_model.project.get_project_by_code') as get_project_by_code:
-                with patch('mangrove.form_model.project.check_if_form_code_is_poll') as mock_check_if_form_code_is_poll:
-                    instance_mock = Mock()
-                    SurveyResponseServiceMock.return_value = instance_mock
-                    get_project_by_code.return_value = project
-
-                    self.assertRaises(ProjectPollCodeDoesNotExistsException, self.sms_player.add_survey_response, request)
-
+                instance_mock = Mock()
+                SurveyResponseServiceMock.return_value = instance_mock
+
+                self.assertRaises(ProjectPollCodeDoesNotExistsException, self.sms_player.add_survey_response, request)
+                self.assertFalse(get_project_by_code.called)
+
+    def test_should_parse_message_and_resolve_form_model_once_for_survey_response(self):
+        self.form_model_mock.is_entity_registration_form.return_value = False
+        self.form_model_mock.form_code = 'questionnaire_code'
+        request = Request(transportInfo=self.transport, message="questionnaire_code question1_answer")
+        parser = OrderSMSParser(self.dbm)
+        parser.parse = Mock(wraps=parser.parse)
+        sms_player = SMSPlayer(self.dbm, parser=parser)
+        with patch('mangrove.transport.player.new_players.SurveyResponseService') as SurveyResponseServiceMock:
+            with patch('mangrove.transport.player.parser.resolve_questionnaire',
+                       wraps=resolve_questionnaire) as resolve:
+                sms_player.accept(request)
+
+                self.assertEqual(1, parser.parse.call_count)
+                self.assertEqual(1, resolve.call_count)
+                save_survey = SurveyResponseServiceMock.return_value.save_survey
+                self.assertEqual(self.form_model_mock, save_survey.call_args[1]['form_model'])
@@ -0,0 +1,67 @@
+from unittest import TestCase
+from mock import Mock, patch
+from mangrove.datastore.database import DatabaseManager
+from mangrove.datastore.metrics import InMemoryMetrics
+from mangrove.transport.contract.response import Response
+from mangrove.transport.services.stage_timer import StageTimer, NULL_STAGE_TIMER, stage_timer
+
+
+class TestStageTimer(TestCase):
+    def test_should_record_every_stage_in_the_metrics_sink(self):
+        metrics = InMemoryMetrics()
+        timer = StageTimer(metrics)
+
+        with timer.stage('parse'):
+            pass
+        with timer.stage('parse'):
+            pass
+
+        stats = metrics.snapshot()[('stage', 'parse')]
+        self.assertEqual(2, stats['calls'])
+        self.assertEqual(2, sum(count for bucket, count in stats['histogram']))
+
+    def test_should_attach_timings_of_sampled_request_to_response(self):
+        timer = StageTimer(InMemoryMetrics(), sampled=True)
+        response = Response()
+
+        with timer.stage('parse'):
+            pass
+        timer.attach(response)
+        with timer.stage('attachments'):
+            pass
+
+        self.assertEqual(['parse', 'attachments'], [stage for stage, seconds in response.stage_timings])
+
+    def test_should_not_attach_timings_of_request_not_sampled(self):
+        timer = StageTimer(InMemoryMetrics(), sampled=False)
+        response = Response()
+
+        with timer.stage('parse'):
+            pass
+        timer.attach(response)
+
+        self.assertIsNone(response.stage_timings)
+
+    def test_should_record_failed_stage_as_error(self):
+        metrics = InMemoryMetrics()
+        timer = StageTimer(metrics, sampled=True)
+
+        with self.assertRaises(ValueError):
+            with timer.stage('validate'):
+                raise ValueError()
+
+        self.assertEqual(1, metrics.snapshot()[('stage', 'validate')]['errors'])
+        self.assertEqual(['validate'], [stage for stage, seconds in timer.timings])
+
+    def test_should_not_time_stages_unless_stage_timing_is_on(self):
+        dbm = Mock(spec=DatabaseManager)
+        with patch('mangrove.transport.services.stage_timer.settings') as settings:
+            settings.STAGE_TIMING = False
+            self.assertIs(NULL_STAGE_TIMER, stage_timer(dbm))
+
+            settings.STAGE_TIMING = True
+            settings.STAGE_TIMING_SAMPLE_RATE = 1.0
+            dbm.metrics = InMemoryMetrics()
+            timer = stage_timer(dbm)
+        self.assertIs(dbm.metrics, timer.metrics)
+        self.assertTrue(timer.sampled)
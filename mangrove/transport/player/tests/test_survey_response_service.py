@@ -3,12 +3,14 @@ from unittest import TestCase
 from mock import Mock, patch, PropertyMock, MagicMock
 from mangrove.datastore.entity_type import define_type
 from mangrove.feeds.enriched_survey_response import EnrichedSurveyResponseBuilder
+from mangrove.feeds.feed_writer import FeedWriter
 from mangrove.form_model.project import Project
 from mangrove.form_model.validation import NumericRangeConstraint
 from mangrove.form_model.field import TextField, IntegerField, UniqueIdField
 from mangrove.datastore.documents import EntityDocument
 from mangrove.datastore.database import DatabaseManager
-from mangrove.datastore.entity import DataRecord, Entity, get_by_short_code_include_voided
+from mangrove.datastore.metrics import InMemoryMetrics
+from mangrove.datastore.entity import DataRecord, Entity, Contact, get_by_short_code_include_voided
 from mangrove.datastore.tests.test_data import TestData
 from mangrove.errors.MangroveException import MangroveException, FormModelDoesNotExistsException
 from mangrove.form_model.form_model import FormModel, MOBILE_NUMBER_FIELD, NAME_FIELD
@@ -16,7 +18,8 @@ from mangrove.transport.contract.request import Request
 from mangrove.transport.contract.transport_info import TransportInfo
 from mangrove.transport.player.tests.test_reporter import TestReporter
 from mangrove.transport.repository.reporters import REPORTER_ENTITY_TYPE
-from mangrove.transport.services.survey_response_service import SurveyResponseService
+from mangrove.transport.services.stage_timer import StageTimer
+from mangrove.transport.services.survey_response_service import SurveyResponseService, SurveySubmission
 from mangrove.utils.test_utils.mangrove_test_case import MangroveTestCase
 from mangrove.transport.repository.survey_responses import SurveyResponse
 
@@ -106,6 +109,74 @@ class TestSurveyResponseService(TestCase):
                                                                     additional_dictionary)
                                 self.assertEquals(1, feed_manager._save_document.call_count)
 
+    def test_survey_response_event_is_queued_on_the_feed_writer(self):
+        manager = Mock(spec=DatabaseManager)
+        feed_manager = Mock(spec=DatabaseManager)
+        feed_writer = Mock(spec=FeedWriter)
+        project = Mock(spec=Project)
+        survey_response_service = SurveyResponseService(manager, feeds_dbm=feed_manager, feed_writer=feed_writer)
+
+        values = {'ID': 'short_code', 'Q1': 'name', 'Q2': '80', 'Q3': 'a'}
+        transport_info = TransportInfo('web', 'src', 'dest')
+
+        additional_dictionary = {'project': {'name': 'someproject', 'status': 'active', 'id': 'someid'}}
+        with patch('mangrove.transport.services.survey_response_service.by_short_code') as get_reporter:
+            with patch(
+                    'mangrove.transport.services.survey_response_service.get_form_model_by_code') as get_form_model_by_code:
+                with patch("mangrove.form_model.form_submission.DataRecordDocument"):
+                    with patch('mangrove.transport.services.survey_response_service.Project.from_form_model') as from_form_model:
+                        get_reporter.return_value = Mock(spec=Entity)
+                        mock_form_model = MagicMock(spec=FormModel)
+                        mock_form_model._dbm = manager
+                        mock_form_model._doc = MagicMock()
+                        mock_form_model.validate_submission.return_value = OrderedDict(values), OrderedDict('')
+                        mock_form_model.unique_id_answers.return_value = []
+                        mock_form_model.is_entity_registration_form.return_value = False
+                        mock_form_model.entity_questions = []
+                        mock_form_model.entity_type = 'sometype'
+                        get_form_model_by_code.return_value = mock_form_model
+                        from_form_model.return_value = project
+                        project.data_senders = []
+                        response = survey_response_service.save_survey('CL1', values, [], transport_info, '',
+                                                                       additional_dictionary)
+
+                        survey_response = feed_writer.submit.call_args[0][0]
+                        self.assertEqual(response.survey_response_id, survey_response.uuid)
+                        feed_writer.submit.assert_called_once_with(survey_response, additional_dictionary, 'src')
+                        self.assertFalse(feed_manager._save_document.called)
+
+    def test_should_time_every_stage_of_a_sampled_submission(self):
+        manager = Mock(spec=DatabaseManager)
+        project = Mock(spec=Project)
+        metrics = InMemoryMetrics()
+        survey_response_service = SurveyResponseService(manager, feed_writer=Mock(spec=FeedWriter),
+                                                        stage_timer=StageTimer(metrics, sampled=True))
+        values = {'ID': 'short_code', 'Q1': 'name'}
+
+        with patch('mangrove.transport.services.survey_response_service.by_short_code') as get_reporter:
+            with patch(
+                    'mangrove.transport.services.survey_response_service.get_form_model_by_code') as get_form_model_by_code:
+                with patch("mangrove.form_model.form_submission.DataRecordDocument"):
+                    with patch('mangrove.transport.services.survey_response_service.Project.from_form_model') as from_form_model:
+                        get_reporter.return_value = Mock(spec=Entity)
+                        mock_form_model = MagicMock(spec=FormModel)
+                        mock_form_model._dbm = manager
+                        mock_form_model._doc = MagicMock()
+                        mock_form_model.validate_submission.return_value = OrderedDict(values), OrderedDict('')
+                        mock_form_model.unique_id_answers.return_value = []
+                        mock_form_model.is_entity_registration_form.return_value = False
+                        mock_form_model.entity_questions = []
+                        mock_form_model.entity_type = 'sometype'
+                        get_form_model_by_code.return_value = mock_form_model
+                        from_form_model.return_value = project
+                        project.data_senders = []
+                        response = survey_response_service.save_survey('CL1', values, [],
+                                                                       TransportInfo('web', 'src', 'dest'), '')
+
+        stages = ['form_model', 'validate', 'bind', 'reporter', 'data_record', 'survey_response', 'feed']
+        self.assertEqual(stages, [stage for stage, seconds in response.stage_timings])
+        self.assertEqual(sorted(('stage', stage) for stage in stages), sorted(metrics.snapshot()))
+
     def test_feeds_created_if_subject_not_found_for_a_submission(self):
         manager = Mock(spec=DatabaseManager)
         feed_manager = Mock(spec=DatabaseManager)
@@ -194,6 +265,74 @@ class TestSurveyResponseService(TestCase):
                                 self.assertFalse(response.errors)
                                 self.assertTrue(response.feed_error_message)
 
+    def test_should_save_many_surveys_with_one_bulk_update_per_database(self):
+        manager = Mock(spec=DatabaseManager)
+        feed_manager = Mock(spec=DatabaseManager)
+        manager._save_documents.side_effect = lambda documents, **kwargs: [(True, d.id, 'rev') for d in documents]
+        feed_manager._save_documents.side_effect = lambda documents, **kwargs: [(True, d.id, 'rev') for d in documents]
+        project = Mock(spec=Project)
+        project.data_senders = ['rep1']
+        survey_response_service = SurveyResponseService(manager, feeds_dbm=feed_manager)
+        reporter = Mock(spec=Contact)
+        reporter.id = 'reporter_id'
+        reporter.short_code = 'rep1'
+        transport_info = TransportInfo('sms', '1234', '5678')
+
+        def form_model():
+            mock_form_model = MagicMock(spec=FormModel)
+            mock_form_model._dbm = manager
+            mock_form_model._doc = MagicMock()
+            mock_form_model._data = {}
+            mock_form_model.validate_submission.return_value = OrderedDict({'Q1': 'name'}), OrderedDict()
+            mock_form_model.is_entity_registration_form.return_value = False
+            mock_form_model.entity_questions = []
+            mock_form_model.entity_type = 'sometype'
+            return mock_form_model
+
+        with patch('mangrove.transport.services.survey_response_service.by_short_code') as get_reporter:
+            with patch('mangrove.transport.services.survey_response_service.EnrichedSurveyResponseBuilder') as builder:
+                with patch('mangrove.transport.services.survey_response_service.Project.from_form_model') as from_form_model:
+                    from_form_model.return_value = project
+                    submissions = [SurveySubmission(form_model(), {'Q1': 'name'}, transport_info, reporter=reporter),
+                                   SurveySubmission(form_model(), {'Q1': 'other'}, transport_info, reporter=reporter)]
+
+                    responses = survey_response_service.save_surveys(submissions)
+
+                    self.assertFalse(get_reporter.called)
+                    self.assertEqual(1, manager._save_documents.call_count)
+                    self.assertEqual(4, len(manager._save_documents.call_args[0][0]))
+                    self.assertEqual(1, feed_manager._save_documents.call_count)
+                    self.assertEqual(2, len(feed_manager._save_documents.call_args[0][0]))
+                    self.assertEqual(2, len(responses))
+                    self.assertTrue(all(response.success for response in responses))
+                    self.assertNotEqual(responses[0].survey_response_id, responses[1].survey_response_id)
+
+
+    def test_should_fail_only_the_submission_which_cannot_be_prepared(self):
+        manager = Mock(spec=DatabaseManager)
+        manager._save_documents.side_effect = lambda documents, **kwargs: [(True, d.id, 'rev') for d in documents]
+        project = Mock(spec=Project)
+        project.data_senders = []
+        survey_response_service = SurveyResponseService(manager)
+        transport_info = TransportInfo('sms', '1234', '5678')
+        form_model = MagicMock(spec=FormModel)
+        form_model._doc = MagicMock()
+        form_model.validate_submission.return_value = OrderedDict({'Q1': 'name'}), OrderedDict()
+        form_model.is_entity_registration_form.return_value = False
+        form_model.entity_questions = []
+        broken_form_model = MagicMock(spec=FormModel)
+        broken_form_model.validate_submission.side_effect = MangroveException('broken questionnaire')
+
+        with patch('mangrove.transport.services.survey_response_service.Project.from_form_model',
+                   return_value=project):
+            responses = survey_response_service.save_surveys(
+                [SurveySubmission(broken_form_model, {'Q1': 'name'}, transport_info),
+                 SurveySubmission(form_model, {'Q1': 'name'}, transport_info)])
+
+        self.assertFalse(responses[0].success)
+        self.assertEqual('broken questionnaire', responses[0].errors)
+        self.assertTrue(responses[1].success)
+        self.assertEqual(2, len(manager._save_documents.call_args[0][0]))
 
 class TestSurveyResponseServiceIT(MangroveTestCase):
     def setUp(self):
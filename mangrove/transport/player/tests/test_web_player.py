@@ -2,12 +2,15 @@ from collections import OrderedDict
 from unittest.case import TestCase
 from mock import Mock, patch
 from mangrove.datastore.database import DatabaseManager
+from mangrove.errors.MangroveException import FormModelDoesNotExistsException
 from mangrove.form_model.form_model import FormModel, EntityFormModel
 from mangrove.form_model.form_submission import FormSubmissionFactory, FormSubmission
+from mangrove.transport.player.new_players import WebPlayerV2
 from mangrove.transport.player.player import WebPlayer
 from mangrove.utils.test_utils.dummy_location_tree import DummyLocationTree
 from mangrove.transport.contract.transport_info import TransportInfo
 from mangrove.transport.contract.request import Request
+from mangrove.transport.contract.response import Response
 
 def mock_form_submission(form_model_mock):
     form_submission_mock = Mock(spec=FormSubmission)
@@ -55,3 +58,39 @@ class TestWebPlayer(TestCase):
 def get_location_hierarchy(foo):
     return ["no_hierarchy"]
 
+
+
+class TestWebPlayerV2(TestCase):
+    def test_should_fail_only_the_requests_without_a_questionnaire(self):
+        dbm = Mock(spec=DatabaseManager)
+        form_model = Mock(spec=FormModel)
+        active_project = Mock(spec=FormModel)
+        transport = TransportInfo('web', 'rep1', 'destination')
+        requests = [Request(message={'form_code': 'cli001', 'q1': 'a'}, transportInfo=transport),
+                    Request(message={'form_code': 'unknown', 'q1': 'b'}, transportInfo=transport),
+                    Request(message={'form_code': 'poll', 'q1': 'c'}, transportInfo=transport)]
+        saved_responses = [Response(success=True), Response(success=True)]
+
+        def get_form_model(dbm, form_code):
+            if form_code != 'cli001':
+                raise FormModelDoesNotExistsException(form_code)
+            return form_model
+
+        def get_active_form_model(dbm, form_code):
+            if form_code == 'unknown':
+                raise FormModelDoesNotExistsException(form_code)
+            return active_project
+
+        with patch('mangrove.transport.player.new_players.get_form_model_by_code', side_effect=get_form_model), \
+                patch('mangrove.transport.player.new_players.get_active_form_model',
+                      side_effect=get_active_form_model), \
+                patch('mangrove.transport.player.new_players.SurveyResponseService.save_surveys',
+                      return_value=saved_responses) as save_surveys:
+            responses = WebPlayerV2(dbm).accept_many(requests, None)
+
+        submissions = save_surveys.call_args[0][0]
+        self.assertEqual([form_model, active_project], [submission.form_model for submission in submissions])
+        self.assertEqual(saved_responses[0], responses[0])
+        self.assertFalse(responses[1].success)
+        self.assertIsInstance(responses[1].exception, FormModelDoesNotExistsException)
+        self.assertEqual(saved_responses[1], responses[2])
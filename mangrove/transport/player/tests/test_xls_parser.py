@@ -71,6 +71,13 @@ class TestXlsParser(TestCase):
             self.assertEqual("clf1", form_code)
             self.assertEqual({u"id": u'CL004', u'beds': u'13', u'director': u'Dr. D', u'meds': u'204'}, values)
 
+    def test_should_lazily_parse_xls_file(self):
+        with open(self.file_name, 'rb') as input_file:
+            submissions = self.parser.iter_parse(input_file)
+            self.assertEqual((u"clf1", {u"id": u'CL001', u'beds': u'10', u'director': u'Dr. A', u'meds': u'201'}),
+                             next(submissions))
+            self.assertEqual(4, len(list(submissions)))
+
     def test_should_parse_xls_contents_less_field_values_than_header(self):
         data = """
                                                 FORM_CODE,ID,BEDS,DIRECTOR,MEDS
@@ -1,5 +1,5 @@
 from mangrove.datastore.entity import Contact
-from mangrove.datastore.queries import get_all_reporters
+from mangrove.datastore.queries import iter_all_reporters
 
 from mangrove.errors.MangroveException import NumberNotRegisteredException, MultipleReportersForANumberException
 from mangrove.transport.repository.survey_responses import get_survey_responses_for_activity_period
@@ -26,9 +26,24 @@ def find_reporters_by_from_number(dbm, from_number):
     return [Contact.new_from_doc(dbm=dbm, doc=Contact.__document_class__.wrap(row.get('doc'))) for row in rows]
 
 
+def find_reporter_entities_by_numbers(dbm, from_numbers):
+    """
+    Looks up the reporters for many numbers with one view query.
+    Returns a dict of number (without '+') to the list of reporters registered with it.
+    """
+    numbers = list(set([from_number.strip("+") for from_number in from_numbers]))
+    reporters_by_number = dict((number, []) for number in numbers)
+    if not numbers:
+        return reporters_by_number
+    rows = dbm.view.datasender_by_mobile_number(keys=numbers, include_docs=True)
+    for row in rows:
+        reporter = Contact.new_from_doc(dbm=dbm, doc=Contact.__document_class__.wrap(row.get('doc')))
+        reporters_by_number[row['key']].append(reporter)
+    return reporters_by_number
+
+
 def get_reporters_who_submitted_data_for_frequency_period(dbm, form_model_id, from_time=None, to_time=None):
     survey_responses = get_survey_responses_for_activity_period(dbm, form_model_id, from_time, to_time)
     source_owner_uids = set([survey_response.owner_uid for survey_response in survey_responses])
-    all_reporters = get_all_reporters(dbm)
-    reporters = [reporter for reporter in all_reporters if reporter.id in source_owner_uids]
+    reporters = [reporter for reporter in iter_all_reporters(dbm) if reporter.id in source_owner_uids]
     return reporters
@@ -8,6 +8,7 @@ UNDELETED_SURVEY_RESPONSE_VIEW_NAME = "undeleted_survey_response"
 # DELETED_SURVEY_RESPONSE_VIEW_NAME = "deleted_survey_response"
 
 def survey_response_count(dbm, form_model_id, from_time, to_time, view_name="surveyresponse"):
+    # the view reduces with _stats: count is the number of survey responses, sum the successful ones
     startkey, endkey = _get_start_and_end_key(form_model_id, from_time, to_time)
     rows = dbm.load_all_rows_in_view(view_name, descending=True, startkey=startkey, endkey=endkey)
     return len(rows) and rows[0]['value']['count']
@@ -15,17 +16,39 @@ def survey_response_count(dbm, form_model_id, from_time, to_time, view_name="sur
 
 def get_survey_responses(dbm, form_model_id, from_time, to_time, page_number=0, page_size=None,
                          view_name="surveyresponse"):
-    startkey, endkey = _get_start_and_end_key(form_model_id, from_time, to_time)
     if page_size is None:
-        rows = dbm.load_all_rows_in_view(view_name, reduce=False, descending=True,
-            startkey=startkey,
-            endkey=endkey)
-    else:
-        rows = dbm.load_all_rows_in_view(view_name, reduce=False, descending=True,
-            startkey=startkey,
-            endkey=endkey, skip=page_number * page_size, limit=page_size)
-    return [SurveyResponse.new_from_doc(dbm=dbm, doc=SurveyResponse.__document_class__.wrap(row['value'])) for row in
-            rows]
+        return list(iter_survey_responses(dbm, form_model_id, from_time, to_time, view_name))
+    startkey, endkey = _get_start_and_end_key(form_model_id, from_time, to_time)
+    rows = dbm.load_all_rows_in_view(view_name, reduce=False, descending=True, include_docs=True,
+        startkey=startkey,
+        endkey=endkey, skip=page_number * page_size, limit=page_size)
+    return [_survey_response_from_row(dbm, row) for row in rows]
+
+
+def get_survey_responses_page(dbm, form_model_id, from_time, to_time, page_size, page_token=None,
+                              view_name="surveyresponse", include_docs=True):
+    """
+    Returns a page of the survey responses of a questionnaire, newest first, and the token of the next page
+    (None on the last one). Unlike page_number paging, later pages cost no more than the first.
+    With include_docs=False only the view rows are read: their id, their [form_model_id, created] key and a
+    value of 1 for a successful survey response, 0 otherwise.
+    """
+    startkey, endkey = _get_start_and_end_key(form_model_id, from_time, to_time)
+    rows, next_page_token = dbm.load_view_page(view_name, page_size, page_token, reduce=False, descending=True,
+                                               include_docs=include_docs, startkey=startkey, endkey=endkey)
+    if not include_docs:
+        return rows, next_page_token
+    return [_survey_response_from_row(dbm, row) for row in rows], next_page_token
+
+
+def iter_survey_responses(dbm, form_model_id, from_time, to_time, view_name="surveyresponse"):
+    """
+    Yields the survey responses of a questionnaire, newest first, one page of the view at a time.
+    """
+    startkey, endkey = _get_start_and_end_key(form_model_id, from_time, to_time)
+    for row in dbm.iter_view(view_name, reduce=False, descending=True, include_docs=True, startkey=startkey,
+                             endkey=endkey):
+        yield _survey_response_from_row(dbm, row)
 
 
 def get_survey_response_by_id(dbm, survey_response_id):
@@ -60,6 +83,10 @@ def get_survey_responses_for_activity_period(dbm, form_model_id, from_time, to_t
             row in
             rows]
 
+def _survey_response_from_row(dbm, row):
+    return SurveyResponse.new_from_doc(dbm=dbm, doc=SurveyResponse.__document_class__.wrap(row['doc']))
+
+
 def _get_start_and_end_key(form_model_id, from_time, to_time):
     end = [form_model_id] if from_time is None else [form_model_id, from_time]
     start = [form_model_id, {}] if to_time is None else [form_model_id, to_time]
@@ -0,0 +1,203 @@
+import logging
+import time
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+
+from mangrove.datastore.entity import get_short_codes_in_use
+from mangrove.datastore.entity_type import entity_type_already_defined
+from mangrove.errors.MangroveException import MangroveException, DataObjectAlreadyExists, \
+    EntityTypeDoesNotExistsException, FailedToSaveDataObject
+from mangrove.form_model.form_model import get_form_model_by_code
+from mangrove.form_model.form_submission import FormSubmissionFactory
+from mangrove.transport.contract.response import Response, create_response_from_form_submission
+from mangrove.transport.player.handler import handlers, handler_factory
+from mangrove.transport.work_flow import RegistrationWorkFlow, _set_short_codes
+
+IMPORT_BATCH_SIZE = 500
+IMPORT_PARALLELISM = 4
+
+logger = logging.getLogger('mangrove.import')
+
+
+class ImportReport(object):
+    def __init__(self, responses, elapsed_seconds):
+        self.responses = responses
+        self.elapsed_seconds = elapsed_seconds
+
+    @property
+    def rows(self):
+        return len(self.responses)
+
+    @property
+    def successful_rows(self):
+        return len([response for response in self.responses if response.success])
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed_seconds if self.elapsed_seconds else float(self.rows)
+
+
+class BulkImportService(object):
+    """
+    Imports a stream of parsed (form_code, values) registration rows, such as the parsers' iter_parse output.
+
+    Rows are handled in batches: missing short codes are allocated per entity type for the whole batch,
+    rows are validated on a pool of `parallelism` workers, existing short codes are checked with one query
+    and the new entities and data records are written with one bulk update. Every row gets its own Response,
+    in input order. Forms with a dedicated handler (e.g. deletion) and non registration forms go through the
+    regular one-row-at-a-time path.
+    """
+
+    def __init__(self, dbm, location_tree=None, parallelism=IMPORT_PARALLELISM, batch_size=IMPORT_BATCH_SIZE):
+        assert parallelism > 0 and batch_size > 0
+        self.dbm = dbm
+        self.location_tree = location_tree
+        self.parallelism = parallelism
+        self.batch_size = batch_size
+        self._form_models = {}
+        self._defined_entity_types = {}
+
+    def import_rows(self, rows):
+        start = time.time()
+        responses = []
+        pool = ThreadPool(self.parallelism) if self.parallelism > 1 else None
+        try:
+            rows = iter(rows)
+            batch = list(islice(rows, self.batch_size))
+            while batch:
+                responses.extend(self._import_batch(batch, pool))
+                batch = list(islice(rows, self.batch_size))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        report = ImportReport(responses, time.time() - start)
+        logger.info("imported %s rows (%s saved) in %.2f seconds, %.1f rows/sec" %
+                    (report.rows, report.successful_rows, report.elapsed_seconds, report.rows_per_second))
+        return report
+
+    def _import_batch(self, batch, pool):
+        responses = [None] * len(batch)
+        rows_by_form_code = {}
+        for index, (form_code, values) in enumerate(batch):
+            try:
+                self._form_model(form_code)
+            except MangroveException as e:
+                responses[index] = Response(errors=e.message, exception=e)
+                continue
+            rows_by_form_code.setdefault(form_code, []).append((index, values))
+
+        pending = []
+        for form_code, rows in rows_by_form_code.items():
+            form_model = self._form_model(form_code)
+            if form_model.form_code in handlers or not form_model.is_entity_registration_form():
+                for index, values in rows:
+                    responses[index] = self._submit(form_model, values)
+                continue
+            for index, form_submission_or_error in self._prepare(form_model, rows, pool):
+                if isinstance(form_submission_or_error, Response):
+                    responses[index] = form_submission_or_error
+                else:
+                    pending.append((index, form_submission_or_error))
+        documents_by_row = self._build_documents(pending, responses)
+
+        failures = self._save([document for index in sorted(documents_by_row) for document in documents_by_row[index]])
+        for index, form_submission in pending:
+            if responses[index] is not None:
+                continue
+            failed = [failures[document.id] for document in documents_by_row.get(index, []) if document.id in failures]
+            if failed:
+                form_submission.data_record_id = None
+                error = FailedToSaveDataObject(str(failed[0]))
+                responses[index] = Response(errors=error.message, exception=error)
+            else:
+                responses[index] = create_response_from_form_submission([], form_submission)
+        return responses
+
+    def _form_model(self, form_code):
+        if form_code not in self._form_models:
+            self._form_models[form_code] = get_form_model_by_code(self.dbm, form_code)
+        return self._form_models[form_code]
+
+    def _submit(self, form_model, values):
+        try:
+            values = RegistrationWorkFlow(self.dbm, form_model, self.location_tree).process(values)
+            form_model.bind(values)
+            cleaned_data, errors = form_model.validate_submission(values=values)
+            return handler_factory(self.dbm, form_model).handle(form_model, cleaned_data, errors, [],
+                                                                self.location_tree)
+        except MangroveException as e:
+            return Response(errors=e.message, exception=e)
+
+    def _prepare(self, form_model, rows, pool):
+        prepared = []
+        processed_rows = []
+        failures = _set_short_codes(self.dbm, form_model, [values for index, values in rows])
+        for position, (index, values) in enumerate(rows):
+            if position in failures:
+                prepared.append((index, Response(errors=failures[position].message, exception=failures[position])))
+                continue
+            try:
+                processed_rows.append((index, RegistrationWorkFlow(self.dbm, form_model, self.location_tree)
+                                       .process(values)))
+            except MangroveException as e:
+                prepared.append((index, Response(errors=e.message, exception=e)))
+
+        chunks = [processed_rows[start::self.parallelism] for start in range(self.parallelism)]
+        chunks = [(form_model, chunk) for chunk in chunks if chunk]
+        results = pool.map(self._validate, chunks) if pool is not None else map(self._validate, chunks)
+        factory = FormSubmissionFactory()
+        for chunk_results in results:
+            for index, cleaned_data, errors in chunk_results:
+                prepared.append((index, factory.get_form_submission(form_model, cleaned_data, errors,
+                                                                     location_tree=self.location_tree)))
+        return prepared
+
+    def _validate(self, form_model_and_rows):
+        form_model, rows = form_model_and_rows
+        # Each worker binds answers on its own copy of the questionnaire
+        form_model = form_model.copy_with_document(self.dbm, form_model._doc._data)
+        results = []
+        for index, values in rows:
+            form_model.bind(values)
+            cleaned_data, errors = form_model.validate_submission(values=values)
+            results.append((index, cleaned_data, errors))
+        return results
+
+    def _build_documents(self, pending, responses):
+        valid = [(index, form_submission) for index, form_submission in pending if form_submission.is_valid]
+        short_codes_by_type = {}
+        for index, form_submission in valid:
+            short_codes_by_type.setdefault(tuple(form_submission.entity_type), []).append(form_submission.short_code)
+        in_use = {}
+        for entity_type, short_codes in short_codes_by_type.items():
+            in_use[entity_type] = set(get_short_codes_in_use(self.dbm, list(entity_type), list(set(short_codes))))
+
+        documents_by_row = {}
+        for index, form_submission in valid:
+            entity_type = tuple(form_submission.entity_type)
+            try:
+                if not self._is_defined(list(entity_type)):
+                    raise EntityTypeDoesNotExistsException(list(entity_type))
+                if form_submission.short_code in in_use[entity_type]:
+                    raise DataObjectAlreadyExists(entity_type[0].capitalize(), "Unique ID Number",
+                                                  form_submission.short_code)
+                new_entity, data_record_doc = form_submission.new_entity_documents(self.dbm)
+            except MangroveException as e:
+                responses[index] = Response(errors=e.message, exception=e)
+                continue
+            in_use[entity_type].add(form_submission.short_code)
+            documents_by_row[index] = [new_entity._doc, data_record_doc]
+        return documents_by_row
+
+    def _is_defined(self, entity_type):
+        key = tuple(entity_type)
+        if key not in self._defined_entity_types:
+            self._defined_entity_types[key] = entity_type_already_defined(self.dbm, entity_type)
+        return self._defined_entity_types[key]
+
+    def _save(self, documents):
+        if not documents:
+            return {}
+        results = self.dbm._save_documents(documents, process_post_update=True)
+        return dict((document_id, result) for success, document_id, result in results if not success)
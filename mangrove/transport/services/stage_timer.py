@@ -0,0 +1,77 @@
+import random
+from contextlib import contextmanager
+
+from mangrove.datastore import settings
+from mangrove.datastore.metrics import measure
+
+# the metrics operation stage timings are recorded under, next to the database calls' 'view', 'save' and so on
+STAGE = 'stage'
+
+
+class _NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class NullStageTimer(object):
+    """
+    The timer used while stage timing is off: its spans do nothing.
+    """
+    sampled = False
+    timings = None
+
+    def stage(self, name):
+        return _NO_SPAN
+
+    def attach(self, response):
+        pass
+
+
+NULL_STAGE_TIMER = NullStageTimer()
+
+
+class StageTimer(object):
+    """
+    Times the stages of handling one submission, e.g. 'parse', 'validate' or 'feed'. Every stage is recorded in
+    metrics as a ('stage', name) Measurement, so the sink aggregates a latency histogram per stage. A sampled
+    timer also keeps the (stage, seconds) pairs, in order, for the Response.
+    """
+
+    def __init__(self, metrics, sampled=False):
+        self.metrics = metrics
+        self.sampled = sampled
+        self.timings = []
+
+    @contextmanager
+    def stage(self, name):
+        measurement = None
+        try:
+            with measure(self.metrics, STAGE, name) as measurement:
+                yield measurement
+        finally:
+            if self.sampled and measurement is not None:
+                self.timings.append((name, measurement.seconds))
+
+    def attach(self, response):
+        """
+        Gives a sampled request's response its stage timings. Stages which end after this are added too.
+        """
+        if self.sampled:
+            response.stage_timings = self.timings
+
+
+def stage_timer(dbm):
+    """
+    Returns the timer for one submission to dbm: NULL_STAGE_TIMER unless settings.STAGE_TIMING is on. Stages are
+    recorded in dbm's metrics, and settings.STAGE_TIMING_SAMPLE_RATE of the requests get their timings attached
+    to their Response.
+    """
+    if not settings.STAGE_TIMING:
+        return NULL_STAGE_TIMER
+    return StageTimer(dbm.metrics, sampled=random.random() < settings.STAGE_TIMING_SAMPLE_RATE)
@@ -1,68 +1,106 @@
 from copy import copy
 import traceback
-from mangrove.datastore.entity import by_short_code
+from mangrove.datastore.entity import by_short_code, EntityResolver
 from mangrove.feeds.enriched_survey_response import EnrichedSurveyResponseBuilder
 from mangrove.form_model.forms import EditSurveyResponseForm
 from mangrove.form_model.form_submission import DataFormSubmission
-from mangrove.errors.MangroveException import MangroveException, FormModelDoesNotExistsException
+from mangrove.errors.MangroveException import MangroveException, FormModelDoesNotExistsException, \
+    DataObjectNotFound, FailedToSaveDataObject
 from mangrove.form_model.form_model import get_form_model_by_code, FormModel
 from mangrove.form_model.project import Project, get_active_form_model, check_if_form_code_is_poll
 from mangrove.transport.contract.response import Response
 from mangrove.transport.repository.reporters import REPORTER_ENTITY_TYPE
 from mangrove.transport.repository.survey_responses import SurveyResponse
+from mangrove.transport.services.stage_timer import NULL_STAGE_TIMER
+
+
+class SurveySubmission(object):
+    """
+    One survey answer to be saved by SurveyResponseService.save_surveys. reporter is the data sender's Contact,
+    or None when the sender is not registered.
+    """
+
+    def __init__(self, form_model, values, transport_info, reporter=None, reporter_id=None, reporter_names=None,
+                 response=None):
+        self.form_model = form_model
+        self.values = values
+        self.transport_info = transport_info
+        self.reporter = reporter
+        self.reporter_id = reporter_id if reporter_id is not None or reporter is None else reporter.short_code
+        self.reporter_names = reporter_names
+        self.response = response
 
 
 class SurveyResponseService(object):
-    def __init__(self, dbm, logger=None, feeds_dbm=None, admin_id=None, response=None):
+    def __init__(self, dbm, logger=None, feeds_dbm=None, admin_id=None, response=None, feed_writer=None,
+                 stage_timer=None):
         self.dbm = dbm
         self.logger = logger
         self.feeds_dbm = feeds_dbm
+        self.feed_writer = feed_writer
         self.admin_id = admin_id
         self.response = response
+        self.stage_timer = stage_timer if stage_timer is not None else NULL_STAGE_TIMER
 
     def save_survey(self, form_code, values, reporter_names, transport_info, reporter_id,
-                    additional_feed_dictionary=None, translation_processor=None):
-        try:
-            form_model = get_form_model_by_code(self.dbm, form_code)
-        except FormModelDoesNotExistsException:
-            form_model = get_active_form_model(self.dbm, form_code)
+                    additional_feed_dictionary=None, translation_processor=None, form_model=None):
+        timer = self.stage_timer
+        if form_model is None:
+            with timer.stage('form_model'):
+                try:
+                    form_model = get_form_model_by_code(self.dbm, form_code)
+                except FormModelDoesNotExistsException:
+                    form_model = get_active_form_model(self.dbm, form_code)
 
-        #TODO : validate_submission should use form_model's bound values
-        cleaned_data, errors = form_model.validate_submission(values=values)
-        form_model.bind(form_model.remove_invalid_meta_answers(values))
+        entity_resolver = EntityResolver(self.dbm)
+        with timer.stage('validate'):
+            entity_resolver.prefetch(form_model.unique_id_answers(values))
+            #TODO : validate_submission should use form_model's bound values
+            cleaned_data, errors = form_model.validate_submission(values=values, entity_resolver=entity_resolver)
+        with timer.stage('bind'):
+            form_model.bind(form_model.remove_invalid_meta_answers(values))
 
-        if reporter_id is not None:
-            survey_response = self.create_survey_response_from_known_datasender(transport_info, form_model,
-                                                                            form_model.bound_values(),
-                                                                            reporter_id, self.response)
-        else:
-            survey_response = self.create_survey_response_from_unknown_datasender(transport_info, form_model.id,
-                                                                            form_model.bound_values(), self.response)
+        with timer.stage('reporter'):
+            if reporter_id is not None:
+                survey_response = self.create_survey_response_from_known_datasender(transport_info, form_model,
+                                                                                form_model.bound_values(),
+                                                                                reporter_id, self.response)
+            else:
+                survey_response = self.create_survey_response_from_unknown_datasender(transport_info, form_model.id,
+                                                                                form_model.bound_values(),
+                                                                                self.response)
 
         survey_response.set_form(form_model)
 
-        form_submission = DataFormSubmission(form_model, cleaned_data, errors)
+        form_submission = DataFormSubmission(form_model, cleaned_data, errors, entity_resolver=entity_resolver)
         feed_create_errors = None
         try:
             if form_submission.is_valid:
-                form_submission.save(self.dbm)
+                with timer.stage('data_record'):
+                    form_submission.save(self.dbm)
 
         except MangroveException as exception:
             errors = exception.message
             raise
         finally:
-            if translation_processor is not None:
-                translated_errors = translation_processor(form_model, self.response).process()
-                survey_response.set_status(translated_errors)
-            else:
-                survey_response.set_status(errors)
-            survey_response.create(form_submission.data_record_id)
+            with timer.stage('survey_response'):
+                if translation_processor is not None:
+                    translated_errors = translation_processor(form_model, self.response).process()
+                    survey_response.set_status(translated_errors)
+                else:
+                    survey_response.set_status(errors)
+                survey_response.create(form_submission.data_record_id)
             try:
-                if self.feeds_dbm:
-                    builder = EnrichedSurveyResponseBuilder(self.dbm, survey_response, form_model,
-                                                            additional_feed_dictionary, ds_mobile_number=transport_info.source)
-                    event_document = builder.feed_document()
-                    self.feeds_dbm._save_document(event_document)
+                with timer.stage('feed'):
+                    if self.feed_writer:
+                        self.feed_writer.submit(survey_response, additional_feed_dictionary, transport_info.source)
+                    elif self.feeds_dbm:
+                        builder = EnrichedSurveyResponseBuilder(self.dbm, survey_response, form_model,
+                                                                additional_feed_dictionary,
+                                                                ds_mobile_number=transport_info.source,
+                                                                entity_resolver=entity_resolver)
+                        event_document = builder.feed_document()
+                        self.feeds_dbm._save_document(event_document)
             except Exception as e:
                 feed_create_errors = 'error while creating feed doc for %s \n' % survey_response.id
                 feed_create_errors += e.message + '\n'
@@ -74,31 +112,191 @@ class SurveyResponseService(object):
             errors = self.response.errors
             success = False
 
-        return Response(reporter_names,  survey_response.uuid, success,
-                        errors, form_submission.data_record_id, form_submission.short_code,
-                        form_submission.cleaned_data, form_submission.is_registration, form_submission.entity_type,
-                        form_submission.form_model.form_code, feed_create_errors, created=survey_response.created,
-                        version=survey_response.version)
+        response = Response(reporter_names,  survey_response.uuid, success,
+                            errors, form_submission.data_record_id, form_submission.short_code,
+                            form_submission.cleaned_data, form_submission.is_registration, form_submission.entity_type,
+                            form_submission.form_model.form_code, feed_create_errors, created=survey_response.created,
+                            version=survey_response.version)
+        timer.attach(response)
+        return response
+
+    def save_surveys(self, submissions, additional_feed_dictionary=None, translation_processor=None):
+        """
+        Saves many SurveySubmissions at once. All the subjects they answer are fetched with one by_short_codes
+        query, all data records and survey responses are written with one bulk update and all feed documents with
+        another. Returns one Response per submission, in the same order; the stages are timed for the batch.
+        Unlike save_survey, a submission which fails gets the error in its Response rather than raising it, so
+        the rest of the batch is still saved.
+        """
+        timer = self.stage_timer
+        entity_resolver = EntityResolver(self.dbm)
+        responses = [None] * len(submissions)
+        accepted = []
+        pending = []
+        with timer.stage('validate'):
+            entity_resolver.prefetch([answer for submission in submissions
+                                      for answer in submission.form_model.unique_id_answers(submission.values)])
+            for index, submission in enumerate(submissions):
+                try:
+                    pending.append(self._prepare_survey(submission, entity_resolver))
+                except MangroveException as e:
+                    responses[index] = Response(errors=e.message, exception=e)
+                    continue
+                accepted.append(index)
+        saved = self._save_prepared_surveys([submissions[index] for index in accepted], pending,
+                                            additional_feed_dictionary, translation_processor, entity_resolver)
+        for index, response in zip(accepted, saved):
+            responses[index] = response
+        return responses
+
+    def _save_prepared_surveys(self, submissions, pending, additional_feed_dictionary, translation_processor,
+                               entity_resolver):
+        timer = self.stage_timer
+        documents = []
+        for index, (survey_response, form_submission, errors) in enumerate(pending):
+            submission = submissions[index]
+            if form_submission.is_valid:
+                errors = self._add_data_record(form_submission, entity_resolver, documents) or errors
+            if translation_processor is not None:
+                survey_response.set_status(translation_processor(submission.form_model, submission.response).process())
+            else:
+                survey_response.set_status(errors)
+            survey_response.data_record_id = form_submission.data_record_id
+            documents.append(survey_response._doc)
+            pending[index] = (survey_response, form_submission, errors)
+
+        with timer.stage('save'):
+            save_failures = self._failed_saves(self.dbm, documents)
+        with timer.stage('feed'):
+            feed_errors = self._save_feed_documents(pending, save_failures, submissions, additional_feed_dictionary,
+                                                    entity_resolver)
+
+        responses = []
+        for index, (survey_response, form_submission, errors) in enumerate(pending):
+            submission = submissions[index]
+            for document_id in [form_submission.data_record_id, survey_response.id]:
+                if document_id in save_failures:
+                    form_submission.data_record_id = None
+                    errors = FailedToSaveDataObject(str(save_failures[document_id])).message
+            if submission.response is None:
+                success = form_submission.saved
+            else:
+                errors = submission.response.errors
+                success = False
+            response = Response(submission.reporter_names, survey_response.uuid, success,
+                                errors, form_submission.data_record_id, form_submission.short_code,
+                                form_submission.cleaned_data, form_submission.is_registration,
+                                form_submission.entity_type, form_submission.form_model.form_code,
+                                feed_errors.get(survey_response.id), created=survey_response.created,
+                                version=survey_response.version)
+            timer.attach(response)
+            responses.append(response)
+        return responses
+
+    def _prepare_survey(self, submission, entity_resolver):
+        form_model = submission.form_model
+        cleaned_data, errors = form_model.validate_submission(values=submission.values, entity_resolver=entity_resolver)
+        form_model.bind(form_model.remove_invalid_meta_answers(submission.values))
+        if submission.reporter is not None:
+            survey_response = self._create_survey_response_for_reporter(submission.transport_info, form_model,
+                                                                         form_model.bound_values(),
+                                                                         submission.reporter, submission.reporter_id,
+                                                                         submission.response)
+        else:
+            survey_response = self.create_survey_response_from_unknown_datasender(submission.transport_info,
+                                                                                  form_model.id,
+                                                                                  form_model.bound_values(),
+                                                                                  submission.response)
+        survey_response.set_form(form_model)
+        form_submission = DataFormSubmission(form_model, cleaned_data, errors, entity_resolver=entity_resolver)
+        return survey_response, form_submission, errors
+
+    def _add_data_record(self, form_submission, entity_resolver, documents):
+        """
+        Adds the data record of a valid submission to documents. Returns the error message when the subject it
+        answers for no longer exists: save_survey raises DataObjectNotFound then, but in a batch only the
+        submission is failed, with its survey response saved under that error as save_survey does.
+        """
+        entity_doc = None
+        if form_submission.short_code:
+            try:
+                entity_doc = entity_resolver.get_by_short_code(form_submission.short_code,
+                                                               form_submission.entity_type)._doc
+            except DataObjectNotFound as e:
+                return e.message
+        data_record_doc = form_submission.data_record_document(entity_doc)
+        form_submission.data_record_id = data_record_doc.id
+        documents.append(data_record_doc)
+        return None
+
+    def _failed_saves(self, dbm, documents):
+        if not documents:
+            return {}
+        results = dbm._save_documents(documents, process_post_update=True)
+        return dict((document_id, result) for success, document_id, result in results if not success)
+
+    def _save_feed_documents(self, pending, save_failures, submissions, additional_feed_dictionary, entity_resolver):
+        feed_errors = {}
+        if self.feed_writer:
+            for index, (survey_response, form_submission, errors) in enumerate(pending):
+                if survey_response.id not in save_failures:
+                    self.feed_writer.submit(survey_response, additional_feed_dictionary,
+                                            submissions[index].transport_info.source)
+            return feed_errors
+        if not self.feeds_dbm:
+            return feed_errors
+        feed_documents = []
+        for index, (survey_response, form_submission, errors) in enumerate(pending):
+            if survey_response.id in save_failures:
+                continue
+            try:
+                builder = EnrichedSurveyResponseBuilder(self.dbm, survey_response, submissions[index].form_model,
+                                                        additional_feed_dictionary,
+                                                        ds_mobile_number=submissions[index].transport_info.source,
+                                                        entity_resolver=entity_resolver)
+                feed_documents.append(builder.feed_document())
+            except Exception as e:
+                feed_errors[survey_response.id] = self._feed_error_message(survey_response.id, e)
+        for document_id, result in self._failed_saves(self.feeds_dbm, feed_documents).items():
+            feed_errors[document_id] = 'error while creating feed doc for %s \n%s\n' % (document_id, result)
+        return feed_errors
+
+    def _feed_error_message(self, survey_response_id, exception):
+        feed_create_errors = 'error while creating feed doc for %s \n' % survey_response_id
+        feed_create_errors += exception.message + '\n'
+        feed_create_errors += traceback.format_exc()
+        return feed_create_errors
 
     def edit_survey(self, form_code, values, reporter_names,  survey_response,
                     additional_feed_dictionary=None, owner_id=None):
-        form_model = get_form_model_by_code(self.dbm, form_code)
+        timer = self.stage_timer
+        with timer.stage('form_model'):
+            form_model = get_form_model_by_code(self.dbm, form_code)
+        entity_resolver = EntityResolver(self.dbm)
 
-        form = EditSurveyResponseForm(self.dbm, survey_response, form_model, values)
+        with timer.stage('validate'):
+            entity_resolver.prefetch(form_model.unique_id_answers(values))
+            form = EditSurveyResponseForm(self.dbm, survey_response, form_model, values,
+                                          entity_resolver=entity_resolver)
         try:
             if form.is_valid:
-                if owner_id:
-                    reporter = by_short_code(self.dbm, owner_id, REPORTER_ENTITY_TYPE)
-                    survey_response.owner_uid = reporter.id
-                survey_response.modified_by = self.admin_id or owner_id
-                survey_response = form.save()
+                with timer.stage('survey_response'):
+                    if owner_id:
+                        reporter = by_short_code(self.dbm, owner_id, REPORTER_ENTITY_TYPE)
+                        survey_response.owner_uid = reporter.id
+                    survey_response.modified_by = self.admin_id or owner_id
+                    survey_response = form.save()
             try:
                 feed_create_errors = None
-                if self.feeds_dbm:
-                    builder = EnrichedSurveyResponseBuilder(self.dbm, survey_response, form_model,
-                                                            additional_feed_dictionary)
-                    event_document = builder.update_event_document(self.feeds_dbm)
-                    self.feeds_dbm._save_document(event_document)
+                with timer.stage('feed'):
+                    if self.feed_writer:
+                        self.feed_writer.submit(survey_response, additional_feed_dictionary)
+                    elif self.feeds_dbm:
+                        builder = EnrichedSurveyResponseBuilder(self.dbm, survey_response, form_model,
+                                                                additional_feed_dictionary,
+                                                                entity_resolver=entity_resolver)
+                        event_document = builder.update_event_document(self.feeds_dbm)
+                        self.feeds_dbm._save_document(event_document)
             except Exception as e:
                 feed_create_errors = 'error while editing feed doc for %s \n' % survey_response.id
                 feed_create_errors += e.message + '\n'
@@ -106,18 +304,22 @@ class SurveyResponseService(object):
 
         except MangroveException as exception:
             raise
-        return Response(reporter_names,  survey_response.uuid, form.saved,
-                        form.errors, form.data_record_id, None,
-                        form._cleaned_data, form.is_registration, form.entity_type,
-                        form.form_model.form_code, feed_create_errors, created=survey_response.created,
-                        version=survey_response.version)
+        response = Response(reporter_names,  survey_response.uuid, form.saved,
+                            form.errors, form.data_record_id, None,
+                            form._cleaned_data, form.is_registration, form.entity_type,
+                            form.form_model.form_code, feed_create_errors, created=survey_response.created,
+                            version=survey_response.version)
+        timer.attach(response)
+        return response
 
     def delete_survey(self, survey_response, additional_details):
         feed_delete_errors = None
         try:
             survey_response.void()
             form_model = FormModel.get(self.dbm,survey_response.form_model_id)
-            if self.feeds_dbm:
+            if self.feed_writer:
+                self.feed_writer.submit(survey_response, additional_details)
+            elif self.feeds_dbm:
                 feed_delete_errors = EnrichedSurveyResponseBuilder(self.dbm, survey_response, form_model,
                                                                    additional_details).delete_feed_document(
                     self.feeds_dbm)
@@ -128,8 +330,12 @@ class SurveyResponseService(object):
 
     def create_survey_response_from_known_datasender(self, transport_info, form_model, values, reporter_id, response):
         reporter = by_short_code(self.dbm, reporter_id.lower(), REPORTER_ENTITY_TYPE)
-        owner_uid = reporter.id
-        survey_response = SurveyResponse(self.dbm, transport_info, form_model.id, values=values, owner_uid=owner_uid,
+        return self._create_survey_response_for_reporter(transport_info, form_model, values, reporter, reporter_id,
+                                                         response)
+
+    def _create_survey_response_for_reporter(self, transport_info, form_model, values, reporter, reporter_id,
+                                             response):
+        survey_response = SurveyResponse(self.dbm, transport_info, form_model.id, values=values, owner_uid=reporter.id,
                                          admin_id=self.admin_id or reporter_id, response=response)
         project = Project.from_form_model(form_model)
         if reporter_id not in project.data_senders:
@@ -1,9 +1,9 @@
 import unittest
 from mock import Mock, patch
-from mangrove.errors.MangroveException import DataObjectNotFound
 from mangrove.form_model.form_submission import FormSubmission
 from mangrove.form_model.field import HierarchyField, GeoCodeField, ShortCodeField
 from mangrove.form_model.form_model import LOCATION_TYPE_FIELD_NAME
+from mangrove.datastore.short_code_counter import reset_short_code_allocators
 from mangrove.datastore.database import DatabaseManager
 from mangrove.datastore.entity import Entity
 from mangrove.form_model.field import TextField
@@ -18,15 +18,21 @@ class TestRegistrationWorkFlow(unittest.TestCase):
 
     def setUp(self):
         self.dbm = Mock(spec=DatabaseManager)
+        self.dbm.url = 'http://localhost:5984/'
+        self.dbm.database_name = 'test_facade'
+        self.dbm._load_document.return_value = None
+        self.dbm._save_documents.return_value = [(True, 'short_code_counter_clinic', 'rev')]
         self.form_model_mock = Mock(spec=FormModel)
         self.form_model_mock.get_field_by_name = self._location_field
-        self.get_entity_count = patch('mangrove.transport.work_flow.get_entity_count_for_type', new=dummy_get_entity_count_for_type,spec=True)
-        self.get_by_short_code_include_voided = patch('mangrove.transport.work_flow.get_by_short_code_include_voided', new=dummy_get_by_short_code_include_voided)
-        self.get_by_short_code_include_voided.start()
+        self.get_entity_count = patch('mangrove.datastore.short_code_counter.get_entity_count_for_type', new=dummy_get_entity_count_for_type,spec=True)
+        self.get_short_codes_in_use = patch('mangrove.datastore.short_code_counter.get_short_codes_in_use', new=dummy_get_short_codes_in_use)
+        self.get_short_codes_in_use.start()
         self.get_entity_count.start()
 
     def tearDown(self):
         self.get_entity_count.stop()
+        self.get_short_codes_in_use.stop()
+        reset_short_code_allocators()
 
     def test_should_generate_default_code_if_short_code_is_empty(self):
         registration_work_flow = RegistrationWorkFlow(self.dbm, self.form_model_mock, DummyLocationTree())
@@ -59,8 +65,8 @@ class TestRegistrationWorkFlow(unittest.TestCase):
         geo_code_field.code='g'
         return geo_code_field
 
-def dummy_get_by_short_code_include_voided(dbm,short_code,entity_type):
-    raise DataObjectNotFound("Entity","Not found",short_code)
+def dummy_get_short_codes_in_use(dbm, entity_type, short_codes):
+    return set()
 
 def dummy_get_entity_count_for_type(dbm, entity_type):
     return 0
@@ -1,43 +1,53 @@
 import unittest
 from mock import Mock, patch
-from mangrove.datastore.entity import Entity
-from mangrove.errors.MangroveException import DataObjectNotFound
-from mangrove.transport.work_flow import _generate_short_code
+from mangrove.datastore.short_code_counter import reset_short_code_allocators
+from mangrove.datastore.database import DatabaseManager
+from mangrove.transport.work_flow import _generate_short_code, _generate_short_codes
 
 
 class TestWorkFlow(unittest.TestCase):
+    def setUp(self):
+        self.dbm = Mock(spec=DatabaseManager)
+        self.dbm.url = 'http://localhost:5984/'
+        self.dbm.database_name = 'test_work_flow'
+        self.dbm._load_document.return_value = None
+        self.dbm._save_documents.side_effect = lambda documents: [(True, documents[0].id, 'rev')]
+
+    def tearDown(self):
+        reset_short_code_allocators()
+
     def test_should_create_entity_short_codes(self):
-        with patch("mangrove.transport.work_flow.get_entity_count_for_type") as current_count:
-            with patch("mangrove.transport.work_flow.get_by_short_code_include_voided") as if_short_code_exists:
+        with patch("mangrove.datastore.short_code_counter.get_entity_count_for_type") as current_count:
+            with patch("mangrove.datastore.short_code_counter.get_short_codes_in_use") as short_codes_in_use:
                 current_count.return_value = 1
-                if_short_code_exists.side_effect = DataObjectNotFound('entity','short_code','som2')
-                code = _generate_short_code(Mock, 'some_type')
+                short_codes_in_use.return_value = set()
+                code = _generate_short_code(self.dbm, 'some_type')
                 self.assertEquals(code, 'som2')
 
 
     def test_should_create_entity_short_code_from_entity_type_name_having_spaces_in_first_three_characters(self):
-        with patch("mangrove.transport.work_flow.get_entity_count_for_type") as current_count:
-            with patch("mangrove.transport.work_flow.get_by_short_code_include_voided") as if_short_code_exists:
+        with patch("mangrove.datastore.short_code_counter.get_entity_count_for_type") as current_count:
+            with patch("mangrove.datastore.short_code_counter.get_short_codes_in_use") as short_codes_in_use:
                 current_count.return_value = 1
-                if_short_code_exists.side_effect = DataObjectNotFound('entity','short_code','som2')
-                code = _generate_short_code(Mock, 'so m')
+                short_codes_in_use.return_value = set()
+                code = _generate_short_code(self.dbm, 'so m')
                 self.assertEquals(code, 'som2')
 
     def test_should_not_duplicate_entity_short_codes(self):
-        side_effect_values = [Mock(spec=Entity), DataObjectNotFound('entity','short_code','som3')]
-
-        def side_effect(*args):
-            result = side_effect_values.pop(0)
-            if isinstance(result, Exception):
-                raise result
-            return result
-
-        with patch("mangrove.transport.work_flow.get_entity_count_for_type") as current_count:
-            with patch("mangrove.transport.work_flow.get_by_short_code_include_voided") as if_short_code_exists:
+        with patch("mangrove.datastore.short_code_counter.get_entity_count_for_type") as current_count:
+            with patch("mangrove.datastore.short_code_counter.get_short_codes_in_use") as short_codes_in_use:
                 current_count.return_value = 1
-                if_short_code_exists.side_effect = side_effect
-                code = _generate_short_code(Mock, 'so m')
+                short_codes_in_use.return_value = set(['som2'])
+                code = _generate_short_code(self.dbm, 'so m')
                 self.assertEquals(code, 'som3')
 
-
-
+    def test_should_allocate_a_block_of_short_codes_skipping_used_ones(self):
+        with patch("mangrove.datastore.short_code_counter.get_entity_count_for_type") as current_count:
+            with patch("mangrove.datastore.short_code_counter.get_short_codes_in_use") as short_codes_in_use:
+                current_count.return_value = 1
+                short_codes_in_use.return_value = set(['cli3'])
+                codes = _generate_short_codes(self.dbm, 'clinic', 3)
+                self.assertEquals(['cli2', 'cli4', 'cli5'], codes)
+                self.assertEquals(['cli6'], _generate_short_codes(self.dbm, 'clinic', 1))
+                self.assertEquals(3, short_codes_in_use.call_count)
+                self.assertEquals(1, self.dbm._save_documents.call_count)
@@ -1,9 +1,8 @@
 
-from mangrove.datastore.entity import get_by_short_code_include_voided
 from mangrove.form_model.form_model import LOCATION_TYPE_FIELD_NAME, GEO_CODE_FIELD_NAME
 from mangrove.form_model.form_model import GLOBAL_REGISTRATION_FORM_ENTITY_TYPE
-from mangrove.datastore.queries import get_entity_count_for_type
-from mangrove.errors.MangroveException import GeoCodeFormatException, MangroveException, DataObjectNotFound
+from mangrove.datastore.short_code_counter import get_short_code_allocator
+from mangrove.errors.MangroveException import GeoCodeFormatException, MangroveException
 from mangrove.form_model.form_model import ENTITY_TYPE_FIELD_CODE
 from mangrove.form_model.location import Location
 from mangrove.utils.types import is_empty, is_not_empty
@@ -80,24 +79,49 @@ class RegistrationWorkFlow(object):
 
 def _set_short_code(dbm, form_model, values):
     entity_q_code = form_model.entity_questions[0].code
+    values[entity_q_code] = _generate_short_code(dbm, _short_code_entity_type(form_model, values))
+
+
+def _set_short_codes(dbm, form_model, values_list):
+    """
+    Fills in the missing short codes of many registrations, allocating the codes of each entity type as one block.
+    Returns {position in values_list: MangroveException} for the registrations which could not get a code; the
+    others are not affected by them.
+    """
+    entity_q_code = form_model.entity_questions[0].code
+    failures = {}
+    missing = {}
+    for position, values in enumerate(values_list):
+        if is_empty(form_model.get_short_code(values)):
+            try:
+                entity_type = _short_code_entity_type(form_model, values)
+            except MangroveException as e:
+                failures[position] = e
+                continue
+            missing.setdefault(entity_type, []).append((position, values))
+    for entity_type, rows in missing.items():
+        try:
+            short_codes = _generate_short_codes(dbm, entity_type, len(rows))
+        except MangroveException as e:
+            failures.update((position, e) for position, values in rows)
+            continue
+        for (position, values), short_code in zip(rows, short_codes):
+            values[entity_q_code] = short_code
+    return failures
+
+
+def _short_code_entity_type(form_model, values):
     try:
         if GLOBAL_REGISTRATION_FORM_ENTITY_TYPE in form_model.entity_type:
-            values[entity_q_code] = _generate_short_code(dbm, values[ENTITY_TYPE_FIELD_CODE].lower())
-        else:
-            values[entity_q_code] = _generate_short_code(dbm, form_model.entity_type[0])
+            return values[ENTITY_TYPE_FIELD_CODE].lower()
+        return form_model.entity_type[0]
     except KeyError:
         raise MangroveException(ENTITY_TYPE_FIELD_CODE + " should be present")
 
 
 def _generate_short_code(dbm, entity_type):
-    current_count = get_entity_count_for_type(dbm, entity_type.lower())
-    entity_type_prefix = entity_type.lower().replace(" ", "")[:3] + "%s"
-    offset = 1
-    while True:
-        short_code = entity_type_prefix % (current_count + offset)
-        try:
-            entity = get_by_short_code_include_voided(dbm, short_code, [entity_type])
-            if entity:
-                offset += 1
-        except DataObjectNotFound as ignore:
-            return short_code
+    return _generate_short_codes(dbm, entity_type, 1)[0]
+
+
+def _generate_short_codes(dbm, entity_type, count):
+    return get_short_code_allocator(dbm, entity_type).allocate(count)
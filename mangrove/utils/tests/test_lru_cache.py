@@ -0,0 +1,26 @@
+import unittest
+from mangrove.utils.lru_cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_should_evict_least_recently_used_item(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+
+    def test_should_delete_matching_keys(self):
+        cache = LRUCache(5)
+        cache.set(('db_cli001', '1-a'), 1)
+        cache.set(('db_cli001', '2-b'), 2)
+        cache.set(('db_cli002', '1-a'), 3)
+
+        cache.delete_matching(lambda key: key[0] == 'db_cli001')
+
+        self.assertEqual(1, len(cache))
+        self.assertIn(('db_cli002', '1-a'), cache)